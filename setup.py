@@ -30,6 +30,7 @@ setup(
     include_package_data=True,
     package_data={
         '': ['requirements.txt', 'requirements.dev.txt'],
+        'starnavi': ['moderation_lexicon.json'],
     },
     data_files=[
         ('', ['requirements.txt', 'requirements.dev.txt']),
@@ -50,6 +51,9 @@ setup(
     entry_points={
         'console_scripts': [
             'run_alembic=starnavi.scripts.run_alembic:main',
+            'backfill_daily_stats=starnavi.scripts.backfill_daily_stats:main',
+            'bulk_import=starnavi.scripts.bulk_import:main',
+            'manage_partitions=starnavi.scripts.manage_partitions:main',
         ]
     },
     # https://setuptools.readthedocs.io/en/latest/setuptools.html
@@ -0,0 +1,29 @@
+"""Added claimed_until to posts and comments
+
+Revision ID: a3c82e6f1b57
+Revises: f19b72e4c6a3
+Create Date: 2026-10-18 21:12:40.581934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c82e6f1b57'
+down_revision: Union[str, None] = 'f19b72e4c6a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Nullable without a default: only the catalog changes, existing rows are not rewritten.
+    op.add_column('posts', sa.Column('claimed_until', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('comments', sa.Column('claimed_until', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('comments', 'claimed_until')
+    op.drop_column('posts', 'claimed_until')
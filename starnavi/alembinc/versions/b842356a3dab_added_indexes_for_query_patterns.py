@@ -0,0 +1,42 @@
+"""Added indexes for query patterns
+
+Revision ID: b842356a3dab
+Revises: b96a902ac80d
+Create Date: 2026-10-18 11:02:17.284106
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b842356a3dab'
+down_revision: Union[str, None] = 'b96a902ac80d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ('ix_posts_created_at_id', 'posts', ['created_at', 'id'], {}),
+    ('ix_posts_user_id', 'posts', ['user_id'], {}),
+    ('ix_comments_post_id_created_at_id', 'comments', ['post_id', 'created_at', 'id'], {}),
+    ('ix_comments_created_at', 'comments', ['created_at'], {}),
+    ('ix_comments_user_id', 'comments', ['user_id'], {}),
+    ('ix_block_contents_comment_created_at', 'block_contents', ['created_at'],
+     {'postgresql_where': sa.text('post_id IS NOT NULL')}),
+    ('ix_block_contents_post_id', 'block_contents', ['post_id'], {}),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps the tables writable while the indexes build; it cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kwargs)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
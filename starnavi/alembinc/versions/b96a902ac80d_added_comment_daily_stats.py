@@ -0,0 +1,45 @@
+"""Added comment_daily_stats rollup table
+
+Revision ID: b96a902ac80d
+Revises: 2b22014a99a8
+Create Date: 2026-10-18 10:12:41.503217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b96a902ac80d'
+down_revision: Union[str, None] = '2b22014a99a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('comment_daily_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('created_comments', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('blocked_comments', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('day')
+    )
+    op.execute("""
+        INSERT INTO comment_daily_stats (day, created_comments, blocked_comments)
+        SELECT day, sum(created), sum(blocked) FROM (
+            SELECT date(created_at) AS day, count(*) AS created, 0 AS blocked
+            FROM comments WHERE created_at IS NOT NULL GROUP BY 1
+            UNION ALL
+            SELECT date(created_at) AS day, 0 AS created, count(*) AS blocked
+            FROM block_contents WHERE post_id IS NOT NULL AND created_at IS NOT NULL GROUP BY 1
+        ) counts GROUP BY day
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('comment_daily_stats')
@@ -0,0 +1,37 @@
+"""Added moderation status to posts and comments
+
+Revision ID: c4e7a91d2f60
+Revises: b842356a3dab
+Create Date: 2026-10-18 15:20:44.810352
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e7a91d2f60'
+down_revision: Union[str, None] = 'b842356a3dab'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A constant server default is stored in the catalog, so existing rows are not rewritten.
+    op.add_column('posts', sa.Column('status', sa.String(), server_default='published', nullable=False))
+    op.add_column('comments', sa.Column('status', sa.String(), server_default='published', nullable=False))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_pending', 'posts', ['id'], postgresql_where=sa.text("status = 'pending'"),
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_comments_pending', 'comments', ['id'], postgresql_where=sa.text("status = 'pending'"),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_comments_pending', table_name='comments', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_posts_pending', table_name='posts', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('comments', 'status')
+    op.drop_column('posts', 'status')
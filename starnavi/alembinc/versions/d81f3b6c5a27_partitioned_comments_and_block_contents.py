@@ -0,0 +1,98 @@
+"""Partitioned comments and block_contents by month
+
+Revision ID: d81f3b6c5a27
+Revises: c4e7a91d2f60
+Create Date: 2026-10-18 17:05:12.460931
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from starnavi.config import PARTITION_MONTHS_AHEAD
+from starnavi.database.partitions import add_months, create_partitions, current_month, month_start
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd81f3b6c5a27'
+down_revision: Union[str, None] = 'c4e7a91d2f60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = {
+    'comments': """
+        id integer NOT NULL DEFAULT nextval('{sequence}'::regclass),
+        user_id integer REFERENCES users (id),
+        post_id integer REFERENCES posts (id),
+        content varchar NOT NULL,
+        status varchar NOT NULL DEFAULT 'published',
+        created_at timestamptz {created_at_null} DEFAULT now(),
+        updated_at timestamptz
+    """,
+    'block_contents': """
+        id integer NOT NULL DEFAULT nextval('{sequence}'::regclass),
+        user_id integer REFERENCES users (id),
+        post_id integer REFERENCES posts (id),
+        content varchar NOT NULL,
+        title varchar,
+        created_at timestamptz {created_at_null} DEFAULT now(),
+        updated_at timestamptz
+    """,
+}
+COPIED = {
+    'comments': ['id', 'user_id', 'post_id', 'content', 'status', 'created_at', 'updated_at'],
+    'block_contents': ['id', 'user_id', 'post_id', 'content', 'title', 'created_at', 'updated_at'],
+}
+INDEXES = {
+    'comments': [
+        ('ix_comments_post_id_created_at_id', ['post_id', 'created_at', 'id'], None),
+        ('ix_comments_created_at', ['created_at'], None),
+        ('ix_comments_user_id', ['user_id'], None),
+        ('ix_comments_pending', ['id'], "status = 'pending'"),
+    ],
+    'block_contents': [
+        ('ix_block_contents_comment_created_at', ['created_at'], 'post_id IS NOT NULL'),
+        ('ix_block_contents_post_id', ['post_id'], None),
+    ],
+}
+
+
+def rebuild(table, partitioned):
+    """Copy `table` into a new (partitioned or plain) table under the same name, keeping its id sequence.
+
+    The rename locks the table until the migration commits, so large tables need a maintenance window.
+    """
+    connection = op.get_bind()
+    sequence = connection.scalar(sa.text(f"SELECT pg_get_serial_sequence('{table}', 'id')"))
+    op.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+
+    columns = COLUMNS[table].format(sequence=sequence, created_at_null="NOT NULL" if partitioned else "")
+    op.execute(f"CREATE TABLE {table} ({columns})" + (" PARTITION BY RANGE (created_at)" if partitioned else ""))
+    if partitioned:
+        oldest = connection.scalar(sa.text(f"SELECT min(created_at) FROM {table}_old"))
+        first_month = month_start((oldest or datetime.now(timezone.utc)).astimezone(timezone.utc))
+        create_partitions(connection, table, first_month, add_months(current_month(), PARTITION_MONTHS_AHEAD))
+
+    values = ["COALESCE(created_at, now())" if partitioned and name == "created_at" else name for name in COPIED[table]]
+    op.execute(f"INSERT INTO {table} ({', '.join(COPIED[table])}) SELECT {', '.join(values)} FROM {table}_old")
+
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute(f"DROP TABLE {table}_old")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    # Unique constraints of a partitioned table must contain the partition key.
+    op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY "
+               f"({'id, created_at' if partitioned else 'id'})")
+    for name, index_columns, where in INDEXES[table]:
+        op.create_index(name, table, index_columns, postgresql_where=sa.text(where) if where else None)
+
+
+def upgrade() -> None:
+    for table in COLUMNS:
+        rebuild(table, partitioned=True)
+
+
+def downgrade() -> None:
+    for table in COLUMNS:
+        rebuild(table, partitioned=False)
@@ -0,0 +1,44 @@
+"""Added full-text search vectors to posts and comments
+
+Revision ID: e5a0c38b9d14
+Revises: d81f3b6c5a27
+Create Date: 2026-10-18 18:02:37.915204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a0c38b9d14'
+down_revision: Union[str, None] = 'd81f3b6c5a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+POST_SEARCH_VECTOR = ("setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+                      "setweight(to_tsvector('english', coalesce(content, '')), 'B')")
+COMMENT_SEARCH_VECTOR = "to_tsvector('english', coalesce(content, ''))"
+
+
+def upgrade() -> None:
+    # Stored generated columns are kept up to date by Postgres on every write; adding one rewrites the table.
+    op.add_column('posts', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                     sa.Computed(POST_SEARCH_VECTOR, persisted=True)))
+    op.add_column('comments', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                        sa.Computed(COMMENT_SEARCH_VECTOR, persisted=True)))
+    # CONCURRENTLY is not supported on partitioned tables, so the comments index is built on each partition normally.
+    op.create_index('ix_comments_search_vector', 'comments', ['search_vector'], postgresql_using='gin')
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], postgresql_using='gin',
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_posts_search_vector', table_name='posts', postgresql_concurrently=True, if_exists=True)
+    op.drop_index('ix_comments_search_vector', table_name='comments')
+    op.drop_column('comments', 'search_vector')
+    op.drop_column('posts', 'search_vector')
@@ -0,0 +1,36 @@
+"""Added comment_count and last_comment_at to posts
+
+Revision ID: f19b72e4c6a3
+Revises: e5a0c38b9d14
+Create Date: 2026-10-18 18:41:09.226517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f19b72e4c6a3'
+down_revision: Union[str, None] = 'e5a0c38b9d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('posts', sa.Column('last_comment_at', sa.DateTime(timezone=True), nullable=True))
+    op.execute("""
+        UPDATE posts SET comment_count = c.comments, last_comment_at = c.newest
+        FROM (
+            SELECT post_id, count(*) AS comments, max(created_at) AS newest
+            FROM comments WHERE status = 'published' AND post_id IS NOT NULL GROUP BY post_id
+        ) c
+        WHERE posts.id = c.post_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('posts', 'last_comment_at')
+    op.drop_column('posts', 'comment_count')
@@ -0,0 +1,148 @@
+"""Seed a dataset, swap Gemini for a local stand-in and drive every API route, reporting latency as JSON.
+
+    python -m starnavi.benchmarks --requests 500 --concurrency 50 --model-latency 0.2 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import time
+from datetime import date, timedelta
+
+import httpx
+
+from starnavi.benchmarks.fake_model import install_fake_model
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def scenarios(dataset, run_id):
+    editable_posts, editable_comments = dataset.editable_posts, dataset.editable_comments
+    today = date.today()
+    return {
+        "POST /create_users/": lambda i: ("POST", "/create_users/", {
+            "name": f"bench {i}", "email": f"bench-{run_id}-{i}@bench.local", "password": "benchmark"}),
+        "POST /login/": lambda i: ("POST", "/login/", {"email": dataset.email, "password": dataset.password}),
+        "POST /posts/": lambda i: ("POST", "/posts/", {"title": f"Title {run_id} {i}",
+                                                       "content": f"Benchmark post {run_id} {i}"}),
+        "POST /posts/batch": lambda i: ("POST", "/posts/batch", {"items": [
+            {"title": f"Batch {run_id} {i}", "content": f"Batch post {run_id} {i} {n}"} for n in range(10)]}),
+        "POST /edit_post/": lambda i: ("POST", "/edit_post/", {"id": 1 + i % editable_posts,
+                                                               "content": f"Edited post {run_id} {i}"}),
+        "POST /comments/": lambda i: ("POST", "/comments/", {"post_id": 1 + i % editable_posts,
+                                                             "content": f"Benchmark comment {run_id} {i}"}),
+        "POST /comments/batch": lambda i: ("POST", "/comments/batch", {"items": [
+            {"post_id": 1 + (i + n) % editable_posts, "content": f"Batch comment {run_id} {i} {n}"}
+            for n in range(10)]}),
+        "POST /edit_comment/": lambda i: ("POST", "/edit_comment/", {
+            "post_id": 1, "comment_id": 1 + i % editable_comments, "content": f"Edited comment {run_id} {i}"}),
+        "GET /posts/": lambda i: ("GET", "/posts/", None),
+        "GET /blocked/": lambda i: ("GET", "/blocked/", None),
+        "GET /comments/": lambda i: ("GET", "/comments/", None),
+        "GET /posts/{id}/comments": lambda i: ("GET", f"/posts/{1 + i % editable_posts}/comments", None),
+        "GET /users/": lambda i: ("GET", "/users/", None),
+        "GET /search": lambda i: ("GET", f"/search?q=comment {1 + i % 1000}", None),
+        "GET /api/comments-daily-breakdown": lambda i: ("GET", "/api/comments-daily-breakdown?date_from="
+                                                        f"{today - timedelta(days=365)}&date_to={today}", None),
+        "GET /api/auth-stats": lambda i: ("GET", "/api/auth-stats", None),
+        "GET /api/moderation-stats": lambda i: ("GET", "/api/moderation-stats", None),
+        "POST /remove_comment/": lambda i: ("POST", "/remove_comment/", {
+            "post_id": 1, "comment_id": dataset.removable_comment(i)}),
+        "POST /remove_post/": lambda i: ("POST", "/remove_post/", {"id": dataset.removable_post(i)}),
+    }
+
+
+async def drive(client, headers, build, requests, concurrency):
+    latencies, statuses = [], {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            method, url, body = build(i)
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body, headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def run(app, dataset, options):
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        login = await client.post("/login/", json={"email": dataset.email, "password": dataset.password})
+        login.raise_for_status()
+        headers = {"Authorization": login.json()["data"]["token"]}
+
+        for name, build in scenarios(dataset, int(time.time())).items():
+            if options.only and name not in options.only:
+                continue
+            requests = min(options.requests, dataset.reserved) if "remove" in name else options.requests
+            results[name] = await drive(client, headers, build, requests, options.concurrency)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every starnavi route against a seeded database")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--blocked", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--model-latency", type=float, default=0.05, help="Seconds per fake Gemini call")
+    parser.add_argument("--block-ratio", type=float, default=0.05, help="Share of content the fake model blocks")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every item to the fake model")
+    parser.add_argument("--only", action="append", help="Route to run, e.g. 'GET /posts/'; repeatable")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    options = parser.parse_args()
+
+    if options.no_prefilter:
+        os.environ["STARNAVI_PREFILTER_ENABLED"] = "false"
+    install_fake_model(options.model_latency, options.block_ratio)
+
+    from starnavi.benchmarks.dataset import seed
+    from starnavi.database.db import engine
+    from starnavi.main import app
+
+    dataset = seed(engine, options.users, options.posts, options.comments, options.blocked,
+                   reserved=min(options.requests, options.posts // 2, options.comments // 2))
+    report = {
+        "revision": git_revision(),
+        "options": {key: value for key, value in vars(options).items() if key != "output"},
+        "routes": asyncio.run(run(app, dataset, options)),
+    }
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import random
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+
+import bcrypt
+from sqlalchemy import insert, delete, func, select, update
+
+from starnavi.config import BCRYPT_ROUNDS, PARTITION_MONTHS_AHEAD
+from starnavi.database.db import Base, User, Post, Comment, ContentBlocked, CommentDailyStats
+from starnavi.database.partitions import ensure_partitions
+
+PASSWORD = "benchmark"
+
+
+@dataclass
+class Dataset:
+    users: int
+    posts: int
+    comments: int
+    blocked: int
+    reserved: int
+    email: str = "user1@bench.local"
+    password: str = PASSWORD
+
+    @property
+    def editable_posts(self):
+        return self.posts - self.reserved
+
+    @property
+    def editable_comments(self):
+        return self.comments - self.reserved
+
+    def removable_post(self, i):
+        return self.editable_posts + 1 + i % self.reserved
+
+    def removable_comment(self, i):
+        return self.editable_comments + 1 + i % self.reserved
+
+
+def chunks(rows, size=5000):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def seed(engine, users, posts, comments, blocked, reserved, days=365):
+    """Recreate a deterministic dataset; the last `reserved` posts and comments are left for the remove routes."""
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+
+    def created_at():
+        return now - timedelta(seconds=rng.randint(0, days * 24 * 60 * 60))
+
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            ensure_partitions(connection, PARTITION_MONTHS_AHEAD, since=(now - timedelta(days=days)).date())
+        for model in (CommentDailyStats, Comment, ContentBlocked, Post, User):
+            connection.execute(delete(model))
+
+        # Ids are assigned explicitly so the scenarios can address rows without querying for them.
+        tables = [
+            (User, [{"id": i, "name": f"user{i}", "email": f"user{i}@bench.local", "password": hashed}
+                    for i in range(1, users + 1)]),
+            (Post, [{"id": i, "user_id": rng.randint(1, users), "title": f"Post {i}", "content": f"Post body {i}",
+                     "should_be_answered": False, "time_for_ai_answer": 0, "created_at": created_at()}
+                    for i in range(1, posts + 1)]),
+            # Comments on reserved posts would be orphaned by the remove_post scenario, so keep them elsewhere.
+            (Comment, [{"id": i, "user_id": rng.randint(1, users), "post_id": rng.randint(1, posts - reserved),
+                        "content": f"Comment {i}", "created_at": created_at()} for i in range(1, comments + 1)]),
+            (ContentBlocked, [{"id": i, "user_id": rng.randint(1, users),
+                               "post_id": rng.randint(1, posts - reserved) if i % 3 else None,
+                               "content": f"Blocked {i}", "created_at": created_at()}
+                              for i in range(1, blocked + 1)]),
+        ]
+        for model, rows in tables:
+            for chunk in chunks(rows):
+                connection.execute(insert(model), chunk)
+
+        comments_of_post = Comment.post_id == Post.id
+        connection.execute(update(Post).values(
+            comment_count=select(func.count()).where(comments_of_post).scalar_subquery(),
+            last_comment_at=select(func.max(Comment.created_at)).where(comments_of_post).scalar_subquery()))
+
+        day_counts = {}
+        for model, column in ((Comment, "created_comments"), (ContentBlocked, "blocked_comments")):
+            query = select(func.date(model.created_at), func.count()).group_by(func.date(model.created_at))
+            if model is ContentBlocked:
+                query = query.where(model.post_id.isnot(None))
+            for day, count in connection.execute(query):
+                day = day if isinstance(day, date) else date.fromisoformat(day)
+                day_counts.setdefault(day, {"created_comments": 0, "blocked_comments": 0})[column] = count
+        for chunk in chunks([{"day": day, **counts} for day, counts in day_counts.items()]):
+            connection.execute(insert(CommentDailyStats), chunk)
+
+        if engine.dialect.name == "postgresql":
+            for table in ("users", "posts", "comments", "block_contents"):
+                connection.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+
+    return Dataset(users=users, posts=posts, comments=comments, blocked=blocked, reserved=reserved)
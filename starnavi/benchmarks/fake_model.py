@@ -0,0 +1,42 @@
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from vertexai.generative_models._generative_models import SafetyRating
+
+HarmSeverity = SafetyRating.HarmSeverity
+
+
+class FakeGenerativeModel:
+    """Local stand-in for vertexai's GenerativeModel with a fixed latency and a configurable block ratio."""
+    latency = 0.05
+    block_ratio = 0.0
+
+    def __init__(self, *args, **kwargs):
+        self.calls = 0
+
+    def response(self):
+        self.calls += 1
+        severity = (HarmSeverity.HARM_SEVERITY_HIGH if random.random() < self.block_ratio
+                    else HarmSeverity.HARM_SEVERITY_NEGLIGIBLE)
+        candidate = SimpleNamespace(safety_ratings=[SimpleNamespace(severity=severity)])
+        return SimpleNamespace(candidates=[candidate], text="Thanks for the post!")
+
+    def generate_content(self, contents, **kwargs):
+        time.sleep(self.latency)
+        return self.response()
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self.response()
+
+
+def install_fake_model(latency, block_ratio):
+    """Replace the Gemini client factory, so neither credentials nor the network are needed."""
+    import starnavi.services as services
+
+    FakeGenerativeModel.latency = latency
+    FakeGenerativeModel.block_ratio = block_ratio
+    services.build_model = FakeGenerativeModel
+    services.get_client.cache_clear()
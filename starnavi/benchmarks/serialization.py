@@ -0,0 +1,81 @@
+"""Compare CPU per row of the ORM + pydantic list path with the column-select + orjson fast path.
+
+    python -m starnavi.benchmarks.serialization --rows 50000
+
+Runs against an in-memory SQLite database, so it measures the Python side only: row/object construction, response
+validation and JSON encoding.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import Column, MetaData, Table, create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from starnavi.database.db import Comment
+from starnavi.models import CommentModel
+from starnavi.serialization import RowsResponse, model_columns, rows_as_dicts
+
+
+def create_comments_table(engine):
+    """Plain SQLite copy of comments: the real table's partition-friendly composite key and generated search_vector
+    have no SQLite equivalent."""
+    columns = [column for column in Comment.__table__.columns if column.computed is None]
+    Table(Comment.__tablename__, MetaData(),
+          *(Column(column.name, column.type, primary_key=column.name == "id") for column in columns)).create(engine)
+
+
+def orm_path(session, adapter):
+    comments = session.scalars(select(Comment)).all()
+    validated = adapter.validate_python(comments, from_attributes=True)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def fast_path(session, adapter):
+    rows = rows_as_dicts(session.execute(select(*model_columns(Comment, CommentModel))))
+    return RowsResponse(rows).body
+
+
+def measure(path, engine, adapter, repeat):
+    timings = []
+    for _ in range(repeat):
+        with Session(engine) as session:
+            started = time.process_time()
+            body = path(session, adapter)
+            timings.append(time.process_time() - started)
+    return min(timings), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU per row of the list endpoint serialization paths")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    create_comments_table(engine)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as connection:
+        connection.execute(insert(Comment), [
+            {"id": i, "user_id": 1 + i % 100, "post_id": 1 + i % 1000, "content": f"Benchmark comment number {i}",
+             "created_at": now - timedelta(seconds=i)} for i in range(1, options.rows + 1)])
+
+    adapter = TypeAdapter(List[CommentModel])
+    orm_seconds, orm_body = measure(orm_path, engine, adapter, options.repeat)
+    fast_seconds, fast_body = measure(fast_path, engine, adapter, options.repeat)
+
+    print(json.dumps({
+        "rows": options.rows,
+        "orm_pydantic_us_per_row": round(orm_seconds / options.rows * 1e6, 2),
+        "rows_orjson_us_per_row": round(fast_seconds / options.rows * 1e6, 2),
+        "speedup": round(orm_seconds / fast_seconds, 1),
+        "same_payload": json.loads(orm_body) == json.loads(fast_body),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
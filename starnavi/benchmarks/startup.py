@@ -0,0 +1,48 @@
+"""Cold-start time of the API and Celery worker modules, with the Gemini client built lazily or at import.
+
+    python -m starnavi.benchmarks.startup --runs 10
+
+Every run is a fresh interpreter. "lazy" imports the module the way uvicorn and the worker do; "eager" additionally
+builds the Gemini client right away, which is what importing starnavi.services used to do.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+TARGETS = {"api": "starnavi.main", "worker": "starnavi.celery_app.tasks"}
+SNIPPET = """
+import time
+started = time.perf_counter()
+import {module}
+if {eager}:
+    import starnavi.services
+    starnavi.services.get_client()
+print(time.perf_counter() - started)
+"""
+
+
+def measure(module, eager, runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", SNIPPET.format(module=module, eager=eager)],
+                                stdout=subprocess.PIPE, text=True, check=True).stdout
+        timings.append(float(output.split()[-1]))
+    return round(statistics.median(timings) * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time of the API and worker imports")
+    parser.add_argument("--runs", type=int, default=5)
+    options = parser.parse_args()
+
+    report = {}
+    for name, module in TARGETS.items():
+        lazy, eager = measure(module, False, options.runs), measure(module, True, options.runs)
+        report[name] = {"module": module, "lazy_ms": lazy, "eager_ms": eager, "saved_ms": round(eager - lazy, 1)}
+    print(json.dumps({"runs": options.runs, "median_import": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+
+from redis import Redis, asyncio as aioredis
+from redis.exceptions import RedisError
+
+from starnavi.config import (REDIS_URL, VERDICT_CACHE_SIZE, VERDICT_ALLOWED_TTL, VERDICT_BLOCKED_TTL,
+                             VERDICT_REDIS_PREFIX, RESOURCE_VERSION_PREFIX, REVOKED_USER_PREFIX, TOKEN_CACHE_SIZE,
+                             REVOCATION_POLL_INTERVAL)
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def content_key(content, title=""):
+    normalized = "\x00".join(WHITESPACE.sub(" ", part or "").strip().casefold() for part in (title, content))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class TTLCache:
+    """Bounded in-process LRU whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def items(self):
+        return [(key, value) for key, (value, _) in self.entries.items()]
+
+    def clear(self):
+        self.entries.clear()
+
+
+class VerdictCache:
+    """Two-tier moderation verdict cache: a per-process LRU in front of a shared Redis tier."""
+
+    def __init__(self, max_size, allowed_ttl, blocked_ttl, redis=None, prefix="verdict:"):
+        self.allowed_ttl = allowed_ttl
+        self.blocked_ttl = blocked_ttl
+        self.prefix = prefix
+        self.redis = redis
+        self.local = TTLCache(max_size)
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "redis_errors": 0}
+
+    def ttl_for(self, allowed):
+        return self.allowed_ttl if allowed else self.blocked_ttl
+
+    async def get(self, content, title=""):
+        key = content_key(content, title)
+        allowed = self.local.get(key)
+        if allowed is not None:
+            self.stats["local_hits"] += 1
+            return allowed
+
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    value, ttl = await pipe.get(self.prefix + key).ttl(self.prefix + key).execute()
+                if value is not None:
+                    allowed = value == b"1"
+                    self.local.set(key, allowed, ttl if ttl > 0 else self.ttl_for(allowed))
+                    self.stats["redis_hits"] += 1
+                    return allowed
+            except RedisError as e:
+                self.stats["redis_errors"] += 1
+                logging.warning(f"Verdict cache read failed: {e}")
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, content, title, allowed):
+        key = content_key(content, title)
+        ttl = self.ttl_for(allowed)
+        if ttl <= 0:
+            return
+        self.local.set(key, allowed, ttl)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self.prefix + key, b"1" if allowed else b"0", ex=ttl)
+            except RedisError as e:
+                self.stats["redis_errors"] += 1
+                logging.warning(f"Verdict cache write failed: {e}")
+
+    def clear(self):
+        self.local.clear()
+
+
+def version_epoch():
+    # Counters start from the current time so a flushed Redis never hands out versions clients have already seen.
+    return time.time_ns() // 1000
+
+
+def bump_versions_sync(redis, tables, prefix=RESOURCE_VERSION_PREFIX):
+    """ResourceVersions.bump for synchronous callers such as Celery tasks and scripts."""
+    if redis is None or not tables:
+        return
+    try:
+        with redis.pipeline(transaction=False) as pipe:
+            for table in tables:
+                pipe.set(prefix + table, version_epoch(), nx=True).incr(prefix + table)
+            pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Resource versions could not be bumped: {e}")
+
+
+class ResourceVersions:
+    """Per-table change counters shared through Redis; conditional GETs derive their ETags from them."""
+
+    def __init__(self, redis=None, prefix="version:"):
+        self.redis = redis
+        self.prefix = prefix
+
+    async def get(self, *tables):
+        """Current versions in argument order, or None when they cannot be read and ETags must be skipped."""
+        if self.redis is None:
+            return None
+        keys = [self.prefix + table for table in tables]
+        try:
+            versions = await self.redis.mget(keys)
+            if None in versions:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.set(key, version_epoch(), nx=True)
+                    versions = (await pipe.mget(keys).execute())[-1]
+        except RedisError as e:
+            logging.warning(f"Resource versions could not be read: {e}")
+            return None
+        return [int(version) for version in versions]
+
+    async def bump(self, *tables):
+        if self.redis is None or not tables:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for table in tables:
+                    pipe.set(self.prefix + table, version_epoch(), nx=True).incr(self.prefix + table)
+                await pipe.execute()
+        except RedisError as e:
+            logging.warning(f"Resource versions could not be bumped: {e}")
+
+
+class RevokedUsers:
+    """Users whose tokens are rejected before they expire.
+
+    Requests only read the local copy. Revocations are published to a Redis sorted set (scored by expiry) next to a
+    version counter, and every process polls that counter at most once per interval, off the request path, pulling
+    the set only when it changed. When Redis is unavailable each process keeps what it last saw.
+    """
+
+    def __init__(self, redis=None, sync_redis=None, prefix="revoked_user:", max_size=10000, poll_interval=1):
+        self.redis = redis
+        self.sync_redis = sync_redis
+        self.users_key = prefix + "users"
+        self.version_key = prefix + "version"
+        self.poll_interval = poll_interval
+        self.local = TTLCache(max_size)
+        self.version = None
+        self.polled_at = float("-inf")
+        self.tasks = set()
+
+    def run_in_background(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def revoke(self, user_id, ttl):
+        """Synchronous, so it can run from session events; on the event loop the publish is scheduled, not awaited."""
+        self.local.set(user_id, True, ttl)
+        expires_at = time.time() + ttl
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.publish_sync(user_id, expires_at)
+        else:
+            self.run_in_background(self.publish(user_id, expires_at))
+
+    async def publish(self, user_id, expires_at):
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zadd(self.users_key, {user_id: expires_at}).zremrangebyscore(self.users_key, "-inf", time.time())
+                await pipe.incr(self.version_key).execute()
+        except RedisError as e:
+            logging.error(f"Revocation of user {user_id} could not be shared: {e}")
+
+    def publish_sync(self, user_id, expires_at):
+        if self.sync_redis is None:
+            return
+        try:
+            with self.sync_redis.pipeline(transaction=False) as pipe:
+                pipe.zadd(self.users_key, {user_id: expires_at}).zremrangebyscore(self.users_key, "-inf", time.time())
+                pipe.incr(self.version_key).execute()
+        except RedisError as e:
+            logging.error(f"Revocation of user {user_id} could not be shared: {e}")
+
+    async def refresh(self):
+        """Pull the revocations published by other processes if the shared version moved since the last pull."""
+        if self.redis is None:
+            return
+        try:
+            version = await self.redis.get(self.version_key)
+            if version is None or version == self.version:
+                return
+            now = time.time()
+            for user_id, expires_at in await self.redis.zrangebyscore(self.users_key, now, "+inf", withscores=True):
+                self.local.set(int(user_id), True, expires_at - now)
+            self.version = version
+        except RedisError as e:
+            logging.warning(f"Revoked users could not be refreshed: {e}")
+
+    def poll(self):
+        """Start a background refresh if the last one is older than the poll interval; never waits for Redis."""
+        if self.redis is None or time.monotonic() - self.polled_at < self.poll_interval:
+            return
+        self.polled_at = time.monotonic()
+        self.run_in_background(self.refresh())
+
+    def is_revoked(self, user_id):
+        return user_id is not None and bool(self.local.get(user_id))
+
+
+redis_client = aioredis.from_url(REDIS_URL, socket_timeout=0.1) if REDIS_URL else None
+
+verdict_cache = VerdictCache(VERDICT_CACHE_SIZE, VERDICT_ALLOWED_TTL, VERDICT_BLOCKED_TTL, redis_client,
+                             VERDICT_REDIS_PREFIX)
+
+resource_versions = ResourceVersions(redis_client, RESOURCE_VERSION_PREFIX)
+
+revoked_users = RevokedUsers(redis_client, Redis.from_url(REDIS_URL, socket_timeout=0.1) if REDIS_URL else None,
+                             REVOKED_USER_PREFIX, TOKEN_CACHE_SIZE, REVOCATION_POLL_INTERVAL)
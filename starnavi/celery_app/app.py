@@ -1,13 +1,18 @@
-import vertexai
+import time
+
 from celery import Celery
+from celery.signals import task_prerun, task_postrun, worker_init
+from redis import Redis
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from starnavi.config import PROJECT_AI_ID, DATABASE_URL, CELERY_BROKER, CELERY_BACKEND
-from starnavi.services import credentials
+from starnavi.config import (DATABASE_URL, CELERY_BROKER, CELERY_BACKEND, REDIS_URL, CELERY_QUEUE,
+                             WORKER_METRICS_PORT)
+from starnavi.metrics import TASK_SECONDS, start_metrics_server
 
 engine = create_engine(DATABASE_URL)
 Session = sessionmaker(bind=engine)
+redis_client = Redis.from_url(REDIS_URL) if REDIS_URL else None
 
 app = Celery(
     "tasks",
@@ -21,10 +26,33 @@ app.conf.update(
     accept_content=['json'],
     result_serializer='json',
     timezone='UTC',
-    enable_utc=True
+    enable_utc=True,
+    task_default_queue=CELERY_QUEUE,
+    beat_schedule={
+        "maintain-partitions": {"task": "starnavi.celery_app.tasks.maintain_partitions", "schedule": 24 * 60 * 60},
+    }
 )
 
+task_started = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_runtime(task_id=None, task=None, state=None, **kwargs):
+    started = task_started.pop(task_id, None)
+    if started is not None:
+        TASK_SECONDS.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - started)
+
+
+@worker_init.connect
+def serve_worker_metrics(**kwargs):
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT)
+
 
 if __name__ == "__main__":
-    vertexai.init(project=PROJECT_AI_ID, location="us-central1", credentials=credentials)
     app.worker_main(['worker', '--loglevel=info'])
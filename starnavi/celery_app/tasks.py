@@ -1,13 +1,316 @@
-from starnavi.celery_app.app import app, Session
-from starnavi.database.db import Comment
-from starnavi.services import automatic_ai_answer
-from starnavi.utils import insert_into_db
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from celery.signals import worker_ready, worker_shutdown
+from redis.exceptions import ResponseError
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from starnavi.cache import bump_versions_sync
+from starnavi.celery_app.app import app, engine, Session, redis_client
+from starnavi.config import (AI_REPLY_QUEUE, AI_REPLY_BATCH_SIZE, AI_REPLY_WINDOW, AI_REPLY_LOCK_PREFIX,
+                             COMMENT_WRITE_BEHIND, COMMENT_STREAM, COMMENT_STREAM_GROUP, COMMENT_STREAM_BATCH,
+                             COMMENT_STREAM_CLAIM_IDLE, ASYNC_MODERATION, ASYNC_MODERATION_BATCH,
+                             ASYNC_MODERATION_LOCK, ASYNC_MODERATION_RETRY, ASYNC_MODERATION_LEASE,
+                             PARTITION_MONTHS_AHEAD, PARTITION_RETENTION_MONTHS, PARTITION_DROP_RETIRED)
+from starnavi.database.db import (Comment, CommentDailyStats, ContentBlocked, Post, PENDING, PUBLISHED,
+                                  update_comment_counts, upsert_daily_stats)
+from starnavi.database.partitions import maintain
+from starnavi.metrics import COMMENT_WRITE_DELAY
+from starnavi.resilience import CircuitOpenError
+from starnavi.services import analyze_content_async, automatic_ai_answer
+
+AI_USER_ID = 1
+STREAM_CONSUMER = f"{socket.gethostname()}-{os.getpid()}"
+
+
+def insert_replies(replies):
+    session = Session()
+    try:
+        session.add_all([Comment(user_id=AI_USER_ID, post_id=reply["post_id"], content=reply["content"])
+                         for reply in replies])
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    bump_versions_sync(redis_client, sorted(session.info.pop("changed_tables", ())))
+
+
+def flush_automatic_replies():
+    flushed = 0
+    while True:
+        with redis_client.pipeline() as pipe:
+            rows, _ = pipe.lrange(AI_REPLY_QUEUE, 0, AI_REPLY_BATCH_SIZE - 1).ltrim(
+                AI_REPLY_QUEUE, AI_REPLY_BATCH_SIZE, -1).execute()
+        if not rows:
+            return flushed
+
+        try:
+            insert_replies([json.loads(row) for row in rows])
+        except SQLAlchemyError as e:
+            logging.error(f"Error occurred while writing automatic replies: {e}")
+            redis_client.rpush(AI_REPLY_QUEUE, *rows)
+            raise
+        flushed += len(rows)
+        if len(rows) < AI_REPLY_BATCH_SIZE:
+            return flushed
+
+
+@app.task(bind=True, max_retries=5)
+def send_automatic_reply(self, content, title, post_id):
+    try:
+        response = automatic_ai_answer(content, title)
+    except CircuitOpenError as e:
+        raise self.retry(exc=e, countdown=e.retry_after)
+    reply = {"post_id": post_id, "content": response.text}
+    if redis_client is None:
+        insert_replies([reply])
+        return
+
+    redis_client.rpush(AI_REPLY_QUEUE, json.dumps(reply))
+    flush_automatic_replies()
+
+
+def ensure_comment_group():
+    try:
+        redis_client.xgroup_create(COMMENT_STREAM, COMMENT_STREAM_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def read_comment_entries():
+    """Own unacknowledged entries first, then entries abandoned by dead consumers, then new ones."""
+    for stream_id in ("0", None, ">"):
+        if stream_id is None:
+            entries = redis_client.xautoclaim(COMMENT_STREAM, COMMENT_STREAM_GROUP, STREAM_CONSUMER,
+                                              min_idle_time=COMMENT_STREAM_CLAIM_IDLE * 1000,
+                                              count=COMMENT_STREAM_BATCH)[1]
+        else:
+            response = redis_client.xreadgroup(COMMENT_STREAM_GROUP, STREAM_CONSUMER, {COMMENT_STREAM: stream_id},
+                                               count=COMMENT_STREAM_BATCH)
+            entries = response[0][1] if response else []
+        if entries:
+            return entries
+    return []
+
+
+def write_comments(rows):
+    """Insert comments whose ids were allocated before enqueueing, so replayed entries are skipped."""
+    session = Session()
+    try:
+        post_ids = set(session.scalars(select(Post.id).where(Post.id.in_({row["post_id"] for row in rows}))))
+        orphans = [row["id"] for row in rows if row["post_id"] not in post_ids]
+        if orphans:
+            logging.warning(f"Dropping write-behind comments of deleted posts: {orphans}")
+        rows = [row for row in rows if row["post_id"] in post_ids]
+
+        created = []
+        if rows:
+            created = session.execute(insert(Comment).values(rows).on_conflict_do_nothing(
+                index_elements=[Comment.id, Comment.created_at]).returning(Comment.post_id, Comment.created_at)).all()
+        deltas = defaultdict(lambda: [0, 0])
+        counts = defaultdict(lambda: [0, [], False])
+        for post_id, created_at in created:
+            deltas[created_at.date()][0] += 1
+            counts[post_id][0] += 1
+            counts[post_id][1].append(created_at)
+        upsert_daily_stats(session, deltas)
+        update_comment_counts(session, counts)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    if created:
+        bump_versions_sync(redis_client, [Comment.__tablename__, CommentDailyStats.__tablename__, Post.__tablename__])
+    return len(created)
+
+
+def flush_comment_stream():
+    """Commit queued write-behind comments in batches; entries are acknowledged only after their batch commits."""
+    if redis_client is None:
+        return 0
+    ensure_comment_group()
+    flushed = 0
+    while entries := read_comment_entries():
+        rows = []
+        for _, fields in entries:
+            if fields:
+                row = json.loads(fields[b"comment"])
+                row["created_at"] = datetime.fromisoformat(row["created_at"])
+                rows.append(row)
+        if rows:
+            flushed += write_comments(rows)
+
+        entry_ids = [entry_id for entry_id, _ in entries]
+        with redis_client.pipeline() as pipe:
+            pipe.xack(COMMENT_STREAM, COMMENT_STREAM_GROUP, *entry_ids).xdel(COMMENT_STREAM, *entry_ids).execute()
+
+        now_ms = time.time() * 1000
+        for entry_id in entry_ids:
+            COMMENT_WRITE_DELAY.observe((now_ms - int(entry_id.split(b"-")[0])) / 1000)
+    return flushed
 
 
 @app.task
-def send_automatic_reply(content, title, post_id):
+def flush_comments():
+    return flush_comment_stream()
+
+
+@worker_shutdown.connect
+def drain_comment_stream(**kwargs):
+    if COMMENT_WRITE_BEHIND:
+        logging.info(f"Flushed {flush_comment_stream()} write-behind comments on shutdown")
+
+
+@lru_cache(maxsize=1)
+def worker_loop():
+    """One event loop per worker process, so the moderation semaphore and async Redis clients stay bound to it."""
+    return asyncio.new_event_loop()
+
+
+def classify_pending(rows):
+    async def classify():
+        return await asyncio.gather(*(analyze_content_async(row.content, getattr(row, "title", "") or "")
+                                      for row in rows), return_exceptions=True)
+
+    return worker_loop().run_until_complete(classify())
+
+
+def schedule_reply(post):
+    """Sync counterpart of utils.schedule_automatic_reply: one reply per post per window."""
+    window = max(AI_REPLY_WINDOW, post.time_for_ai_answer or 0)
+    if redis_client is not None and not redis_client.set(f"{AI_REPLY_LOCK_PREFIX}{post.id}", 1, nx=True, ex=window):
+        return
+    send_automatic_reply.apply_async((post.content, post.title, post.id), countdown=post.time_for_ai_answer)
+
+
+def claim_pending(entity):
+    """Lease up to ASYNC_MODERATION_BATCH pending rows of `entity` in a short transaction of its own.
+
+    SKIP LOCKED lets workers split the backlog, and a row whose lease has run out (its worker died) is claimed again.
+    Returns the (id, content[, title], claimed_until) rows.
+    """
+    claimable = (select(entity.id).where(entity.status == PENDING,
+                                         or_(entity.claimed_until.is_(None), entity.claimed_until < func.now()))
+                 .order_by(entity.id).limit(ASYNC_MODERATION_BATCH).with_for_update(skip_locked=True))
+    columns = [entity.id, entity.content, *([entity.title] if entity is Post else []), entity.claimed_until]
+    session = Session()
+    try:
+        rows = session.execute(update(entity).where(entity.id.in_(claimable))
+                               .values(claimed_until=func.now() + timedelta(seconds=ASYNC_MODERATION_LEASE))
+                               .returning(*columns).execution_options(synchronize_session=False)).all()
+        session.commit()
+        return rows
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def moderate_pending_batch(entity):
+    """Moderate up to ASYNC_MODERATION_BATCH pending rows of `entity` concurrently and settle them in one transaction.
+
+    Rows are claimed and committed before Gemini is called, so no row locks are held while it runs; the verdicts are
+    applied in a second transaction to the rows this worker still holds the lease on. Rows whose moderation failed
+    are released and stay pending for the next run. Returns (settled, failed).
+    """
+    claimed = claim_pending(entity)
+    if not claimed:
+        return 0, 0
+    verdicts = {row.id: allowed for row, allowed in zip(claimed, classify_pending(claimed))}
+
     session = Session()
-    response = automatic_ai_answer(content, title)
-    ai_comment = Comment(user_id=1, post_id=post_id, content=response.text)
-    insert_into_db(ai_comment, session)
-    session.close()
+    try:
+        rows = session.scalars(select(entity).where(entity.id.in_(verdicts), entity.status == PENDING,
+                                                    entity.claimed_until == claimed[0].claimed_until)
+                               .order_by(entity.id).with_for_update()).all()
+
+        published, blocked, failed = [], [], 0
+        for row in rows:
+            allowed = verdicts[row.id]
+            row.claimed_until = None
+            if isinstance(allowed, Exception):
+                logging.error(f"Moderation of {entity.__tablename__} {row.id} failed, keeping it pending: {allowed}")
+                failed += 1
+            elif allowed:
+                row.status = PUBLISHED
+                published.append(row)
+            else:
+                blocked.append(row)
+
+        if entity is Post and blocked:
+            # Comments cannot be added to pending posts, this only catches a post blocked in between. They are
+            # deleted one by one so the session events keep the daily stats in step.
+            for comment in session.scalars(select(Comment).where(Comment.post_id.in_([row.id for row in blocked]))):
+                session.delete(comment)
+        for row in blocked:
+            session.add(ContentBlocked(user_id=row.user_id, post_id=getattr(row, "post_id", None),
+                                       title=getattr(row, "title", None), content=row.content,
+                                       created_at=row.created_at))
+            session.delete(row)
+        post_ids = {row.post_id for row in published if entity is Comment}
+        session.commit()
+
+        answered = []
+        if post_ids:
+            answered = session.scalars(select(Post).where(Post.id.in_(post_ids), Post.should_be_answered)).all()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    bump_versions_sync(redis_client, sorted(session.info.pop("changed_tables", ())))
+    for post in answered:
+        schedule_reply(post)
+    return len(published) + len(blocked), failed
+
+
+@app.task
+def moderate_pending():
+    """Drain pending posts and comments batch by batch."""
+    settled = failed = 0
+    for entity in (Post, Comment):
+        while True:
+            batch_settled, batch_failed = moderate_pending_batch(entity)
+            settled += batch_settled
+            failed += batch_failed
+            if batch_settled < ASYNC_MODERATION_BATCH or batch_failed:
+                break
+    # Keep a single retry scheduled while moderation fails, however many runs hit the failure.
+    if failed and (redis_client is None or redis_client.set(f"{ASYNC_MODERATION_LOCK}:retry", 1, nx=True,
+                                                            ex=ASYNC_MODERATION_RETRY)):
+        moderate_pending.apply_async(countdown=ASYNC_MODERATION_RETRY)
+    return settled
+
+
+@worker_ready.connect
+def resume_pending_moderation(**kwargs):
+    if ASYNC_MODERATION:
+        moderate_pending.delay()
+
+
+@app.task
+def maintain_partitions():
+    with engine.begin() as connection:
+        return maintain(connection, PARTITION_MONTHS_AHEAD, PARTITION_RETENTION_MONTHS, PARTITION_DROP_RETIRED)
+
+
+@worker_ready.connect
+def prepare_partitions(**kwargs):
+    maintain_partitions.delay()
@@ -1,18 +1,87 @@
 import logging
 import os
 
-import bcrypt
-
 JWT_SECRET = ("eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJzdWIiOiIxMjM0NTY3ODkwIiwibmFtZSI6IkpvaG4gRG9lIiwiaWF0IjoxNTE2Mj"
               "M5MDIyfQ.SflKxwRJSMeKKF2QT4fwpMeJf36POk6yJV_adQssw5c")
-KEY = bcrypt.gensalt()
 ALGORITHM = "HS256"
+TOKEN_LIFETIME_MINUTES = 30
 
 try:
     PROJECT_AI_ID = os.getenv("STARNAVI_AI_ID")
     CREDENTIALS = os.getenv("CREDENTIALS_AI", default="/app/service_account_key.json")
     DATABASE_URL = os.getenv("STARNAVI_DB_URL")
+    ASYNC_DATABASE_URL = os.getenv("STARNAVI_ASYNC_DB_URL", default=(DATABASE_URL or "").replace(
+        "postgresql://", "postgresql+asyncpg://", 1) or None)
+    DB_POOL_SIZE = int(os.getenv("STARNAVI_DB_POOL_SIZE", default=10))
+    DB_MAX_OVERFLOW = int(os.getenv("STARNAVI_DB_MAX_OVERFLOW", default=20))
+    DB_POOL_RECYCLE = int(os.getenv("STARNAVI_DB_POOL_RECYCLE", default=1800))
     CELERY_BROKER = os.getenv("CELERY_BROKER_URL")
     CELERY_BACKEND = os.getenv("CELERY_BACKEND_URL")
+    POSTS_PAGE_SIZE = int(os.getenv("STARNAVI_POSTS_PAGE_SIZE", default=20))
+    POSTS_MAX_PAGE_SIZE = int(os.getenv("STARNAVI_POSTS_MAX_PAGE_SIZE", default=100))
+    COMMENTS_PER_POST = int(os.getenv("STARNAVI_COMMENTS_PER_POST", default=10))
+    COMMENTS_PAGE_SIZE = int(os.getenv("STARNAVI_COMMENTS_PAGE_SIZE", default=50))
+    COMMENTS_MAX_PAGE_SIZE = int(os.getenv("STARNAVI_COMMENTS_MAX_PAGE_SIZE", default=200))
+    ANALYTICS_MAX_DAYS = int(os.getenv("STARNAVI_ANALYTICS_MAX_DAYS", default=366))
+    MODERATION_CONCURRENCY = int(os.getenv("STARNAVI_MODERATION_CONCURRENCY", default=200))
+    MODERATION_TIMEOUT = float(os.getenv("STARNAVI_MODERATION_TIMEOUT", default=10))
+    GEMINI_TIMEOUT = float(os.getenv("STARNAVI_GEMINI_TIMEOUT", default=MODERATION_TIMEOUT))
+    GEMINI_HEDGE_AFTER = float(os.getenv("STARNAVI_GEMINI_HEDGE_AFTER", default=0))
+    GEMINI_SYNC_WORKERS = int(os.getenv("STARNAVI_GEMINI_SYNC_WORKERS", default=4))
+    BREAKER_WINDOW = int(os.getenv("STARNAVI_BREAKER_WINDOW", default=20))
+    BREAKER_MIN_CALLS = int(os.getenv("STARNAVI_BREAKER_MIN_CALLS", default=10))
+    BREAKER_ERROR_RATIO = float(os.getenv("STARNAVI_BREAKER_ERROR_RATIO", default=0.5))
+    BREAKER_SLOW_SECONDS = float(os.getenv("STARNAVI_BREAKER_SLOW_SECONDS", default=5))
+    BREAKER_SLOW_RATIO = float(os.getenv("STARNAVI_BREAKER_SLOW_RATIO", default=0.5))
+    BREAKER_OPEN_SECONDS = float(os.getenv("STARNAVI_BREAKER_OPEN_SECONDS", default=30))
+    MODERATION_FAIL_OPEN = os.getenv("STARNAVI_MODERATION_FAIL_OPEN", default="false").lower() == "true"
+    ASYNC_MODERATION = os.getenv("STARNAVI_ASYNC_MODERATION", default="false").lower() == "true"
+    ASYNC_MODERATION_BATCH = int(os.getenv("STARNAVI_ASYNC_MODERATION_BATCH", default=100))
+    ASYNC_MODERATION_INTERVAL = int(os.getenv("STARNAVI_ASYNC_MODERATION_INTERVAL", default=1))
+    ASYNC_MODERATION_RETRY = int(os.getenv("STARNAVI_ASYNC_MODERATION_RETRY", default=30))
+    ASYNC_MODERATION_LEASE = int(os.getenv("STARNAVI_ASYNC_MODERATION_LEASE", default=300))
+    ASYNC_MODERATION_LOCK = os.getenv("STARNAVI_ASYNC_MODERATION_LOCK", default="starnavi:moderation_flush")
+    BATCH_MAX_ITEMS = int(os.getenv("STARNAVI_BATCH_MAX_ITEMS", default=100))
+    PREFILTER_ENABLED = os.getenv("STARNAVI_PREFILTER_ENABLED", default="true").lower() == "true"
+    MODERATION_LEXICON = os.getenv("STARNAVI_MODERATION_LEXICON",
+                                   default=os.path.join(os.path.dirname(__file__), "moderation_lexicon.json"))
+    TOKEN_CACHE_SIZE = int(os.getenv("STARNAVI_TOKEN_CACHE_SIZE", default=10000))
+    TOKEN_CACHE_TTL = int(os.getenv("STARNAVI_TOKEN_CACHE_TTL", default=5 * 60))
+    BCRYPT_ROUNDS = int(os.getenv("STARNAVI_BCRYPT_ROUNDS", default=12))
+    BCRYPT_WORKERS = int(os.getenv("STARNAVI_BCRYPT_WORKERS", default=os.cpu_count() or 1))
+    BCRYPT_MAX_QUEUE = int(os.getenv("STARNAVI_BCRYPT_MAX_QUEUE", default=64))
+    REDIS_URL = os.getenv("STARNAVI_REDIS_URL", default=CELERY_BROKER)
+    VERDICT_CACHE_SIZE = int(os.getenv("STARNAVI_VERDICT_CACHE_SIZE", default=10000))
+    VERDICT_ALLOWED_TTL = int(os.getenv("STARNAVI_VERDICT_ALLOWED_TTL", default=24 * 60 * 60))
+    VERDICT_BLOCKED_TTL = int(os.getenv("STARNAVI_VERDICT_BLOCKED_TTL", default=60 * 60))
+    VERDICT_REDIS_PREFIX = os.getenv("STARNAVI_VERDICT_REDIS_PREFIX", default="starnavi:verdict:")
+    AI_REPLY_WINDOW = int(os.getenv("STARNAVI_AI_REPLY_WINDOW", default=60))
+    AI_REPLY_BATCH_SIZE = int(os.getenv("STARNAVI_AI_REPLY_BATCH_SIZE", default=100))
+    AI_REPLY_LOCK_PREFIX = os.getenv("STARNAVI_AI_REPLY_LOCK_PREFIX", default="starnavi:ai_reply:")
+    AI_REPLY_QUEUE = os.getenv("STARNAVI_AI_REPLY_QUEUE", default="starnavi:ai_reply_rows")
+    CELERY_QUEUE = os.getenv("STARNAVI_CELERY_QUEUE", default="celery")
+    WORKER_METRICS_PORT = int(os.getenv("STARNAVI_WORKER_METRICS_PORT", default=0))
+    SQL_PROFILER_ENABLED = os.getenv("STARNAVI_SQL_PROFILER", default="false").lower() == "true"
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("STARNAVI_SQL_N_PLUS_ONE_THRESHOLD", default=5))
+    SLOW_QUERY_MS = float(os.getenv("STARNAVI_SLOW_QUERY_MS", default=100))
+    SLOW_QUERY_LOG = os.getenv("STARNAVI_SLOW_QUERY_LOG", default="starnavi-slow-queries.log")
+    COMMENT_WRITE_BEHIND = os.getenv("STARNAVI_COMMENT_WRITE_BEHIND", default="false").lower() == "true"
+    COMMENT_STREAM = os.getenv("STARNAVI_COMMENT_STREAM", default="starnavi:comment_stream")
+    COMMENT_STREAM_GROUP = os.getenv("STARNAVI_COMMENT_STREAM_GROUP", default="comment-writers")
+    COMMENT_STREAM_BATCH = int(os.getenv("STARNAVI_COMMENT_STREAM_BATCH", default=500))
+    COMMENT_STREAM_CLAIM_IDLE = int(os.getenv("STARNAVI_COMMENT_STREAM_CLAIM_IDLE", default=60))
+    COMMENT_FLUSH_INTERVAL = int(os.getenv("STARNAVI_COMMENT_FLUSH_INTERVAL", default=1))
+    COMMENT_FLUSH_LOCK = os.getenv("STARNAVI_COMMENT_FLUSH_LOCK", default="starnavi:comment_flush")
+    PARTITION_MONTHS_AHEAD = int(os.getenv("STARNAVI_PARTITION_MONTHS_AHEAD", default=3))
+    PARTITION_RETENTION_MONTHS = int(os.getenv("STARNAVI_PARTITION_RETENTION_MONTHS", default=0))
+    PARTITION_DROP_RETIRED = os.getenv("STARNAVI_PARTITION_DROP_RETIRED", default="false").lower() == "true"
+    EXPORT_BATCH_SIZE = int(os.getenv("STARNAVI_EXPORT_BATCH_SIZE", default=1000))
+    SEARCH_PAGE_SIZE = int(os.getenv("STARNAVI_SEARCH_PAGE_SIZE", default=20))
+    SEARCH_MAX_PAGE_SIZE = int(os.getenv("STARNAVI_SEARCH_MAX_PAGE_SIZE", default=100))
+    SEARCH_MAX_CANDIDATES = int(os.getenv("STARNAVI_SEARCH_MAX_CANDIDATES", default=1000))
+    SEARCH_TIMEOUT_MS = int(os.getenv("STARNAVI_SEARCH_TIMEOUT_MS", default=2000))
+    RESOURCE_VERSION_PREFIX = os.getenv("STARNAVI_RESOURCE_VERSION_PREFIX", default="starnavi:version:")
+    REVOKED_USER_PREFIX = os.getenv("STARNAVI_REVOKED_USER_PREFIX", default="starnavi:revoked_user:")
+    REVOCATION_POLL_INTERVAL = float(os.getenv("STARNAVI_REVOCATION_POLL_INTERVAL", default=1))
 except ValueError as v:
     logging.error(f"Environment variable is not set, {v}")
@@ -1,9 +1,28 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from collections import defaultdict
 
-from starnavi.config import DATABASE_URL
+from sqlalchemy import (create_engine, Column, Integer, String, ForeignKey, Boolean, Computed, Date, DateTime, Index,
+                        PrimaryKeyConstraint, event, func, inspect, select, text, update)
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base, deferred, sessionmaker, relationship, Session
+
+from starnavi.cache import resource_versions
+from starnavi.config import (DATABASE_URL, ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE,
+                             SQL_PROFILER_ENABLED)
+from starnavi.metrics import instrument_engine
+from starnavi.profiler import profile_engine, setup_slow_query_log
 from starnavi.mixin import HelperModelMixin
 
+# Posts and comments wait as PENDING while they are moderated in the background; only PUBLISHED ones are listed.
+PENDING = "pending"
+PUBLISHED = "published"
+
+# Text search configuration of the generated search_vector columns; queries must use the same one to hit the index.
+SEARCH_CONFIG = "english"
+POST_SEARCH_VECTOR = (f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+                      f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(content, '')), 'B')")
+COMMENT_SEARCH_VECTOR = f"to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))"
+
 
 class BaseModel(HelperModelMixin):
     pass
@@ -25,41 +44,209 @@ class User(Base):
 
 class Post(Base):
     __tablename__ = 'posts'
+    __table_args__ = (
+        Index('ix_posts_created_at_id', 'created_at', 'id'),
+        Index('ix_posts_user_id', 'user_id'),
+        Index('ix_posts_pending', 'id', postgresql_where=text(f"status = '{PENDING}'")),
+        Index('ix_posts_search_vector', 'search_vector', postgresql_using='gin'),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     title = Column(String, nullable=False)
     content = Column(String, nullable=False)
     should_be_answered = Column(Boolean, default=False)
     time_for_ai_answer = Column(Integer, default=0)
+    status = Column(String, nullable=False, default=PUBLISHED, server_default=PUBLISHED)
+    # Set while a worker moderates the pending row; once it has passed another worker may claim the row again.
+    claimed_until = Column(DateTime(timezone=True))
+    # Published comments of the post, kept up to date by the session events below in the same transaction.
+    comment_count = Column(Integer, nullable=False, default=0, server_default='0')
+    last_comment_at = Column(DateTime(timezone=True))
+    search_vector = deferred(Column(TSVECTOR, Computed(POST_SEARCH_VECTOR, persisted=True)))
     owner = relationship("User", back_populates="posts")
     comments = relationship("Comment", back_populates="post")
     blocked_content = relationship("ContentBlocked", back_populates="post", uselist=False)
 
 
 class Comment(Base):
+    # Partitioned by month on created_at (see database/partitions.py), so the primary key has to include it.
     __tablename__ = 'comments'
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        PrimaryKeyConstraint('id', 'created_at'),
+        Index('ix_comments_post_id_created_at_id', 'post_id', 'created_at', 'id'),
+        Index('ix_comments_created_at', 'created_at'),
+        Index('ix_comments_user_id', 'user_id'),
+        Index('ix_comments_pending', 'id', postgresql_where=text(f"status = '{PENDING}'")),
+        Index('ix_comments_search_vector', 'search_vector', postgresql_using='gin'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+    __mapper_args__ = {'primary_key': ['id']}
+    id = Column(Integer, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), unique=False)
     post_id = Column(Integer, ForeignKey('posts.id'))
     content = Column(String, nullable=False)
+    status = Column(String, nullable=False, default=PUBLISHED, server_default=PUBLISHED)
+    claimed_until = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    search_vector = deferred(Column(TSVECTOR, Computed(COMMENT_SEARCH_VECTOR, persisted=True)))
     post = relationship("Post", back_populates="comments")
     author = relationship("User", back_populates="comments")
 
 
 class ContentBlocked(Base):
     __tablename__ = 'block_contents'
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        PrimaryKeyConstraint('id', 'created_at'),
+        Index('ix_block_contents_comment_created_at', 'created_at', postgresql_where=text('post_id IS NOT NULL')),
+        Index('ix_block_contents_post_id', 'post_id'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+    __mapper_args__ = {'primary_key': ['id']}
+    id = Column(Integer, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     post_id = Column(Integer, ForeignKey('posts.id'), nullable=True, default=None)
     content = Column(String, nullable=False)
     title = Column(String)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     post = relationship("Post", back_populates="blocked_content")
     author = relationship("User", back_populates="blocked_contents")
 
 
-engine = create_engine(DATABASE_URL)
+class CommentDailyStats(Base):
+    __tablename__ = 'comment_daily_stats'
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, unique=True, nullable=False)
+    created_comments = Column(Integer, nullable=False, default=0, server_default='0')
+    blocked_comments = Column(Integer, nullable=False, default=0, server_default='0')
+
+
+def stats_day(obj):
+    return obj.created_at.date() if obj.created_at is not None else None
+
+
+@event.listens_for(Session, "before_flush")
+def collect_daily_stats(session, flush_context, instances):
+    deltas = defaultdict(lambda: [0, 0])
+    for objs, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objs:
+            if isinstance(obj, Comment):
+                deltas[stats_day(obj)][0] += sign
+            elif isinstance(obj, ContentBlocked) and obj.post_id is not None:
+                deltas[stats_day(obj)][1] += sign
+    session.info["daily_stats"] = deltas
+
+
+def upsert_daily_stats(session, deltas):
+    """Add {day: [created, blocked]} deltas to comment_daily_stats; None stands for the database's current date."""
+    for day, (created, blocked) in deltas.items():
+        if not created and not blocked:
+            continue
+        stmt = insert(CommentDailyStats).values(day=day if day is not None else func.current_date(),
+                                                created_comments=created, blocked_comments=blocked)
+        stmt = stmt.on_conflict_do_update(index_elements=[CommentDailyStats.day], set_={
+            "created_comments": CommentDailyStats.created_comments + stmt.excluded.created_comments,
+            "blocked_comments": CommentDailyStats.blocked_comments + stmt.excluded.blocked_comments,
+        })
+        session.execute(stmt)
+        session.info.setdefault("changed_tables", set()).add(CommentDailyStats.__tablename__)
+
+
+@event.listens_for(Session, "after_flush")
+def apply_daily_stats(session, flush_context):
+    upsert_daily_stats(session, session.info.pop("daily_stats", {}))
+
+
+def count_comment(counts, comment, sign):
+    if comment.post_id is None:
+        return
+    entry = counts[comment.post_id]
+    entry[0] += sign
+    if sign > 0:
+        entry[1].append(comment.created_at)
+    else:
+        entry[2] = True
+
+
+@event.listens_for(Session, "before_flush")
+def collect_comment_counts(session, flush_context, instances):
+    # {post_id: [delta, created_at of the added comments, removed]} for the published comments this flush changes.
+    counts = defaultdict(lambda: [0, [], False])
+    for obj in session.new:
+        if isinstance(obj, Comment) and obj.status in (None, PUBLISHED):
+            count_comment(counts, obj, 1)
+    for obj in session.dirty:
+        if isinstance(obj, Comment) and PUBLISHED in inspect(obj).attrs.status.history.added:
+            count_comment(counts, obj, 1)
+    for obj in session.deleted:
+        if isinstance(obj, Comment) and obj.status == PUBLISHED:
+            count_comment(counts, obj, -1)
+    session.info["comment_counts"] = counts
+
+
+def update_comment_counts(session, counts):
+    """Apply {post_id: [delta, created_at of added comments, removed]} to posts.comment_count and last_comment_at.
+
+    A created_at of None stands for the database's current time. Posts are updated in id order so concurrent flushes
+    cannot deadlock on them; after a removal the latest comment is looked up again.
+    """
+    for post_id in sorted(counts):
+        delta, added, removed = counts[post_id]
+        if removed:
+            last_comment_at = select(func.max(Comment.created_at)).where(
+                Comment.post_id == post_id, Comment.status == PUBLISHED).scalar_subquery()
+        else:
+            known = [created_at for created_at in added if created_at is not None]
+            newest = ([max(known)] if known else []) + ([func.now()] if len(known) < len(added) else [])
+            last_comment_at = func.greatest(Post.last_comment_at, *newest)
+        session.execute(update(Post).where(Post.id == post_id).values(
+            comment_count=Post.comment_count + delta, last_comment_at=last_comment_at
+        ).execution_options(synchronize_session=False))
+        session.info.setdefault("changed_tables", set()).add(Post.__tablename__)
+
+
+@event.listens_for(Session, "after_flush")
+def apply_comment_counts(session, flush_context):
+    update_comment_counts(session, session.info.pop("comment_counts", {}))
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_tables(session, flush_context):
+    changed = session.info.setdefault("changed_tables", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        changed.add(obj.__table__.name)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_changed_tables(session, previous_transaction):
+    session.info.pop("changed_tables", None)
+
+
+class VersionedAsyncSession(AsyncSession):
+    """Bumps the shared version of every table a transaction wrote once it has committed."""
+
+    async def commit(self):
+        await super().commit()
+        changed = self.sync_session.info.pop("changed_tables", None)
+        if changed:
+            await resource_versions.bump(*sorted(changed))
+
+
+engine = create_engine(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                       pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                                   pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=VersionedAsyncSession, expire_on_commit=False)
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+if SQL_PROFILER_ENABLED:
+    setup_slow_query_log()
+    profile_engine(engine)
+    profile_engine(async_engine.sync_engine)
+
 
 def get_session():
     session = SessionLocal()
@@ -67,3 +254,8 @@ def get_session():
         yield session
     finally:
         session.close()
+
+
+async def get_async_session():
+    async with AsyncSessionLocal() as session:
+        yield session
@@ -0,0 +1,108 @@
+"""Monthly range partitions of the append-mostly tables on created_at.
+
+Partitions are named <table>_y<year>m<month> and cover [first day of the month, first day of the next month) in UTC.
+"""
+import logging
+import re
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+
+PARTITIONED_TABLES = ("comments", "block_contents")
+PARTITION_NAME = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    years, month_index = divmod(month.month - 1 + count, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def current_month():
+    return month_start(datetime.now(timezone.utc).date())
+
+
+def list_partitions(connection, table):
+    """{partition name: month} of the partitions currently attached to `table`."""
+    rows = connection.execute(text("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        WHERE parent.relname = :table
+    """), {"table": table}).scalars()
+    partitions = {}
+    for name in rows:
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+def create_partitions(connection, table, first_month, last_month):
+    """Create the missing monthly partitions of `table` from `first_month` to `last_month` inclusive."""
+    existing = list_partitions(connection, table)
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        name = partition_name(table, month)
+        if name not in existing:
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month} 00:00:00+00') TO ('{add_months(month, 1)} 00:00:00+00')"))
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_partitions(connection, months_ahead, since=None):
+    """Make sure every partitioned table has partitions from `since` (default: this month) to `months_ahead` ahead."""
+    first_month = month_start(since) if since else current_month()
+    last_month = add_months(current_month(), months_ahead)
+    created = []
+    for table in PARTITIONED_TABLES:
+        created += create_partitions(connection, table, first_month, last_month)
+    return created
+
+
+def ensure_partitions_between(connection, first_day, last_day):
+    """Make sure every partitioned table has partitions for the days `first_day`..`last_day`, e.g. before importing
+    historical rows. One month of margin on each side covers timestamps whose UTC month differs from their date."""
+    created = []
+    for table in PARTITIONED_TABLES:
+        created += create_partitions(connection, table, add_months(month_start(first_day), -1),
+                                     add_months(month_start(last_day), 1))
+    return created
+
+
+def retire_partitions(connection, keep_months, drop=False):
+    """Detach partitions that ended more than `keep_months` ago, and drop them with `drop`.
+
+    Detached partitions stay as plain tables for archiving; comment_daily_stats keeps their counts either way.
+    """
+    cutoff = add_months(current_month(), -keep_months)
+    retired = []
+    for table in PARTITIONED_TABLES:
+        for name, month in sorted(list_partitions(connection, table).items(), key=lambda item: item[1]):
+            if add_months(month, 1) > cutoff:
+                continue
+            connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            if drop:
+                connection.execute(text(f"DROP TABLE {name}"))
+            logging.info(f"Partition {name} {'dropped' if drop else 'detached'}")
+            retired.append(name)
+    return retired
+
+
+def maintain(connection, months_ahead, keep_months=0, drop=False):
+    """Create upcoming partitions and retire old ones (keep_months=0 keeps everything); safe to run concurrently."""
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('starnavi_partitions'))"))
+    created = ensure_partitions(connection, months_ahead)
+    retired = retire_partitions(connection, keep_months, drop) if keep_months else []
+    return {"created": created, "retired": retired}
@@ -1,54 +1,85 @@
+import asyncio
 import logging
-from collections import defaultdict
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, date
-from typing import List
+from typing import List, Optional
 
 import jwt
 import uvicorn
-from fastapi import FastAPI, HTTPException, requests, Depends, Query
-from sqlalchemy import func, and_
-from sqlalchemy.orm import Session
-
-from starnavi.database.db import Post, User, ContentBlocked, Comment, get_session
-from starnavi.services import analyze_content
-from starnavi.celery_app.tasks import send_automatic_reply
-from starnavi.utils import (email_check, encryption, ALGORITHM, JWT_SECRET, get_validated_user_id, validate_jwt_token,
-                            insert_into_db, create_ai_user_in_db)
+from fastapi import FastAPI, HTTPException, requests, Depends, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, tuple_, select
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from starnavi.cache import verdict_cache, redis_client, revoked_users
+from starnavi.config import (POSTS_PAGE_SIZE, POSTS_MAX_PAGE_SIZE, COMMENTS_PER_POST, COMMENTS_PAGE_SIZE,
+                             COMMENTS_MAX_PAGE_SIZE, TOKEN_LIFETIME_MINUTES,
+                             BCRYPT_WORKERS, BCRYPT_MAX_QUEUE, CELERY_QUEUE, AI_REPLY_QUEUE, SQL_PROFILER_ENABLED,
+                             EXPORT_BATCH_SIZE, COMMENT_WRITE_BEHIND, COMMENT_STREAM, ASYNC_MODERATION,
+                             SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, SEARCH_MAX_CANDIDATES, ANALYTICS_MAX_DAYS)
+from starnavi.database.db import (Post, User, ContentBlocked, Comment, CommentDailyStats, PENDING, PUBLISHED,
+                                  get_async_session)
+from starnavi.celery_app.tasks import flush_comment_stream
+from starnavi.metrics import MetricsMiddleware, QUEUE_DEPTH, COMMENT_STREAM_LAG, COMMENT_STREAM_AGE, render_metrics
+from starnavi.profiler import SQLProfilerMiddleware
+from starnavi.serialization import RowsResponse, model_columns, rows_as_dicts
+from starnavi.services import moderation_pipeline, gemini_breaker
+from starnavi.utils import (email_check, hash_password, verify_password, ALGORITHM, JWT_SECRET, get_validated_user_id,
+                            validate_jwt_token, insert_into_db_async, insert_all_into_db_async, create_ai_user_in_db,
+                            moderate, moderate_many, encode_cursor, decode_cursor, attach_latest_comments,
+                            attach_latest_comment_rows, resource_etag, etag_matches, stream_export, enqueue_comment,
+                            schedule_automatic_reply, schedule_pending_moderation, search_content, password_jobs)
 from starnavi.models import (PostCreate, CommentCreate, UserCreate, UserLogin, PostRemove, CommentRemove, PostEdit,
-                             CommentEdit, PostModel, ContentBlockedModel, CommentModel, UserModel, CommentAnalytics)
+                             CommentEdit, PostModel, ContentBlockedModel, CommentModel, UserModel, CommentAnalytics,
+                             PostBatchCreate, CommentBatchCreate, BatchItemResult, SearchResult)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await revoked_users.refresh()
+    yield
+    if COMMENT_WRITE_BEHIND:
+        flushed = await asyncio.to_thread(flush_comment_stream)
+        logging.info(f"Flushed {flushed} write-behind comments on shutdown")
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+if SQL_PROFILER_ENABLED:
+    app.add_middleware(SQLProfilerMiddleware)
 logging.basicConfig(filename='starnavi.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 @app.post("/create_users/")
-async def create_user(user: UserCreate, session: Session = Depends(get_session)):
-    if session.query(User).first() is None:
-        create_ai_user_in_db(session)
+async def create_user(user: UserCreate, session: AsyncSession = Depends(get_async_session)):
+    if await session.scalar(select(User.id).limit(1)) is None:
+        await create_ai_user_in_db(session)
 
     if not email_check(user.email):
         raise HTTPException(status_code=401, detail=f"The email {user.email} is invalid")
 
-    email = session.query(User).filter(User.email == user.email).first()
+    email = await session.scalar(select(User).where(User.email == user.email))
     if email:
         raise HTTPException(status_code=409, detail=f"User already exists with {user.email}")
 
-    hashed_password = encryption(user.password)
+    hashed_password = await hash_password(user.password)
     new_user = User(name=user.name, email=user.email, password=hashed_password)
-    insert_into_db(new_user, session)
+    await insert_into_db_async(new_user, session)
     return {"status_code": 200, "message": "success"}
 
 
 @app.post("/login/")
-async def login(user_login: UserLogin, session: Session = Depends(get_session)):
-    hashed_password = encryption(user_login.password)
-    user = session.query(User).filter(User.email == user_login.email and User.password == hashed_password).first()
-    if not user:
+async def login(user_login: UserLogin, session: AsyncSession = Depends(get_async_session)):
+    user = await session.scalar(select(User).where(User.email == user_login.email))
+    if not user or not await verify_password(user_login.password, user.password):
         raise HTTPException(status_code=401, detail=f"The credentials are invalid")
 
     payload = {
         "email": user.email,
-        "exp": datetime.utcnow() + timedelta(minutes=30)
+        "user_id": user.id,
+        "exp": datetime.utcnow() + timedelta(minutes=TOKEN_LIFETIME_MINUTES)
     }
     token = jwt.encode(payload, JWT_SECRET, algorithm=ALGORITHM)
 
@@ -57,194 +88,475 @@ async def login(user_login: UserLogin, session: Session = Depends(get_session)):
 
 
 @app.post("/posts/", response_model=PostModel)
-async def create_post(post: PostCreate, request: requests.Request, session: Session = Depends(get_session)):
+async def create_post(post: PostCreate, request: requests.Request, response: Response,
+                      session: AsyncSession = Depends(get_async_session)):
     user_id = await get_validated_user_id(request.headers, session)
-    if not analyze_content(post.content, post.title):
+    if ASYNC_MODERATION:
+        new_post = Post(user_id=user_id, title=post.title, content=post.content,
+                        should_be_answered=post.should_be_answered, time_for_ai_answer=post.time_for_ai_answer,
+                        status=PENDING, comment_count=0, comments=[])
+        await insert_into_db_async(new_post, session)
+        await schedule_pending_moderation()
+        response.status_code = 202
+        return new_post
+
+    if not await moderate(post.content, post.title):
         new_block_content = ContentBlocked(user_id=user_id, title=post.title, content=post.content)
-        insert_into_db(new_block_content, session)
+        await insert_into_db_async(new_block_content, session)
         raise HTTPException(status_code=403, detail="Post was blocked")
 
     new_post = Post(user_id=user_id, title=post.title, content=post.content, should_be_answered=post.should_be_answered,
-                    time_for_ai_answer=post.time_for_ai_answer)
-    insert_into_db(new_post, session)
+                    time_for_ai_answer=post.time_for_ai_answer, status=PUBLISHED, comment_count=0, comments=[])
+    await insert_into_db_async(new_post, session)
     return new_post
 
 
+@app.post("/posts/batch", response_model=List[BatchItemResult])
+async def create_posts_batch(batch: PostBatchCreate, request: requests.Request, response: Response,
+                             session: AsyncSession = Depends(get_async_session)):
+    user_id = await get_validated_user_id(request.headers, session)
+    if ASYNC_MODERATION:
+        ids = await insert_all_into_db_async([
+            Post(user_id=user_id, title=post.title, content=post.content, should_be_answered=post.should_be_answered,
+                 time_for_ai_answer=post.time_for_ai_answer, status=PENDING) for post in batch.items], session)
+        await schedule_pending_moderation()
+        response.status_code = 202
+        return [BatchItemResult(index=index, status=PENDING, id=row_id) for index, row_id in enumerate(ids)]
+
+    verdicts = await moderate_many((post.content, post.title) for post in batch.items)
+
+    results, rows = [], []
+    for index, (post, allowed) in enumerate(zip(batch.items, verdicts)):
+        if isinstance(allowed, Exception):
+            results.append(BatchItemResult(index=index, status="error",
+                                           detail=getattr(allowed, "detail", "Moderation failed")))
+        elif allowed:
+            results.append(BatchItemResult(index=index, status="created"))
+            rows.append((index, Post(user_id=user_id, title=post.title, content=post.content,
+                                     should_be_answered=post.should_be_answered,
+                                     time_for_ai_answer=post.time_for_ai_answer)))
+        else:
+            results.append(BatchItemResult(index=index, status="blocked", detail="Post was blocked"))
+            rows.append((index, ContentBlocked(user_id=user_id, title=post.title, content=post.content)))
+
+    ids = await insert_all_into_db_async([row for _, row in rows], session) if rows else []
+    for (index, _), row_id in zip(rows, ids):
+        results[index].id = row_id
+    return results
+
+
 @app.post("/edit_post/", response_model=PostModel)
-async def edit_post(edit: PostEdit, request: requests.Request, session: Session = Depends(get_session)):
+async def edit_post(edit: PostEdit, request: requests.Request, session: AsyncSession = Depends(get_async_session)):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
 
-    post = session.query(Post).filter(Post.id == edit.id).first()
+    post = await session.get(Post, edit.id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    if not analyze_content(edit.content):
+    if not await moderate(edit.content):
         new_block_content = ContentBlocked(user_id=post.user_id, content=edit.content)
-        insert_into_db(new_block_content, session)
+        await insert_into_db_async(new_block_content, session)
         raise HTTPException(status_code=403, detail="Post content was blocked")
     post.content = edit.content
-    session.commit()
+    await session.commit()
+    await attach_latest_comments([post], session, COMMENTS_PER_POST)
     return post
 
 
 @app.post("/remove_post/")
-async def remove_post(remove: PostRemove, request: requests.Request, session: Session = Depends(get_session)):
+async def remove_post(remove: PostRemove, request: requests.Request,
+                      session: AsyncSession = Depends(get_async_session)):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
 
-    post = session.query(Post).filter(Post.id == remove.id).first()
+    post = await session.get(Post, remove.id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    session.delete(post)
-    session.commit()
+    await session.delete(post)
+    await session.commit()
     return {"status_code": 200, "message": "Post was deleted"}
 
 
 @app.post("/comments/", response_model=CommentModel)
-async def create_comment(comment: CommentCreate, request: requests.Request, session: Session = Depends(get_session)):
+async def create_comment(comment: CommentCreate, request: requests.Request, response: Response,
+                         session: AsyncSession = Depends(get_async_session)):
     user_id = await get_validated_user_id(request.headers, session)
 
-    if not analyze_content(comment.content):
+    if ASYNC_MODERATION:
+        post = await session.get(Post, comment.post_id)
+        if not post or post.status != PUBLISHED:
+            raise HTTPException(status_code=404, detail="Post not found")
+        new_comment = Comment(user_id=user_id, post_id=comment.post_id, content=comment.content, status=PENDING)
+        await insert_into_db_async(new_comment, session)
+        await schedule_pending_moderation()
+        response.status_code = 202
+        return new_comment
+
+    if not await moderate(comment.content):
         new_block_content = ContentBlocked(user_id=user_id, post_id=comment.post_id, content=comment.content)
-        insert_into_db(new_block_content, session)
+        await insert_into_db_async(new_block_content, session)
         raise HTTPException(status_code=403, detail="Comment was blocked")
 
-    post = session.query(Post).filter(Post.id == comment.post_id).first()
+    post = await session.get(Post, comment.post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    new_comment = Comment(user_id=user_id, post_id=comment.post_id, content=comment.content)
-    insert_into_db(new_comment, session)
+    new_comment = Comment(user_id=user_id, post_id=comment.post_id, content=comment.content, status=PUBLISHED)
+    if COMMENT_WRITE_BEHIND and await enqueue_comment(new_comment, session):
+        response.status_code = 202
+    else:
+        await insert_into_db_async(new_comment, session)
 
     if post.should_be_answered:
-        send_automatic_reply.apply_async((post.content, post.title, comment.post_id), countdown=post.time_for_ai_answer)
+        await schedule_automatic_reply(post)
 
     return new_comment
 
 
+@app.post("/comments/batch", response_model=List[BatchItemResult])
+async def create_comments_batch(batch: CommentBatchCreate, request: requests.Request, response: Response,
+                                session: AsyncSession = Depends(get_async_session)):
+    user_id = await get_validated_user_id(request.headers, session)
+
+    post_ids = {comment.post_id for comment in batch.items}
+    posts = {post.id: post for post in (await session.scalars(select(Post).where(Post.id.in_(post_ids)))).all()}
+    known = [(index, comment) for index, comment in enumerate(batch.items) if comment.post_id in posts]
+
+    if ASYNC_MODERATION:
+        known = [(index, comment) for index, comment in known if posts[comment.post_id].status == PUBLISHED]
+        results = [BatchItemResult(index=index, status="error", detail="Post not found")
+                   for index in range(len(batch.items))]
+        ids = await insert_all_into_db_async([
+            Comment(user_id=user_id, post_id=comment.post_id, content=comment.content, status=PENDING)
+            for _, comment in known], session) if known else []
+        for (index, _), row_id in zip(known, ids):
+            results[index] = BatchItemResult(index=index, status=PENDING, id=row_id)
+        if ids:
+            await schedule_pending_moderation()
+            response.status_code = 202
+        return results
+
+    verdicts = await moderate_many((comment.content, "") for _, comment in known)
+
+    results = [BatchItemResult(index=index, status="error", detail="Post not found")
+               for index in range(len(batch.items))]
+    rows, answered = [], {}
+    for (index, comment), allowed in zip(known, verdicts):
+        if isinstance(allowed, Exception):
+            results[index].detail = getattr(allowed, "detail", "Moderation failed")
+        elif allowed:
+            results[index] = BatchItemResult(index=index, status="created")
+            rows.append((index, Comment(user_id=user_id, post_id=comment.post_id, content=comment.content)))
+            answered[comment.post_id] = posts[comment.post_id]
+        else:
+            results[index] = BatchItemResult(index=index, status="blocked", detail="Comment was blocked")
+            rows.append((index, ContentBlocked(user_id=user_id, post_id=comment.post_id, content=comment.content)))
+
+    ids = await insert_all_into_db_async([row for _, row in rows], session) if rows else []
+    for (index, _), row_id in zip(rows, ids):
+        results[index].id = row_id
+
+    for post in answered.values():
+        if post.should_be_answered:
+            await schedule_automatic_reply(post)
+
+    return results
+
+
 @app.post("/edit_comment/", response_model=CommentModel)
-async def edit_comment(edit: CommentEdit, request: requests.Request, session: Session = Depends(get_session)):
+async def edit_comment(edit: CommentEdit, request: requests.Request,
+                       session: AsyncSession = Depends(get_async_session)):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
 
-    post = session.query(Post).filter(Post.id == edit.post_id).first()
+    post = await session.get(Post, edit.post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    comment = session.query(Comment).filter(Comment.id == edit.comment_id).first()
+    comment = await session.get(Comment, edit.comment_id)
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
 
-    if not analyze_content(edit.content):
+    if not await moderate(edit.content):
         new_block_content = ContentBlocked(user_id=post.user_id, post_id=post.id, content=edit.content)
-        insert_into_db(new_block_content, session)
+        await insert_into_db_async(new_block_content, session)
         raise HTTPException(status_code=403, detail="Comment was blocked")
 
     comment.content = edit.content
-    session.commit()
+    await session.commit()
     return comment
 
 
 @app.post("/remove_comment/")
-async def remove_comment(remove: CommentRemove, request: requests.Request, session: Session = Depends(get_session)):
+async def remove_comment(remove: CommentRemove, request: requests.Request,
+                         session: AsyncSession = Depends(get_async_session)):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
 
-    post = session.query(Post).filter(Post.id == remove.post_id).first()
+    post = await session.get(Post, remove.post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    comment = session.query(Comment).filter(Comment.id == remove.comment_id).first()
+    comment = await session.get(Comment, remove.comment_id)
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
 
-    session.delete(comment)
-    session.commit()
+    await session.delete(comment)
+    await session.commit()
     return {"status_code": 200, "message": "Comment was deleted"}
 
 
 @app.get("/posts/", response_model=List[PostModel])
-async def get_posts(request: requests.Request, session: Session = Depends(get_session)):
+async def get_posts(
+        request: requests.Request,
+        limit: int = Query(POSTS_PAGE_SIZE, ge=1, le=POSTS_MAX_PAGE_SIZE),
+        cursor: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page"),
+        comments_limit: int = Query(COMMENTS_PER_POST, ge=0, le=COMMENTS_PER_POST),
+        session: AsyncSession = Depends(get_async_session)
+):
+    data = await validate_jwt_token(request.headers)
+    if not data:
+        raise HTTPException(status_code=401, detail="Invalid Authentication token!")
+
+    etag = await resource_etag(request, Post.__tablename__, Comment.__tablename__)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    query = select(*model_columns(Post, PostModel)).where(Post.status == PUBLISHED)
+    if cursor:
+        created_at, post_id = decode_cursor(cursor)
+        query = query.where(tuple_(Post.created_at, Post.id) < (created_at, post_id))
+
+    posts = rows_as_dicts(await session.execute(
+        query.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit + 1)
+    ))
+    headers = {"ETag": etag} if etag else {}
+    if len(posts) > limit:
+        posts = posts[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(posts[-1]["created_at"], posts[-1]["id"])
+
+    await attach_latest_comment_rows(posts, session, comments_limit)
+    return RowsResponse(posts, headers=headers)
+
+
+@app.get("/posts/{post_id}/comments", response_model=List[CommentModel])
+async def get_post_comments(
+        post_id: int,
+        request: requests.Request,
+        limit: int = Query(COMMENTS_PAGE_SIZE, ge=1, le=COMMENTS_MAX_PAGE_SIZE),
+        cursor: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page"),
+        session: AsyncSession = Depends(get_async_session)
+):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
-    return session.query(Post).all()
+
+    etag = await resource_etag(request, Post.__tablename__, Comment.__tablename__)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    post = (await session.execute(select(Post.status, Post.comment_count).where(Post.id == post_id))).first()
+    if not post or post.status != PUBLISHED:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    query = select(*model_columns(Comment, CommentModel)).where(Comment.post_id == post_id,
+                                                                Comment.status == PUBLISHED)
+    if cursor:
+        created_at, comment_id = decode_cursor(cursor)
+        # The plain created_at bound lets Postgres skip the monthly partitions before the cursor.
+        query = query.where(Comment.created_at >= created_at,
+                            tuple_(Comment.created_at, Comment.id) > (created_at, comment_id))
+
+    comments = rows_as_dicts(await session.execute(
+        query.order_by(Comment.created_at, Comment.id).limit(limit + 1)
+    ))
+    headers = {"X-Total-Count": str(post.comment_count)}
+    if etag:
+        headers["ETag"] = etag
+    if len(comments) > limit:
+        comments = comments[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(comments[-1]["created_at"], comments[-1]["id"])
+    return RowsResponse(comments, headers=headers)
 
 
 @app.get("/blocked/", response_model=List[ContentBlockedModel])
-async def get_blocked(request: requests.Request, session: Session = Depends(get_session)):
+async def get_blocked(request: requests.Request, session: AsyncSession = Depends(get_async_session)):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
-    return session.query(ContentBlocked).all()
+
+    etag = await resource_etag(request, ContentBlocked.__tablename__)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    rows = await session.execute(select(*model_columns(ContentBlocked, ContentBlockedModel)))
+    return RowsResponse(rows_as_dicts(rows), headers={"ETag": etag} if etag else None)
 
 
 @app.get("/comments/", response_model=List[CommentModel])
-async def get_comments(request: requests.Request, session: Session = Depends(get_session)):
+async def get_comments(request: requests.Request, session: AsyncSession = Depends(get_async_session)):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
-    return session.query(Comment).all()
+
+    etag = await resource_etag(request, Comment.__tablename__)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    rows = await session.execute(select(*model_columns(Comment, CommentModel)).where(Comment.status == PUBLISHED))
+    return RowsResponse(rows_as_dicts(rows), headers={"ETag": etag} if etag else None)
 
 
 @app.get("/users/", response_model=List[UserModel])
-async def get_users(request: requests.Request, session: Session = Depends(get_session)):
+async def get_users(request: requests.Request, session: AsyncSession = Depends(get_async_session)):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
-    return session.query(User).all()
+    rows = await session.execute(select(*model_columns(User, UserModel)))
+    return RowsResponse(rows_as_dicts(rows))
+
+
+@app.get("/search", response_model=List[SearchResult])
+async def search(
+        request: requests.Request,
+        q: str = Query(..., min_length=1, max_length=200, description="Search terms, web search syntax"),
+        kind: Optional[str] = Query(None, pattern="^(post|comment)$", description="Only posts or only comments"),
+        limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+        offset: int = Query(0, ge=0, le=SEARCH_MAX_CANDIDATES),
+        session: AsyncSession = Depends(get_async_session)
+):
+    data = await validate_jwt_token(request.headers)
+    if not data:
+        raise HTTPException(status_code=401, detail="Invalid Authentication token!")
+
+    etag = await resource_etag(request, Post.__tablename__, Comment.__tablename__)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    kinds = {kind} if kind else {"post", "comment"}
+    results = await search_content(session, q, kinds, limit + 1, offset)
+    headers = {"ETag": etag} if etag else {}
+    if len(results) > limit:
+        results = results[:limit]
+        if offset + limit <= SEARCH_MAX_CANDIDATES:
+            headers["X-Next-Offset"] = str(offset + limit)
+    return RowsResponse(results, headers=headers)
+
+
+@app.get("/export/posts")
+async def export_posts(request: requests.Request,
+                       since: Optional[datetime] = Query(None, description="Only rows created or updated since")):
+    data = await validate_jwt_token(request.headers)
+    if not data:
+        raise HTTPException(status_code=401, detail="Invalid Authentication token!")
+    return StreamingResponse(stream_export(Post, PostModel, since, EXPORT_BATCH_SIZE),
+                             media_type="application/x-ndjson")
+
+
+@app.get("/export/comments")
+async def export_comments(request: requests.Request,
+                          since: Optional[datetime] = Query(None, description="Only rows created or updated since")):
+    data = await validate_jwt_token(request.headers)
+    if not data:
+        raise HTTPException(status_code=401, detail="Invalid Authentication token!")
+    return StreamingResponse(stream_export(Comment, CommentModel, since, EXPORT_BATCH_SIZE),
+                             media_type="application/x-ndjson")
+
+
+@app.get("/export/blocked")
+async def export_blocked(request: requests.Request,
+                         since: Optional[datetime] = Query(None, description="Only rows created or updated since")):
+    data = await validate_jwt_token(request.headers)
+    if not data:
+        raise HTTPException(status_code=401, detail="Invalid Authentication token!")
+    return StreamingResponse(stream_export(ContentBlocked, ContentBlockedModel, since, EXPORT_BATCH_SIZE),
+                             media_type="application/x-ndjson")
 
 
 @app.get("/api/comments-daily-breakdown", response_model=List[CommentAnalytics])
 async def get_comments_daily_breakdown(
         request: requests.Request,
+        response: Response,
         date_from: date = Query(..., description="Start date in format YYYY-MM-DD"),
         date_to: date = Query(..., description="End date in format YYYY-MM-DD"),
-        session: Session = Depends(get_session)
+        session: AsyncSession = Depends(get_async_session)
 ):
     data = await validate_jwt_token(request.headers)
     if not data:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
 
-    created_comments = session.query(
-        func.date(Comment.created_at).label('date'),
-        func.count(Comment.id).label('count')
-    ).filter(
-        and_(Comment.created_at >= date_from, Comment.created_at <= date_to)
-    ).group_by(func.date(Comment.created_at)).all()
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    if (date_to - date_from).days >= ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"The range must not exceed {ANALYTICS_MAX_DAYS} days")
 
-    blocked_comments = session.query(
-        func.date(ContentBlocked.created_at).label('date'),
-        func.count(ContentBlocked.id).label('count')
-    ).filter(
-        and_(ContentBlocked.created_at >= date_from, ContentBlocked.created_at <= date_to,
-             ContentBlocked.post_id.isnot(None))
-    ).group_by(func.date(ContentBlocked.created_at)).all()
+    etag = await resource_etag(request, CommentDailyStats.__tablename__)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if etag:
+        response.headers["ETag"] = etag
 
-    analytics = defaultdict(lambda: {"created": 0, "blocked": 0})
-
-    for comment in created_comments:
-        analytics[comment.date]["created"] += comment.count
-
-    for comment in blocked_comments:
-        analytics[comment.date]["blocked"] += comment.count
+    rows = (await session.scalars(select(CommentDailyStats).where(
+        and_(CommentDailyStats.day >= date_from, CommentDailyStats.day <= date_to)
+    ))).all()
+    stats = {row.day: row for row in rows}
 
     result = []
-    for comment_date, counts in analytics.items():
+    for offset in range((date_to - date_from).days + 1):
+        day = date_from + timedelta(days=offset)
+        row = stats.get(day)
         result.append(CommentAnalytics(
-            date=comment_date.strftime('%Y-%m-%d'),
-            created_comments=counts["created"],
-            blocked_comments=counts["blocked"]
+            date=day.strftime('%Y-%m-%d'),
+            created_comments=row.created_comments if row else 0,
+            blocked_comments=row.blocked_comments if row else 0
         ))
 
     return result
 
 
+@app.get("/api/auth-stats")
+async def get_auth_stats(request: requests.Request):
+    data = await validate_jwt_token(request.headers)
+    if not data:
+        raise HTTPException(status_code=401, detail="Invalid Authentication token!")
+    return {"password_queue_depth": password_jobs["pending"], "password_workers": BCRYPT_WORKERS,
+            "password_queue_limit": BCRYPT_MAX_QUEUE}
+
+
+@app.get("/api/moderation-stats")
+async def get_moderation_stats(request: requests.Request):
+    data = await validate_jwt_token(request.headers)
+    if not data:
+        raise HTTPException(status_code=401, detail="Invalid Authentication token!")
+    return {"pipeline": moderation_pipeline.stats,
+            "cache": {**verdict_cache.stats, "local_size": len(verdict_cache.local)},
+            "circuit": gemini_breaker.stats}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    if redis_client is not None:
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                depths = await pipe.llen(CELERY_QUEUE).llen(AI_REPLY_QUEUE).execute()
+            for queue, depth in zip((CELERY_QUEUE, AI_REPLY_QUEUE), depths):
+                QUEUE_DEPTH.labels(queue).set(depth)
+            if COMMENT_WRITE_BEHIND:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    lag, oldest = await pipe.xlen(COMMENT_STREAM).xrange(COMMENT_STREAM, count=1).execute()
+                COMMENT_STREAM_LAG.set(lag)
+                COMMENT_STREAM_AGE.set(time.time() - int(oldest[0][0].split(b"-")[0]) / 1000 if oldest else 0)
+        except RedisError as e:
+            logging.warning(f"Queue depth could not be read: {e}")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, log_level="info")
@@ -0,0 +1,102 @@
+import os
+import time
+from contextvars import ContextVar
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess, start_http_server)
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUEST_SECONDS = Histogram("starnavi_request_seconds", "HTTP request latency", ["method", "route"],
+                            buckets=LATENCY_BUCKETS)
+REQUESTS = Counter("starnavi_requests", "HTTP requests by status", ["method", "route", "status"])
+REQUEST_DB_QUERIES = Histogram("starnavi_request_db_queries", "Database queries issued per request", ["route"],
+                               buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("starnavi_request_db_seconds", "Time spent in the database per request", ["route"],
+                               buckets=LATENCY_BUCKETS)
+MODERATION_SECONDS = Histogram("starnavi_moderation_seconds", "Moderation latency by backend", ["backend"],
+                               buckets=LATENCY_BUCKETS)
+MODERATION_OUTCOMES = Counter("starnavi_moderation", "Moderation outcomes by backend", ["backend", "outcome"])
+BCRYPT_SECONDS = Histogram("starnavi_bcrypt_seconds", "bcrypt time on the worker pool", ["operation"],
+                           buckets=LATENCY_BUCKETS)
+TASK_SECONDS = Histogram("starnavi_task_seconds", "Celery task runtime", ["task", "state"], buckets=LATENCY_BUCKETS)
+COMMENT_WRITE_DELAY = Histogram("starnavi_comment_write_delay_seconds",
+                                "Time from accepting a write-behind comment to its commit", buckets=LATENCY_BUCKETS)
+COMMENT_STREAM_LAG = Gauge("starnavi_comment_stream_lag", "Write-behind comments not yet committed",
+                           multiprocess_mode="max")
+COMMENT_STREAM_AGE = Gauge("starnavi_comment_stream_oldest_seconds", "Age of the oldest uncommitted comment",
+                           multiprocess_mode="max")
+CIRCUIT_STATE = Gauge("starnavi_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ["circuit"],
+                      multiprocess_mode="max")
+CIRCUIT_TRIPS = Counter("starnavi_circuit_trips", "Circuit breaker trips by reason", ["circuit", "reason"])
+HEDGED_CALLS = Counter("starnavi_hedged_calls", "Hedged Gemini requests sent and won", ["outcome"])
+QUEUE_DEPTH = Gauge("starnavi_queue_depth", "Pending items in the Redis queues", ["queue"],
+                    multiprocess_mode="max")
+
+# [query count, seconds] for the request being served; None outside of a request.
+request_queries = ContextVar("request_queries", default=None)
+
+
+def registry():
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+def render_metrics():
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port):
+    start_http_server(port, registry=registry())
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finish_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = request_queries.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so it adds no extra task or body buffering per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        stats = [0, 0.0]
+        token = request_queries.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_queries.reset(token)
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            REQUEST_SECONDS.labels(scope["method"], route).observe(elapsed)
+            REQUESTS.labels(scope["method"], route, str(status[0])).inc()
+            REQUEST_DB_QUERIES.labels(route).observe(stats[0])
+            REQUEST_DB_SECONDS.labels(route).observe(stats[1])
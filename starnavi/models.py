@@ -1,7 +1,9 @@
 from datetime import datetime
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from starnavi.config import BATCH_MAX_ITEMS
 
 
 class UserModel(BaseModel):
@@ -28,6 +30,7 @@ class CommentModel(BaseModel):
     post_id: int
     content: str
     created_at: datetime
+    status: Optional[str] = "published"
 
 
 class CommentCreate(BaseModel):
@@ -35,6 +38,10 @@ class CommentCreate(BaseModel):
     content: str
 
 
+class CommentBatchCreate(BaseModel):
+    items: List[CommentCreate] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
 class CommentEdit(BaseModel):
     post_id: int
     comment_id: int
@@ -52,7 +59,10 @@ class PostModel(BaseModel):
     title: str
     content: str
     comments: List[CommentModel] = []
+    comment_count: Optional[int] = 0
+    last_comment_at: Optional[datetime] = None
     created_at: datetime
+    status: Optional[str] = "published"
 
 
 class PostCreate(BaseModel):
@@ -62,6 +72,10 @@ class PostCreate(BaseModel):
     time_for_ai_answer: Optional[int] = 0
 
 
+class PostBatchCreate(BaseModel):
+    items: List[PostCreate] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
 class PostEdit(BaseModel):
     id: int
     content: str
@@ -80,7 +94,24 @@ class ContentBlockedModel(BaseModel):
     title: Optional[str]
 
 
+class SearchResult(BaseModel):
+    kind: str
+    id: int
+    post_id: int
+    title: str
+    snippet: str
+    rank: float
+    created_at: datetime
+
+
 class CommentAnalytics(BaseModel):
     date: str
     created_comments: int
     blocked_comments: int
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: str
+    id: Optional[int] = None
+    detail: Optional[str] = None
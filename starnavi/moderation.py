@@ -0,0 +1,103 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from typing import Optional
+
+from starnavi.config import MODERATION_LEXICON, PREFILTER_ENABLED
+from starnavi.metrics import MODERATION_SECONDS, MODERATION_OUTCOMES
+
+NOT_WORDS = re.compile(r"[\W_]+")
+
+
+class ModerationBackend:
+    """A moderation stage. `classify` returns True (allowed), False (blocked) or None to escalate."""
+    name = "backend"
+
+    async def classify(self, content, title="") -> Optional[bool]:
+        raise NotImplementedError
+
+
+def compile_lexicon(words):
+    words = sorted({word.strip().lower() for word in words if word.strip()}, key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b", re.IGNORECASE)
+
+
+def normalize_phrase(text):
+    return NOT_WORDS.sub(" ", text).strip().lower()
+
+
+def load_lexicon(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            lexicon = json.load(f)
+        return lexicon.get("block", []), lexicon.get("allow", [])
+    except (OSError, ValueError) as e:
+        logging.error(f"Moderation lexicon {path} could not be loaded: {e}")
+        return [], []
+
+
+class LocalPrefilter(ModerationBackend):
+    """Blocks text with a blocklisted term and allows a few stock replies ("thanks", "+1"); everything else goes to
+    the remote backend. Abuse without a listed word is common, so short or plain-looking text is never trusted."""
+    name = "local"
+
+    def __init__(self, block_words=(), allow_phrases=()):
+        self.block = compile_lexicon(block_words)
+        self.allow = {normalize_phrase(phrase) for phrase in allow_phrases} - {""}
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(*load_lexicon(path))
+
+    def decide(self, content, title=""):
+        text = f"{title}\n{content}" if title else content
+        if self.block is not None and self.block.search(text):
+            return False
+        if not title and normalize_phrase(content) in self.allow:
+            return True
+        return None
+
+    async def classify(self, content, title="") -> Optional[bool]:
+        return self.decide(content, title)
+
+
+class ModerationPipeline:
+    """Runs backends in order until one of them decides; the last backend must always decide."""
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.decided_by = Counter()
+
+    async def classify(self, content, title=""):
+        for backend in self.backends:
+            started = time.perf_counter()
+            try:
+                allowed = await backend.classify(content, title)
+            except Exception:
+                MODERATION_OUTCOMES.labels(backend.name, "error").inc()
+                raise
+            finally:
+                MODERATION_SECONDS.labels(backend.name).observe(time.perf_counter() - started)
+            outcome = "escalated" if allowed is None else "allowed" if allowed else "blocked"
+            MODERATION_OUTCOMES.labels(backend.name, outcome).inc()
+            if allowed is not None:
+                self.decided_by[backend.name] += 1
+                return allowed
+        raise RuntimeError("No moderation backend reached a decision")
+
+    @property
+    def stats(self):
+        total = sum(self.decided_by.values())
+        local = sum(count for name, count in self.decided_by.items() if name != self.backends[-1].name)
+        return {"decided_by": dict(self.decided_by), "total": total,
+                "short_circuit_ratio": local / total if total else 0.0}
+
+
+def build_prefilters():
+    if not PREFILTER_ENABLED:
+        return []
+    return [LocalPrefilter.from_file(MODERATION_LEXICON)]
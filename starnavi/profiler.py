@@ -0,0 +1,103 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from starnavi.config import SQL_N_PLUS_ONE_THRESHOLD, SLOW_QUERY_MS, SLOW_QUERY_LOG
+
+PLACEHOLDER_LIST = re.compile(r"\((?:\s*(?:\$\d+|\?|%\(\w+\)s|:\w+)\s*,?)+\)")
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+
+logger = logging.getLogger("starnavi.sql")
+slow_query_logger = logging.getLogger("starnavi.sql.slow")
+
+current_profile = ContextVar("current_profile", default=None)
+
+
+def statement_shape(statement):
+    """Collapse literals and placeholder lists so queries that differ only by their values compare equal."""
+    shape = PLACEHOLDER_LIST.sub("(?)", statement)
+    shape = LITERAL.sub("?", shape)
+    return WHITESPACE.sub(" ", shape).strip()
+
+
+class RequestProfile:
+    def __init__(self, route=""):
+        self.route = route
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, elapsed):
+        self.queries += 1
+        self.seconds += elapsed
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold=SQL_N_PLUS_ONE_THRESHOLD):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def report(self):
+        logger.info(f"{self.route}: {self.queries} queries in {self.seconds * 1000:.1f} ms, "
+                    f"{len(self.shapes)} distinct statements")
+        for shape, count in self.repeated():
+            logger.warning(f"Possible N+1 on {self.route}: {count} x {shape}")
+
+
+def setup_slow_query_log(path=SLOW_QUERY_LOG):
+    if slow_query_logger.handlers:
+        return
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    slow_query_logger.addHandler(handler)
+    slow_query_logger.setLevel(logging.INFO)
+    slow_query_logger.propagate = False
+
+
+def profile_engine(engine, slow_query_ms=SLOW_QUERY_MS):
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finish_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["profile_started"].pop()
+        profile = current_profile.get()
+        if profile is not None:
+            profile.record(statement, elapsed)
+        if elapsed * 1000 >= slow_query_ms:
+            route = profile.route if profile is not None else "-"
+            slow_query_logger.info(f"{elapsed * 1000:.1f} ms on {route}: {WHITESPACE.sub(' ', statement)} "
+                                   f"params={parameters!r:.1000}")
+
+
+class SQLProfilerMiddleware:
+    """Collects the queries each request issues and reports them in the log and a Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(f"{scope['method']} {scope['path']}")
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timing = f'db;dur={profile.seconds * 1000:.1f};desc="{profile.queries} queries"'
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_profile.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                profile.route = f"{scope['method']} {route.path}"
+            profile.report()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from starnavi.metrics import CIRCUIT_STATE, CIRCUIT_TRIPS, HEDGED_CALLS
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit {name} is open, retry in {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Trips when errors or slow calls reach a ratio of the last `window` calls; after `open_seconds` one probe
+    call is let through and its outcome closes or re-opens the circuit."""
+
+    def __init__(self, name, window=20, min_calls=10, error_ratio=0.5, slow_seconds=5.0, slow_ratio=0.5,
+                 open_seconds=30.0, clock=time.monotonic):
+        self.name = name
+        self.calls = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.error_ratio = error_ratio
+        self.slow_seconds = slow_seconds
+        self.slow_ratio = slow_ratio
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        CIRCUIT_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+        if self.clock() - self.opened_at < self.open_seconds:
+            return OPEN
+        return HALF_OPEN
+
+    def before_call(self):
+        """Raise CircuitOpenError while open; returns True when this call is the half-open probe."""
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self.probing):
+            raise CircuitOpenError(self.name, max(self.open_seconds - (self.clock() - self.opened_at), 1))
+        if state == HALF_OPEN:
+            self.probing = True
+            CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[HALF_OPEN])
+        return state == HALF_OPEN
+
+    def record(self, elapsed, failed, probe=False):
+        slow = elapsed >= self.slow_seconds
+        if probe:
+            self.probing = False
+            if failed or slow:
+                self.trip("probe_error" if failed else "probe_slow")
+            else:
+                self.close()
+            return
+        if self.opened_at is not None:
+            # Started before the circuit opened; the probe decides what happens next.
+            return
+
+        self.calls.append((failed, slow))
+        if len(self.calls) < self.min_calls:
+            return
+        if sum(failed for failed, _ in self.calls) >= self.error_ratio * len(self.calls):
+            self.trip("errors")
+        elif sum(slow for _, slow in self.calls) >= self.slow_ratio * len(self.calls):
+            self.trip("latency")
+
+    def trip(self, reason):
+        logging.warning(f"Circuit {self.name} opened ({reason}) for {self.open_seconds} s")
+        self.opened_at = self.clock()
+        self.calls.clear()
+        self.trips += 1
+        CIRCUIT_TRIPS.labels(self.name, reason).inc()
+        CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[OPEN])
+
+    def close(self):
+        logging.info(f"Circuit {self.name} closed")
+        self.opened_at = None
+        CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def stats(self):
+        return {"state": self.state, "trips": self.trips, "recent_calls": len(self.calls),
+                "recent_errors": sum(failed for failed, _ in self.calls),
+                "recent_slow": sum(slow for _, slow in self.calls)}
+
+
+async def hedged_async(attempt, hedge_after):
+    """Await `attempt()`; if it has not finished after `hedge_after` seconds start a second one and return the first
+    success. The loser is cancelled."""
+    tasks = [asyncio.ensure_future(attempt())]
+    try:
+        if hedge_after:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                HEDGED_CALLS.labels("sent").inc()
+                tasks.append(asyncio.ensure_future(attempt()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        HEDGED_CALLS.labels("won").inc()
+                    return task.result()
+        return tasks[0].result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def hedged_sync(attempt, executor, timeout, hedge_after):
+    """Thread-pool version of `hedged_async` with the deadline applied; a losing or timed-out call keeps its thread
+    until the client returns."""
+    deadline = time.monotonic() + timeout
+    futures = [executor.submit(attempt)]
+    try:
+        if hedge_after and hedge_after < timeout:
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                HEDGED_CALLS.labels("sent").inc()
+                futures.append(executor.submit(attempt))
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"No response within {timeout} s")
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        HEDGED_CALLS.labels("won").inc()
+                    return future.result()
+        return futures[0].result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+async def call_async(breaker, attempt, timeout, hedge_after=0):
+    probe = breaker.before_call()
+    started = time.perf_counter()
+    try:
+        # Never hedge a probe: while the service is recovering a second request only adds load.
+        result = await asyncio.wait_for(hedged_async(attempt, 0 if probe else hedge_after), timeout=timeout)
+    except asyncio.CancelledError:
+        # The caller went away; that says nothing about the service.
+        if probe:
+            breaker.probing = False
+        raise
+    except Exception:
+        breaker.record(time.perf_counter() - started, failed=True, probe=probe)
+        raise
+    breaker.record(time.perf_counter() - started, failed=False, probe=probe)
+    return result
+
+
+def call_sync(breaker, attempt, executor, timeout, hedge_after=0):
+    probe = breaker.before_call()
+    started = time.perf_counter()
+    try:
+        result = hedged_sync(attempt, executor, timeout, 0 if probe else hedge_after)
+    except Exception:
+        breaker.record(time.perf_counter() - started, failed=True, probe=probe)
+        raise
+    breaker.record(time.perf_counter() - started, failed=False, probe=probe)
+    return result
@@ -0,0 +1,52 @@
+import argparse
+import logging
+from datetime import date, timedelta
+
+from redis import Redis
+from sqlalchemy import text
+
+from starnavi.cache import bump_versions_sync
+from starnavi.config import REDIS_URL
+from starnavi.database.db import SessionLocal, CommentDailyStats
+
+BACKFILL_SQL = """
+    INSERT INTO comment_daily_stats (day, created_comments, blocked_comments)
+    SELECT day, sum(created), sum(blocked) FROM (
+        SELECT date(created_at) AS day, count(*) AS created, 0 AS blocked
+        FROM comments WHERE created_at >= :date_from AND created_at < :date_until GROUP BY 1
+        UNION ALL
+        SELECT date(created_at) AS day, 0 AS created, count(*) AS blocked
+        FROM block_contents
+        WHERE post_id IS NOT NULL AND created_at >= :date_from AND created_at < :date_until GROUP BY 1
+    ) counts GROUP BY day
+"""
+
+
+def backfill(session, date_from, date_to):
+    params = {"date_from": date_from, "date_to": date_to, "date_until": date_to + timedelta(days=1)}
+    session.execute(text("DELETE FROM comment_daily_stats WHERE day BETWEEN :date_from AND :date_to"), params)
+    session.execute(text(BACKFILL_SQL), params)
+    session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild comment_daily_stats from comments and block_contents")
+    parser.add_argument("--date-from", type=date.fromisoformat, default=date(1970, 1, 1))
+    parser.add_argument("--date-to", type=date.fromisoformat, default=date.today())
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    session = SessionLocal()
+    try:
+        backfill(session, options.date_from, options.date_to)
+        bump_versions_sync(Redis.from_url(REDIS_URL) if REDIS_URL else None, [CommentDailyStats.__tablename__])
+        logging.info(f"comment_daily_stats rebuilt for {options.date_from} - {options.date_to}")
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Backfill error {e}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import json
+import logging
+import statistics
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, text
+
+from starnavi.config import PARTITION_MONTHS_AHEAD, COMMENTS_PER_POST
+from starnavi.database.db import Base, Comment
+from starnavi.database.partitions import ensure_partitions
+from starnavi.utils import latest_comments_query
+
+SEED_SQL = [
+    """INSERT INTO users (name, email, password, created_at)
+       SELECT 'user' || g, 'user' || g || '@bench.local', 'x', now() - g * interval '1 minute'
+       FROM generate_series(1, :users) g""",
+    """INSERT INTO posts (user_id, title, content, should_be_answered, time_for_ai_answer, created_at)
+       SELECT 1 + g % :users, 'title ' || g, 'content ' || g, false, 0, now() - random() * interval '365 days'
+       FROM generate_series(1, :posts) g""",
+    """INSERT INTO comments (user_id, post_id, content, created_at)
+       SELECT 1 + g % :users, 1 + (random() * (:posts - 1))::int, 'comment ' || g,
+              now() - random() * interval '365 days'
+       FROM generate_series(1, :comments) g""",
+    """INSERT INTO block_contents (user_id, post_id, content, created_at)
+       SELECT 1 + g % :users, CASE WHEN g % 3 = 0 THEN NULL ELSE 1 + g % :posts END, 'blocked ' || g,
+              now() - random() * interval '365 days'
+       FROM generate_series(1, :blocked) g""",
+]
+
+QUERIES = {
+    "posts_first_page": """SELECT * FROM posts ORDER BY created_at DESC, id DESC LIMIT 21""",
+    "posts_next_page": """SELECT * FROM posts WHERE (created_at, id) < (:cursor_created_at, :cursor_id)
+                          ORDER BY created_at DESC, id DESC LIMIT 21""",
+    # Built by the API's own query so the benchmark follows it; compiled once the post ids are known.
+    "page_comments": lambda params: latest_comments_query(params["post_ids"], COMMENTS_PER_POST, Comment),
+    "comments_daily_range": """SELECT date(created_at), count(*) FROM comments
+                               WHERE created_at >= :date_from AND created_at < :date_to GROUP BY 1""",
+    "blocked_daily_range": """SELECT date(created_at), count(*) FROM block_contents
+                              WHERE post_id IS NOT NULL AND created_at >= :date_from AND created_at < :date_to
+                              GROUP BY 1""",
+    "posts_by_user": """SELECT id FROM posts WHERE user_id = :user_id""",
+}
+
+
+def plan_summary(plan, nodes=None):
+    nodes = [] if nodes is None else nodes
+    node = plan["Node Type"]
+    if plan.get("Index Name"):
+        node = f"{node} using {plan['Index Name']}"
+    nodes.append(node)
+    for child in plan.get("Plans", []):
+        plan_summary(child, nodes)
+    return nodes
+
+
+def explain(connection, sql, params, repeat):
+    if callable(sql):
+        sql = str(sql(params).compile(connection, compile_kwargs={"literal_binds": True}))
+    timings, plan = [], None
+    for _ in range(repeat):
+        result = connection.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"), params).scalar()
+        timings.append(result[0]["Execution Time"])
+        plan = result[0]["Plan"]
+    return {"median_ms": round(statistics.median(timings), 3), "plan": plan_summary(plan)}
+
+
+def seed(connection, options):
+    connection.execute(text("TRUNCATE users, posts, comments, block_contents, comment_daily_stats "
+                            "RESTART IDENTITY CASCADE"))
+    sizes = {"users": options.users, "posts": options.posts, "comments": options.comments,
+             "blocked": options.blocked}
+    for sql in SEED_SQL:
+        connection.execute(text(sql), sizes)
+
+
+def query_params(connection, options):
+    cursor = connection.execute(text("SELECT created_at, id FROM posts ORDER BY created_at DESC, id DESC "
+                                     "OFFSET :offset LIMIT 1"), {"offset": options.posts // 2}).one()
+    post_ids = connection.execute(text("SELECT id FROM posts ORDER BY created_at DESC, id DESC LIMIT 20")).scalars()
+    now = datetime.now(timezone.utc)
+    return {"cursor_created_at": cursor.created_at, "cursor_id": cursor.id, "post_ids": list(post_ids),
+            "date_from": now - timedelta(days=30), "date_to": now, "user_id": 1}
+
+
+def run_phase(engine, indexes, create, params, repeat):
+    with engine.begin() as connection:
+        for index in indexes:
+            if create:
+                index.create(connection, checkfirst=True)
+            else:
+                connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        connection.execute(text("ANALYZE"))
+    with engine.connect() as connection:
+        return {name: explain(connection, sql, params, repeat) for name, sql in QUERIES.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare query plans and latency without and with the indexes "
+                                                 "declared on the models. Seeds a scratch Postgres database.")
+    parser.add_argument("--database-url", required=True, help="Scratch database; its tables are truncated")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--comments", type=int, default=1000000)
+    parser.add_argument("--blocked", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reset", action="store_true", help="Truncate existing rows before seeding")
+    options = parser.parse_args()
+
+    engine = create_engine(options.database_url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        has_rows = connection.execute(text("SELECT EXISTS (SELECT 1 FROM posts)")).scalar()
+        if has_rows and not options.reset:
+            logging.error("Database already contains posts, pass --reset to truncate it")
+            sys.exit(1)
+        ensure_partitions(connection, PARTITION_MONTHS_AHEAD, since=datetime.now(timezone.utc) - timedelta(days=366))
+        seed(connection, options)
+        params = query_params(connection, options)
+
+    indexes = [index for table in Base.metadata.sorted_tables for index in table.indexes]
+    before = run_phase(engine, indexes, False, params, options.repeat)
+    after = run_phase(engine, indexes, True, params, options.repeat)
+
+    report = {name: {"before": before[name], "after": after[name],
+                     "speedup": round(before[name]["median_ms"] / max(after[name]["median_ms"], 0.001), 1)}
+              for name in QUERIES}
+    print(json.dumps({"dataset": {"users": options.users, "posts": options.posts, "comments": options.comments,
+                                  "blocked": options.blocked}, "queries": report}, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Bulk import users, posts and comments from JSONL or CSV files with COPY.
+
+    bulk_import --users users.jsonl --posts posts.csv --comments comments.jsonl --checkpoint import.json
+
+Rows keep the ids from the input so posts and comments can reference them. Every chunk is copied into a temporary
+table and moved over with INSERT ... ON CONFLICT DO NOTHING, so re-running a chunk after a crash is harmless; the
+checkpoint file records how many records of each file are done and a re-run resumes from there. Posts whose author
+and comments whose post or author is missing are skipped.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from itertools import islice
+
+import bcrypt
+from redis import Redis
+from sqlalchemy import create_engine
+
+from starnavi.cache import bump_versions_sync
+from starnavi.config import DATABASE_URL, BCRYPT_ROUNDS, BCRYPT_WORKERS, REDIS_URL
+from starnavi.database.db import User, Post, Comment, ContentBlocked, CommentDailyStats, SessionLocal
+from starnavi.database.partitions import ensure_partitions_between
+from starnavi.scripts.backfill_daily_stats import backfill
+
+TABLES = {
+    "users": {
+        "columns": ["id", "name", "email", "password", "created_at"],
+        "insert": """INSERT INTO users (id, name, email, password, created_at)
+                     SELECT id, name, email, password, COALESCE(created_at, now()) FROM {staging}
+                     ON CONFLICT DO NOTHING""",
+    },
+    "posts": {
+        "columns": ["id", "user_id", "title", "content", "should_be_answered", "time_for_ai_answer", "created_at"],
+        "insert": """INSERT INTO posts (id, user_id, title, content, should_be_answered, time_for_ai_answer,
+                                        created_at)
+                     SELECT s.id, s.user_id, s.title, s.content, COALESCE(s.should_be_answered, false),
+                            COALESCE(s.time_for_ai_answer, 0), COALESCE(s.created_at, now())
+                     FROM {staging} s JOIN users u ON u.id = s.user_id
+                     ON CONFLICT DO NOTHING""",
+    },
+    "comments": {
+        "columns": ["id", "user_id", "post_id", "content", "created_at"],
+        # Also bumps posts.comment_count and last_comment_at by what was actually inserted; selects the row count.
+        "insert": """WITH inserted AS (
+                         INSERT INTO comments (id, user_id, post_id, content, created_at)
+                         SELECT s.id, s.user_id, s.post_id, s.content, COALESCE(s.created_at, now())
+                         FROM {staging} s JOIN posts p ON p.id = s.post_id JOIN users u ON u.id = s.user_id
+                         ON CONFLICT DO NOTHING
+                         RETURNING post_id, created_at
+                     ), counted AS (
+                         UPDATE posts SET comment_count = posts.comment_count + c.added,
+                                          last_comment_at = GREATEST(posts.last_comment_at, c.newest)
+                         FROM (SELECT post_id, count(*) AS added, max(created_at) AS newest
+                               FROM inserted GROUP BY post_id ORDER BY post_id) c
+                         WHERE posts.id = c.post_id
+                     )
+                     SELECT count(*) FROM inserted""",
+    },
+}
+BLOCKED_COLUMNS = ["user_id", "post_id", "title", "content", "created_at"]
+# block_contents has no natural key, so a replayed chunk skips rows that are already there instead. Like the other
+# inserts it drops rows whose user or post does not exist rather than failing the chunk on the foreign key.
+BLOCKED_INSERT = """INSERT INTO block_contents (user_id, post_id, title, content, created_at)
+                    SELECT s.user_id, s.post_id, s.title, s.content, COALESCE(s.created_at, now())
+                    FROM {staging} s JOIN users u ON u.id = s.user_id LEFT JOIN posts p ON p.id = s.post_id
+                    WHERE (s.post_id IS NULL OR p.id IS NOT NULL) AND NOT EXISTS (
+                        SELECT 1 FROM block_contents b
+                        WHERE b.user_id = s.user_id AND b.post_id IS NOT DISTINCT FROM s.post_id
+                          AND b.title IS NOT DISTINCT FROM s.title AND b.content = s.content
+                          AND (s.created_at IS NULL OR b.created_at = s.created_at)
+                    )"""
+MODELS = {"users": User, "posts": Post, "comments": Comment}
+
+
+def read_records(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(records, size):
+    records = iter(records)
+    while chunk := list(islice(records, size)):
+        yield chunk
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def to_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row.get(column) is None else row[column] for column in columns])
+    buffer.seek(0)
+    return buffer
+
+
+def copy_rows(cursor, table, rows, columns):
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", to_csv(rows, columns))
+
+
+def hash_passwords(rows, executor):
+    def hashed(password):
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+    for row, password in zip(rows, executor.map(hashed, [row["password"] for row in rows])):
+        row["password"] = password
+
+
+def moderate_rows(kind, rows, loop):
+    """Split a chunk into allowed rows and block_contents rows with the regular moderation pipeline."""
+    from starnavi.services import analyze_content_async
+
+    async def classify():
+        return await asyncio.gather(*(analyze_content_async(row["content"], row.get("title") or "") for row in rows),
+                                    return_exceptions=True)
+
+    allowed, blocked = [], []
+    for row, verdict in zip(rows, loop.run_until_complete(classify())):
+        if isinstance(verdict, Exception):
+            raise RuntimeError(f"Moderation failed for {kind} {row.get('id')}: {verdict}")
+        if verdict:
+            allowed.append(row)
+        else:
+            blocked.append({"user_id": row["user_id"], "post_id": row.get("post_id"), "title": row.get("title"),
+                            "content": row["content"], "created_at": row.get("created_at")})
+    return allowed, blocked
+
+
+def import_chunk(connection, kind, rows, blocked):
+    table = TABLES[kind]
+    staging = f"import_{kind}"
+    with connection.cursor() as cursor:
+        # Only the copied columns: LIKE would also copy NOT NULL constraints of columns the input does not supply.
+        cursor.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+                       f"SELECT {', '.join(table['columns'])} FROM {kind} WITH NO DATA")
+        copy_rows(cursor, staging, rows, table["columns"])
+        cursor.execute(table["insert"].format(staging=staging))
+        inserted = cursor.fetchone()[0] if cursor.description else cursor.rowcount
+        if blocked:
+            cursor.execute(f"CREATE TEMP TABLE import_blocked ON COMMIT DROP AS "
+                           f"SELECT {', '.join(BLOCKED_COLUMNS)} FROM {ContentBlocked.__tablename__} WITH NO DATA")
+            copy_rows(cursor, "import_blocked", blocked, BLOCKED_COLUMNS)
+            cursor.execute(BLOCKED_INSERT.format(staging="import_blocked"))
+    connection.commit()
+    return inserted
+
+
+def stats_range(rows, current):
+    days = [date.fromisoformat(str(row["created_at"])[:10]) for row in rows if row.get("created_at")]
+    if not days:
+        days = [date.today()]
+    low, high = min(days), max(days)
+    if current:
+        low, high = min(low, current[0]), max(high, current[1])
+    return low, high
+
+
+def import_file(engine, kind, path, options, checkpoint, executor, loop):
+    done = checkpoint.get(kind, 0)
+    records = islice(read_records(path), done, None)
+    imported = skipped = 0
+    started = time.perf_counter()
+    # Kept in the checkpoint, so days of chunks committed before a crash are still backfilled by the re-run.
+    changed_days = None
+    if kind == "comments" and checkpoint.get("comment_days"):
+        changed_days = tuple(date.fromisoformat(day) for day in checkpoint["comment_days"])
+
+    connection = engine.raw_connection()
+    try:
+        for rows in chunked(records, options.chunk_size):
+            if kind == "users" and options.plain_passwords:
+                hash_passwords(rows, executor)
+            allowed, blocked = (moderate_rows(kind, rows, loop) if options.moderate and kind != "users"
+                                else (rows, []))
+            if kind != "users":
+                # Comments and blocked rows may be older than the partitions maintain_partitions keeps.
+                with engine.begin() as partition_connection:
+                    ensure_partitions_between(partition_connection, *stats_range(rows, None))
+            inserted = import_chunk(connection, kind, allowed, blocked)
+            if kind == "comments":
+                changed_days = stats_range(rows, changed_days)
+                checkpoint["comment_days"] = [day.isoformat() for day in changed_days]
+
+            imported += inserted
+            skipped += len(rows) - inserted
+            done += len(rows)
+            checkpoint[kind] = done
+            save_checkpoint(options.checkpoint, checkpoint)
+            logging.info(f"{kind}: {done} records read, {imported} imported, {skipped} skipped or blocked, "
+                         f"{imported / (time.perf_counter() - started):.0f} rows/s")
+    finally:
+        connection.close()
+    return imported, changed_days
+
+
+def finish(engine, changed_days):
+    with engine.begin() as connection:
+        for table in ("users", "posts", "comments", "block_contents"):
+            connection.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT max(id) FROM {table}), 1))")
+
+    if changed_days:
+        session = SessionLocal(bind=engine)
+        try:
+            backfill(session, *changed_days)
+        finally:
+            session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import users, posts and comments from JSONL or CSV with COPY")
+    parser.add_argument("--users", help="users file: id, name, email, password, created_at")
+    parser.add_argument("--posts", help="posts file: id, user_id, title, content, should_be_answered, "
+                                        "time_for_ai_answer, created_at")
+    parser.add_argument("--comments", help="comments file: id, user_id, post_id, content, created_at")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--checkpoint", help="JSON file with the progress per file; resumes from it when present")
+    parser.add_argument("--plain-passwords", action="store_true",
+                        help="Passwords in the users file are plain text and get bcrypt-hashed; default: bcrypt hashes")
+    parser.add_argument("--moderate", action="store_true",
+                        help="Run posts and comments through the moderation pipeline; blocked ones go to block_contents")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    engine = create_engine(options.database_url)
+    checkpoint = load_checkpoint(options.checkpoint)
+    changed_tables, changed_days = set(), None
+    # One loop for the whole run: the moderation semaphore and Redis connections stay bound to it.
+    loop = asyncio.new_event_loop()
+    try:
+        with ThreadPoolExecutor(max_workers=BCRYPT_WORKERS) as executor:
+            for kind in ("users", "posts", "comments"):
+                path = getattr(options, kind)
+                if not path:
+                    continue
+                imported, days = import_file(engine, kind, path, options, checkpoint, executor, loop)
+                if imported:
+                    changed_tables.add(MODELS[kind].__tablename__)
+                    if kind == "comments":
+                        changed_tables.add(Post.__tablename__)
+                changed_days = days or changed_days
+        if options.moderate:
+            changed_tables.add(ContentBlocked.__tablename__)
+        finish(engine, changed_days)
+    except Exception as e:
+        logging.error(f"Import stopped, re-run with the same --checkpoint to resume: {e}")
+        sys.exit(1)
+    finally:
+        loop.close()
+
+    if changed_days:
+        changed_tables.add(CommentDailyStats.__tablename__)
+    bump_versions_sync(Redis.from_url(REDIS_URL) if REDIS_URL else None, sorted(changed_tables))
+    logging.info(f"Import finished: {', '.join(sorted(changed_tables)) or 'nothing new'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import argparse
+import logging
+
+from sqlalchemy import create_engine
+
+from starnavi.config import DATABASE_URL, PARTITION_MONTHS_AHEAD, PARTITION_RETENTION_MONTHS, PARTITION_DROP_RETIRED
+from starnavi.database.partitions import maintain
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create upcoming monthly partitions of comments and block_contents "
+                                                 "and detach or drop old ones")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--keep-months", type=int, default=PARTITION_RETENTION_MONTHS,
+                        help="Retire partitions that ended more than this many months ago; 0 keeps everything")
+    parser.add_argument("--drop", action="store_true", default=PARTITION_DROP_RETIRED,
+                        help="Drop retired partitions instead of only detaching them")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        with create_engine(options.database_url).begin() as connection:
+            result = maintain(connection, options.months_ahead, options.keep_months, options.drop)
+        logging.info(f"Partitions created: {result['created'] or 'none'}, retired: {result['retired'] or 'none'}")
+    except Exception as e:
+        logging.error(f"Partition maintenance error {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import orjson
+from fastapi.responses import ORJSONResponse
+
+JSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def model_columns(entity, schema):
+    """ORM columns behind the fields of a response schema, so list endpoints can select rows instead of objects."""
+    columns = entity.__table__.columns
+    return [getattr(entity, name) for name in schema.model_fields if name in columns]
+
+
+def rows_as_dicts(result):
+    return [dict(row) for row in result.mappings().all()]
+
+
+class RowsResponse(ORJSONResponse):
+    """Encodes plain row dicts with orjson, skipping response_model validation; datetimes match pydantic's output."""
+
+    def render(self, content):
+        return orjson.dumps(content, option=JSON_OPTIONS)
+
+
+def encode_ndjson(rows):
+    return b"".join(orjson.dumps(dict(row), option=JSON_OPTIONS) + b"\n" for row in rows)
@@ -1,69 +1,119 @@
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-import vertexai
-from vertexai.generative_models import GenerativeModel
-from google.oauth2 import service_account
-from vertexai.generative_models._generative_models import SafetyRating
-from vertexai.preview import generative_models
-
-from starnavi.config import CREDENTIALS, PROJECT_AI_ID
-
-try:
-    credentials = service_account.Credentials.from_service_account_file(CREDENTIALS)
-    vertexai.init(project=PROJECT_AI_ID, location="us-central1", credentials=credentials)
-except FileNotFoundError as e:
-    logging.error(f"Error: The credentials file was not found. {e}")
-except ValueError as e:
-    logging.error(f"Error: Invalid credentials or project ID. {e}")
-except Exception as e:
-    logging.error(f"An unexpected error occurred: {e}")
-
-model = GenerativeModel(model_name="gemini-1.5-flash-001")
-
-generation_config = generative_models.GenerationConfig(
-        max_output_tokens=100, temperature=0.4, top_p=1, top_k=32
-    )
-
-safety_config = [
-    generative_models.SafetySetting(
-        category=generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-        method=generative_models.SafetySetting.HarmBlockMethod.SEVERITY,
-        threshold=generative_models.HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-    ),
-    generative_models.SafetySetting(
-        category=generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT,
-        method=generative_models.SafetySetting.HarmBlockMethod.SEVERITY,
-        threshold=generative_models.HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-    ),
-    generative_models.SafetySetting(
-        category=generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-        method=generative_models.SafetySetting.HarmBlockMethod.SEVERITY,
-        threshold=generative_models.HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-    ),
-    generative_models.SafetySetting(
-        category=generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-        method=generative_models.SafetySetting.HarmBlockMethod.SEVERITY,
-        threshold=generative_models.HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-    )
-]
+from starnavi.cache import verdict_cache
+from starnavi.moderation import ModerationBackend, ModerationPipeline, build_prefilters
+from starnavi.config import (CREDENTIALS, PROJECT_AI_ID, MODERATION_CONCURRENCY, GEMINI_TIMEOUT, GEMINI_HEDGE_AFTER,
+                             GEMINI_SYNC_WORKERS, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATIO,
+                             BREAKER_SLOW_SECONDS, BREAKER_SLOW_RATIO, BREAKER_OPEN_SECONDS, MODERATION_FAIL_OPEN)
+from starnavi.resilience import CircuitBreaker, CircuitOpenError, call_async, call_sync
 
+# vertexai and google-auth are imported on first use: loading them and reading the credentials takes seconds and
+# would otherwise be paid, and fail without credentials, by every process that merely imports this module.
+moderation_semaphore = asyncio.Semaphore(MODERATION_CONCURRENCY)
+gemini_breaker = CircuitBreaker("gemini", window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                                error_ratio=BREAKER_ERROR_RATIO, slow_seconds=BREAKER_SLOW_SECONDS,
+                                slow_ratio=BREAKER_SLOW_RATIO, open_seconds=BREAKER_OPEN_SECONDS)
+# Blocking calls run here so the deadline and hedging also apply to Celery tasks.
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_SYNC_WORKERS, thread_name_prefix="gemini")
 
-def generate_answer(content, title=""):
+
+def load_credentials():
+    from google.oauth2 import service_account
+
+    try:
+        return service_account.Credentials.from_service_account_file(CREDENTIALS)
+    except FileNotFoundError as e:
+        logging.error(f"Error: The credentials file was not found. {e}")
+    except ValueError as e:
+        logging.error(f"Error: Invalid credentials or project ID. {e}")
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+    return None
+
+
+def build_model():
+    import vertexai
+    from vertexai.generative_models import GenerativeModel
+
+    try:
+        vertexai.init(project=PROJECT_AI_ID, location="us-central1", credentials=load_credentials())
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+    return GenerativeModel(model_name="gemini-1.5-flash-001")
+
+
+def build_generation_options():
+    from vertexai.preview import generative_models
+
+    generation_config = generative_models.GenerationConfig(max_output_tokens=100, temperature=0.4, top_p=1, top_k=32)
+
+    safety_config = [
+        generative_models.SafetySetting(
+            category=category,
+            method=generative_models.SafetySetting.HarmBlockMethod.SEVERITY,
+            threshold=generative_models.HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
+        )
+        for category in (generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                         generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT,
+                         generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                         generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT)
+    ]
+    return generation_config, safety_config
+
+
+@lru_cache(maxsize=1)
+def get_client():
+    """(model, generation_config, safety_config), built once on first use."""
+    return build_model(), *build_generation_options()
+
+
+async def get_client_async():
+    if get_client.cache_info().currsize:
+        return get_client()
+    # The first build imports vertexai and reads the credentials file; keep that off the event loop.
+    return await asyncio.to_thread(get_client)
+
+
+def build_contents(content, title=""):
     if title:
-        contents = [title, content]
-    else:
-        contents = [content]
-
-    response = model.generate_content(
-        contents,
-        generation_config=generation_config,
-        safety_settings=safety_config,
-    )
-    return response
+        return [title, content]
+    return [content]
 
 
-def analyze_content(content, title=""):
-    response = generate_answer(content, title)
+def generate_answer(content, title=""):
+    model, generation_config, safety_config = get_client()
+
+    def attempt():
+        return model.generate_content(
+            build_contents(content, title),
+            generation_config=generation_config,
+            safety_settings=safety_config,
+        )
+
+    return call_sync(gemini_breaker, attempt, gemini_executor, GEMINI_TIMEOUT, GEMINI_HEDGE_AFTER)
+
+
+async def generate_answer_async(content, title=""):
+    model, generation_config, safety_config = await get_client_async()
+
+    async def attempt():
+        return await model.generate_content_async(
+            build_contents(content, title),
+            generation_config=generation_config,
+            safety_settings=safety_config,
+        )
+
+    # Waiting for a slot is queueing on our side: keep it out of the deadline and the breaker's latency samples.
+    async with moderation_semaphore:
+        return await call_async(gemini_breaker, attempt, GEMINI_TIMEOUT, GEMINI_HEDGE_AFTER)
+
+
+def is_content_allowed(response):
+    from vertexai.generative_models._generative_models import SafetyRating
+
     result = next((severity for severity in response.candidates[0].safety_ratings if severity.severity !=
                    SafetyRating.HarmSeverity.HARM_SEVERITY_NEGLIGIBLE), None)
     if result:
@@ -71,6 +121,38 @@ def analyze_content(content, title=""):
     return True
 
 
+def analyze_content(content, title=""):
+    response = generate_answer(content, title)
+    return is_content_allowed(response)
+
+
+class GeminiBackend(ModerationBackend):
+    name = "gemini"
+
+    async def classify(self, content, title=""):
+        allowed = await verdict_cache.get(content, title)
+        if allowed is not None:
+            return allowed
+
+        try:
+            response = await generate_answer_async(content, title)
+        except CircuitOpenError as e:
+            if not MODERATION_FAIL_OPEN:
+                raise
+            logging.warning(f"{e}, allowing content unmoderated")
+            return True
+        allowed = is_content_allowed(response)
+        await verdict_cache.set(content, title, allowed)
+        return allowed
+
+
+moderation_pipeline = ModerationPipeline(build_prefilters() + [GeminiBackend()])
+
+
+async def analyze_content_async(content, title=""):
+    return await moderation_pipeline.classify(content, title)
+
+
 def automatic_ai_answer(content, title=""):
     response = generate_answer(content, title)
     return response
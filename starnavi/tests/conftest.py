@@ -1,23 +1,20 @@
 from datetime import datetime, timedelta
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 
 import jwt
 import pytest
-import vertexai
 from starlette.testclient import TestClient
 
-from starnavi.config import PROJECT_AI_ID, JWT_SECRET, ALGORITHM
-from starnavi.database.db import get_session
+from starnavi.config import JWT_SECRET, ALGORITHM
+from starnavi.database.db import get_async_session
 from starnavi.main import app
-from starnavi.services import credentials
 
-vertexai.init(project=PROJECT_AI_ID, location="us-central1", credentials=credentials)
 
-
-def generate_token():
+def generate_token(**claims):
     payload = {
         "email": "test@test.com",
-        "exp": datetime.utcnow() + timedelta(minutes=5)
+        "exp": datetime.utcnow() + timedelta(minutes=5),
+        **claims
     }
     token = jwt.encode(payload, JWT_SECRET, algorithm=ALGORITHM)
     return token
@@ -35,12 +32,16 @@ def mock_session():
         pass
 
     session.add.side_effect = mock_add
+    for name in ("commit", "rollback", "flush", "delete", "get", "scalar", "scalars", "execute"):
+        setattr(session, name, AsyncMock())
+    session.scalars.return_value = MagicMock()
+    session.execute.return_value = MagicMock()
     session.commit.side_effect = mock_commit
     return session
 
 
 @pytest.fixture
 def client(mock_session):
-    app.dependency_overrides[get_session] = lambda: mock_session
+    app.dependency_overrides[get_async_session] = lambda: mock_session
     with TestClient(app) as c:
         yield c
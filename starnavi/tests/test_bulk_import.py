@@ -0,0 +1,95 @@
+import json
+from datetime import date
+from unittest.mock import MagicMock
+
+import pytest
+
+from starnavi.scripts.bulk_import import (BLOCKED_COLUMNS, MODELS, TABLES, chunked, import_chunk, import_file,
+                                          load_checkpoint, read_records, save_checkpoint, to_csv)
+
+
+def test_read_records_from_jsonl_and_csv(tmp_path):
+    jsonl = tmp_path / "posts.jsonl"
+    jsonl.write_text('{"id": 1, "title": "First"}\n\n{"id": 2, "title": "Second"}\n')
+    csv_file = tmp_path / "posts.csv"
+    csv_file.write_text('id,title\n1,"First, with comma"\n')
+
+    assert [row["id"] for row in read_records(str(jsonl))] == [1, 2]
+    assert list(read_records(str(csv_file))) == [{"id": "1", "title": "First, with comma"}]
+
+
+def test_chunked_keeps_the_remainder():
+    assert [len(chunk) for chunk in chunked(range(5), 2)] == [2, 2, 1]
+
+
+def test_to_csv_writes_missing_values_as_null():
+    buffer = to_csv([{"id": 1, "title": None, "content": 'He said "hi"'}], ["id", "title", "content"])
+    assert buffer.read() == '1,,"He said ""hi"""\r\n'
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "import.json")
+    assert load_checkpoint(path) == {}
+
+    save_checkpoint(path, {"users": 100})
+
+    assert load_checkpoint(path) == {"users": 100}
+    assert json.loads((tmp_path / "import.json").read_text()) == {"users": 100}
+
+
+@pytest.mark.parametrize("kind", list(TABLES))
+def test_import_chunk_stages_only_the_copied_columns(kind):
+    connection = MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.description = None
+    cursor.rowcount = 1
+    columns = TABLES[kind]["columns"]
+    assert set(columns) <= set(MODELS[kind].__table__.columns.keys())
+
+    assert import_chunk(connection, kind, [dict.fromkeys(columns, 1)], []) == 1
+
+    statements = [call.args[0] for call in cursor.execute.call_args_list]
+    assert statements[0] == (f"CREATE TEMP TABLE import_{kind} ON COMMIT DROP AS "
+                             f"SELECT {', '.join(columns)} FROM {kind} WITH NO DATA")
+    assert cursor.copy_expert.call_args.args[0] == (f"COPY import_{kind} ({', '.join(columns)}) "
+                                                    f"FROM STDIN WITH (FORMAT csv)")
+    connection.commit.assert_called_once()
+
+
+def test_import_chunk_skips_blocked_rows_already_imported():
+    connection = MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.description = None
+    blocked = [{"user_id": 1, "post_id": 2, "title": None, "content": "bad", "created_at": "2024-07-05T12:00:00"}]
+
+    import_chunk(connection, "comments", [], blocked)
+
+    statements = [call.args[0] for call in cursor.execute.call_args_list]
+    assert statements[2] == (f"CREATE TEMP TABLE import_blocked ON COMMIT DROP AS "
+                             f"SELECT {', '.join(BLOCKED_COLUMNS)} FROM block_contents WITH NO DATA")
+    assert "AND NOT EXISTS" in statements[3]
+    assert cursor.copy_expert.call_args.args[0].startswith("COPY import_blocked ")
+
+
+def test_import_chunk_drops_orphaned_blocked_rows():
+    connection = MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.description = None
+    orphaned = [{"user_id": 404, "post_id": 405, "title": None, "content": "bad", "created_at": None}]
+
+    import_chunk(connection, "comments", [], orphaned)
+
+    insert = cursor.execute.call_args_list[3].args[0]
+    assert "JOIN users u ON u.id = s.user_id LEFT JOIN posts p ON p.id = s.post_id" in insert
+    assert "(s.post_id IS NULL OR p.id IS NOT NULL)" in insert
+
+
+def test_import_file_resumes_the_stats_range_from_the_checkpoint(tmp_path):
+    path = tmp_path / "comments.jsonl"
+    path.write_text('{"id": 1, "user_id": 1, "post_id": 1, "content": "hi"}\n')
+    checkpoint = {"comments": 1, "comment_days": ["2024-07-01", "2024-07-09"]}
+
+    imported, days = import_file(MagicMock(), "comments", str(path), MagicMock(), checkpoint, None, None)
+
+    assert imported == 0
+    assert days == (date(2024, 7, 1), date(2024, 7, 9))
@@ -0,0 +1,177 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from starnavi.cache import ResourceVersions, RevokedUsers, VerdictCache, content_key
+
+
+def test_content_key_normalizes_case_and_whitespace():
+    assert content_key("Hello   World\n", "My  Title") == content_key("hello world", "my title")
+    assert content_key("hello world", "my title") != content_key("my title", "hello world")
+
+
+def test_verdict_cache_counts_hits_and_misses():
+    cache = VerdictCache(max_size=10, allowed_ttl=60, blocked_ttl=60)
+
+    assert asyncio.run(cache.get("content", "title")) is None
+    asyncio.run(cache.set("content", "title", False))
+    assert asyncio.run(cache.get("content", "title")) is False
+
+    assert cache.stats["misses"] == 1
+    assert cache.stats["local_hits"] == 1
+
+
+def test_verdict_cache_evicts_least_recently_used():
+    cache = VerdictCache(max_size=2, allowed_ttl=60, blocked_ttl=60)
+
+    asyncio.run(cache.set("first", "", True))
+    asyncio.run(cache.set("second", "", True))
+    asyncio.run(cache.get("first"))
+    asyncio.run(cache.set("third", "", True))
+
+    assert asyncio.run(cache.get("second")) is None
+    assert asyncio.run(cache.get("first")) is True
+
+
+def test_verdict_cache_expires_by_verdict_ttl():
+    cache = VerdictCache(max_size=10, allowed_ttl=60, blocked_ttl=0)
+
+    asyncio.run(cache.set("allowed", "", True))
+    asyncio.run(cache.set("blocked", "", False))
+
+    assert asyncio.run(cache.get("allowed")) is True
+    assert asyncio.run(cache.get("blocked")) is None
+
+
+class FakeAsyncRedis:
+    """Just enough of redis.asyncio for ResourceVersions."""
+
+    def __init__(self):
+        self.values = {}
+
+    async def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.values)
+
+
+class FakePipeline:
+    def __init__(self, values):
+        self.values = values
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, nx=False):
+        self.commands.append(lambda: self.values.setdefault(key, value) if nx else self.values.update({key: value}))
+        return self
+
+    def incr(self, key):
+        self.commands.append(lambda: self.values.update({key: self.values.get(key, 0) + 1}))
+        return self
+
+    def mget(self, keys):
+        self.commands.append(lambda: [self.values.get(key) for key in keys])
+        return self
+
+    async def execute(self):
+        results = [command() for command in self.commands]
+        self.commands = []
+        return results
+
+
+def test_resource_versions_change_only_for_bumped_tables():
+    versions = ResourceVersions(FakeAsyncRedis())
+
+    posts, comments = asyncio.run(versions.get("posts", "comments"))
+    asyncio.run(versions.bump("comments"))
+
+    assert asyncio.run(versions.get("posts", "comments")) == [posts, comments + 1]
+
+
+def test_resource_versions_are_skipped_without_redis():
+    assert asyncio.run(ResourceVersions().get("posts")) is None
+
+
+class FakeRevocationRedis:
+    """Just enough of the sync and asyncio Redis clients to share revocations between RevokedUsers instances."""
+
+    def __init__(self):
+        self.users, self.version, self.gets = {}, 0, 0
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def __enter__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def zadd(self, key, mapping):
+        self.users.update(mapping)
+        return self
+
+    def zremrangebyscore(self, key, low, high):
+        self.users = {user: score for user, score in self.users.items() if score > high}
+        return self
+
+    def incr(self, key):
+        self.version += 1
+        return self
+
+    def execute(self):
+        return self
+
+    def __await__(self):
+        return iter(())
+
+    async def get(self, key):
+        self.gets += 1
+        return str(self.version).encode() if self.version else None
+
+    async def zrangebyscore(self, key, low, high, withscores=False):
+        return [(str(user).encode(), score) for user, score in self.users.items() if score >= low]
+
+
+def test_revoked_users_are_polled_from_redis():
+    shared = FakeRevocationRedis()
+    revoking, other_process = RevokedUsers(shared, shared), RevokedUsers(shared, shared, poll_interval=60)
+
+    revoking.revoke(4, 60)
+    assert other_process.is_revoked(4) is False
+
+    async def poll_twice():
+        other_process.poll()
+        other_process.poll()
+        await asyncio.gather(*other_process.tasks)
+
+    asyncio.run(poll_twice())
+    assert other_process.is_revoked(4) is True
+    assert other_process.is_revoked(5) is False
+    assert shared.gets == 1
+
+
+def test_revocation_is_published_in_the_background_on_the_event_loop():
+    shared = FakeRevocationRedis()
+    sync_redis = MagicMock()
+    revoked = RevokedUsers(shared, sync_redis)
+
+    async def revoke():
+        revoked.revoke(7, 60)
+        assert revoked.is_revoked(7) is True
+        await asyncio.gather(*revoked.tasks)
+
+    asyncio.run(revoke())
+    sync_redis.pipeline.assert_not_called()
+    assert 7 in shared.users and shared.version == 1
@@ -1,17 +1,29 @@
-from datetime import date
-from unittest.mock import patch, MagicMock
+import asyncio
+from datetime import date, datetime
+from unittest.mock import patch, AsyncMock, MagicMock
+import bcrypt
+import jwt
 import pytest
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
 
 from starnavi.celery_app.tasks import send_automatic_reply
 
-from starnavi.database.db import User, Comment, Post, ContentBlocked
+from starnavi.database.db import (User, Comment, Post, ContentBlocked, CommentDailyStats, collect_comment_counts,
+                                  update_comment_counts)
+from starnavi.config import JWT_SECRET, ALGORITHM, BCRYPT_MAX_QUEUE, ANALYTICS_MAX_DAYS
+from starnavi.resilience import CircuitOpenError
+from starnavi.serialization import encode_ndjson
 from starnavi.tests.conftest import generate_token
+from starnavi.utils import (decode_cursor, get_validated_user_id, validate_jwt_token, revoke_user_tokens, search_query,
+                            latest_comments_query, revoke_deleted_users, keep_rolled_back_users)
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_create_user_success(mock_get_session, mock_session, client):
-    mock_session.query.return_value.filter.return_value.first.return_value = None
+    mock_session.scalar.return_value = None
     mock_get_session.return_value = mock_session
 
     response = client.post("/create_users/", json={
@@ -25,9 +37,9 @@ def test_create_user_success(mock_get_session, mock_session, client):
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_create_user_invalid_email(mock_get_session, mock_session, client):
-    mock_session.query(User).first.return_value = None
+    mock_session.scalar.return_value = None
     mock_get_session.return_value = mock_session
 
     response = client.post("/create_users/", json={
@@ -41,10 +53,9 @@ def test_create_user_invalid_email(mock_get_session, mock_session, client):
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_create_user_already_exists(mock_get_session, mock_session, client):
-    mock_session.query(User).filter().first.return_value = User(name="Test User", email="test@gmail.com",
-                                                                password="testpassword")
+    mock_session.scalar.return_value = User(name="Test User", email="test@gmail.com", password="testpassword")
     mock_get_session.return_value = mock_session
 
     response = client.post("/create_users/", json={
@@ -58,21 +69,46 @@ def test_create_user_already_exists(mock_get_session, mock_session, client):
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_login_user(mock_get_session, mock_session, client):
-    mock_session.query(User).filter().first.return_value = User(name="testuser", email="testuser@example.com",
-                                                                password="password")
+    mock_session.scalar.return_value = User(id=7, name="testuser", email="testuser@example.com",
+                                            password=bcrypt.hashpw(b"password", bcrypt.gensalt(rounds=4)).decode())
     mock_get_session.return_value = mock_session
 
     response = client.post("/login/", json={"email": "testuser@example.com", "password": "password"})
     assert response.status_code == 200
     assert response.json()["message"] == "testuser login successfully"
+    assert jwt.decode(response.json()["data"]["token"], JWT_SECRET, ALGORITHM)["user_id"] == 7
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_login_wrong_password(mock_get_session, mock_session, client):
+    mock_session.scalar.return_value = User(id=7, name="testuser", email="testuser@example.com",
+                                            password=bcrypt.hashpw(b"password", bcrypt.gensalt(rounds=4)).decode())
+    mock_get_session.return_value = mock_session
+
+    response = client.post("/login/", json={"email": "testuser@example.com", "password": "wrongpassword"})
+    assert response.status_code == 401
+    assert response.json() == {"detail": "The credentials are invalid"}
+
+
+@pytest.mark.api
+@patch.dict('starnavi.utils.password_jobs', {"pending": BCRYPT_MAX_QUEUE})
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_login_password_queue_full(mock_get_session, mock_session, client):
+    mock_session.scalar.return_value = User(id=7, name="testuser", email="testuser@example.com", password="hash")
+    mock_get_session.return_value = mock_session
+
+    response = client.post("/login/", json={"email": "testuser@example.com", "password": "password"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_login_invalid_credentials(mock_get_session, mock_session, client):
-    mock_session.query(User).filter.return_value.first.return_value = None
+    mock_session.scalar.return_value = None
     mock_get_session.return_value = mock_session
 
     response = client.post("/login/", json={"email": "invaliduser@example.com", "password": "wrongpassword"})
@@ -80,10 +116,56 @@ def test_login_invalid_credentials(mock_get_session, mock_session, client):
     assert response.json() == {"detail": "The credentials are invalid"}
 
 
+def test_validated_user_id_from_token_claims(mock_session):
+    token = generate_token(user_id=3)
+
+    assert asyncio.run(get_validated_user_id({"Authorization": token}, mock_session)) == 3
+    assert asyncio.run(get_validated_user_id({"Authorization": token}, mock_session)) == 3
+    mock_session.scalar.assert_not_awaited()
+
+
+def test_revoked_user_token_is_rejected(mock_session):
+    token = generate_token(user_id=4)
+    asyncio.run(validate_jwt_token({"Authorization": token}))
+
+    revoke_user_tokens(4)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(validate_jwt_token({"Authorization": token}))
+    assert error.value.status_code == 401
+
+
+@patch('starnavi.utils.revoked_users.poll', autospec=True)
+@patch('starnavi.utils.revoked_users.is_revoked', autospec=True)
+def test_cached_token_is_rejected_after_revocation_elsewhere(mock_is_revoked, mock_poll, mock_session):
+    token = generate_token(user_id=6)
+    mock_is_revoked.return_value = False
+    asyncio.run(validate_jwt_token({"Authorization": token}))
+
+    mock_is_revoked.return_value = True
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(validate_jwt_token({"Authorization": token}))
+    assert error.value.status_code == 401
+    mock_is_revoked.assert_called_with(6)
+    assert mock_poll.call_count == 2
+
+
+@patch('starnavi.utils.revoke_user_tokens', autospec=True)
+def test_deleted_users_are_revoked_only_after_commit(mock_revoke_user_tokens):
+    session = MagicMock(info={"deleted_users": {8}})
+    keep_rolled_back_users(session, None)
+    revoke_deleted_users(session)
+    mock_revoke_user_tokens.assert_not_called()
+
+    session.info["deleted_users"] = {8}
+    revoke_deleted_users(session)
+    mock_revoke_user_tokens.assert_called_once_with(8)
+
+
 @pytest.mark.api
-@patch('starnavi.utils.get_validated_user_id', autospec=True)
-@patch('starnavi.services.analyze_content', autospec=True)
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.main.get_validated_user_id', autospec=True)
+@patch('starnavi.main.moderate', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_create_post(mock_get_session, mock_analyze_content, mock_get_validated_user_id, mock_session, client):
     mock_get_validated_user_id.return_value = 1
     mock_analyze_content.return_value = True
@@ -105,12 +187,120 @@ def test_create_post(mock_get_session, mock_analyze_content, mock_get_validated_
 
 
 @pytest.mark.api
-@patch('starnavi.services.analyze_content', autospec=True)
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.main.schedule_pending_moderation', autospec=True)
+@patch('starnavi.main.moderate', autospec=True)
+@patch('starnavi.main.get_validated_user_id', autospec=True)
+@patch('starnavi.main.ASYNC_MODERATION', True)
+def test_create_post_async_moderation(mock_get_validated_user_id, mock_moderate, mock_schedule, mock_session, client):
+    mock_get_validated_user_id.return_value = 1
+
+    response = client.post("/posts/", json={"title": "Test Post", "content": "This is a test post content"},
+                           headers={"Authorization": generate_token()})
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "pending"
+    mock_moderate.assert_not_called()
+    mock_schedule.assert_awaited_once()
+
+
+@pytest.mark.api
+@patch('starnavi.main.moderate_many', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_create_posts_batch(mock_get_session, mock_moderate_many, mock_session, client):
+    mock_moderate_many.return_value = [True, False, HTTPException(status_code=504, detail="Moderation service timed out")]
+    mock_session.scalar.return_value = 1
+
+    def mock_add_all(instances):
+        for row_id, instance in enumerate(instances, start=10):
+            instance.id = row_id
+
+    mock_session.add_all.side_effect = mock_add_all
+    mock_get_session.return_value = mock_session
+
+    response = client.post("/posts/batch", json={"items": [
+        {"title": "First", "content": "Fine content"},
+        {"title": "Second", "content": "Bad content"},
+        {"title": "Third", "content": "Slow content"}
+    ]}, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"index": 0, "status": "created", "id": 10, "detail": None},
+        {"index": 1, "status": "blocked", "id": 11, "detail": "Post was blocked"},
+        {"index": 2, "status": "error", "id": None, "detail": "Moderation service timed out"}
+    ]
+    assert mock_session.commit.call_count == 1
+
+
+@pytest.mark.api
+@patch('starnavi.main.moderate_many', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_create_comments_batch_unknown_post(mock_get_session, mock_moderate_many, mock_session, client):
+    mock_moderate_many.return_value = [True]
+    mock_session.scalar.return_value = 1
+    mock_session.scalars.return_value.all.return_value = [Post(id=1, should_be_answered=False)]
+
+    def mock_add_all(instances):
+        for instance in instances:
+            instance.id = 5
+
+    mock_session.add_all.side_effect = mock_add_all
+    mock_get_session.return_value = mock_session
+
+    response = client.post("/comments/batch", json={"items": [
+        {"post_id": 2, "content": "Comment on a missing post"},
+        {"post_id": 1, "content": "Comment"}
+    ]}, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"index": 0, "status": "error", "id": None, "detail": "Post not found"},
+        {"index": 1, "status": "created", "id": 5, "detail": None}
+    ]
+
+
+@pytest.mark.api
+@patch('starnavi.utils.analyze_content_async', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_create_post_moderation_timeout(mock_get_session, mock_analyze_content_async, mock_session, client):
+    mock_analyze_content_async.side_effect = asyncio.TimeoutError
+    mock_session.scalar.return_value = 1
+    mock_get_session.return_value = mock_session
+
+    response = client.post("/posts/", json={
+        "title": "Test Post",
+        "content": "This is a test post content"
+    }, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Moderation service timed out"}
+
+
+@pytest.mark.api
+@patch('starnavi.utils.analyze_content_async', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_create_post_moderation_circuit_open(mock_get_session, mock_analyze_content_async, mock_session, client):
+    mock_analyze_content_async.side_effect = CircuitOpenError("gemini", 12.5)
+    mock_session.scalar.return_value = 1
+    mock_get_session.return_value = mock_session
+
+    response = client.post("/posts/", json={
+        "title": "Test Post",
+        "content": "This is a test post content"
+    }, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "13"
+    assert response.json() == {"detail": "Moderation service unavailable, try again later"}
+
+
+@pytest.mark.api
+@patch('starnavi.main.moderate', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_edit_post_success(mock_get_session, mock_analyze_content, mock_session, client):
     mock_analyze_content.return_value = True
     mock_post = Post(id=1, user_id=1, content="Old content")
-    mock_session.query(Post).filter.return_value.first.return_value = mock_post
+    mock_session.get.return_value = mock_post
 
     def mock_update(instance):
         instance.title = "Test Post"
@@ -130,9 +320,9 @@ def test_edit_post_success(mock_get_session, mock_analyze_content, mock_session,
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_remove_post_success(mock_get_session, mock_session, client):
-    mock_session.query(Post).filter.return_value.first.return_value = Post(id=1)
+    mock_session.get.return_value = Post(id=1)
     mock_get_session.return_value = mock_session
 
     response = client.post("/remove_post/", json={"id": 1}, headers={"Authorization": generate_token()})
@@ -142,14 +332,14 @@ def test_remove_post_success(mock_get_session, mock_session, client):
 
 
 @pytest.mark.api
-@patch('starnavi.utils.get_validated_user_id', autospec=True)
-@patch('starnavi.services.analyze_content', autospec=True)
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.main.get_validated_user_id', autospec=True)
+@patch('starnavi.main.moderate', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_create_comment_success(mock_get_session, mock_analyze_content, mock_get_validated_user_id, mock_session, client):
     mock_get_validated_user_id.return_value = 1
     mock_analyze_content.return_value = True
 
-    mock_session.query(Post).filter.return_value.first.return_value = Post(id=1, should_be_answered=False)
+    mock_session.get.return_value = Post(id=1, should_be_answered=False)
 
     mock_get_session.return_value = mock_session
 
@@ -163,12 +353,12 @@ def test_create_comment_success(mock_get_session, mock_analyze_content, mock_get
 
 
 @pytest.mark.api
-@patch('starnavi.services.analyze_content', autospec=True)
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.main.moderate', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_edit_comment_success(mock_get_session, mock_analyze_content, mock_session, client):
-    mock_session.query(Post).filter.return_value.first.return_value = Post(id=1, user_id=1, content="Old content")
     mock_comment = Comment(id=1, user_id=1, post_id=1, content="Old content")
-    mock_session.query(Comment).filter.return_value.first.return_value = mock_comment
+    rows = {Post: Post(id=1, user_id=1, content="Old content"), Comment: mock_comment}
+    mock_session.get.side_effect = lambda model, row_id: rows[model]
 
     def mock_update(instance):
         instance.created_at = "2024-07-05T12:34:56"
@@ -190,12 +380,10 @@ def test_edit_comment_success(mock_get_session, mock_analyze_content, mock_sessi
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_remove_comment_success(mock_get_session, mock_session, client):
-    mock_session.query(Comment).filter.return_value.first.return_value = Comment(id=1)
-
-    mock_session.query(Post).filter.return_value.first.return_value = Post(id=1)
-    mock_session.query(Comment).filter.first.return_value = Comment(id=1)
+    rows = {Post: Post(id=1), Comment: Comment(id=1)}
+    mock_session.get.side_effect = lambda model, row_id: rows[model]
     mock_get_session.return_value = mock_session
 
     response = client.post("/remove_comment/", json={
@@ -208,13 +396,16 @@ def test_remove_comment_success(mock_get_session, mock_session, client):
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_get_posts(mock_get_session, mock_session, client):
-    mock_session.query.return_value.all.return_value = [
-        Post(id=1, user_id=1, title="Test Post", content="Test Content", comments=[], created_at="2024-07-05T12:34:56"),
-        Post(id=2, user_id=2, title="Another Post", content="Another Content", comments=[],
-             created_at="2024-07-05T12:35:56")
-    ]
+    mock_session.execute.return_value.mappings.return_value.all.side_effect = [[
+        {"id": 1, "user_id": 1, "title": "Test Post", "content": "Test Content",
+         "created_at": datetime(2024, 7, 5, 12, 34, 56)},
+        {"id": 2, "user_id": 2, "title": "Another Post", "content": "Another Content",
+         "created_at": datetime(2024, 7, 5, 12, 35, 56)}
+    ], [
+        {"id": 1, "user_id": 2, "post_id": 2, "content": "Comment", "created_at": datetime(2024, 7, 5, 12, 36, 56)}
+    ]]
     mock_get_session.return_value = mock_session
 
     response = client.get("/posts/", headers={"Authorization": generate_token()})
@@ -222,17 +413,104 @@ def test_get_posts(mock_get_session, mock_session, client):
     assert response.json() == [
         {"id": 1, "user_id": 1, "title": "Test Post", "content": "Test Content", "comments": [],
          "created_at": "2024-07-05T12:34:56"},
-        {"id": 2, "user_id": 2, "title": "Another Post", "content": "Another Content", "comments": [],
+        {"id": 2, "user_id": 2, "title": "Another Post", "content": "Another Content",
+         "comments": [{"id": 1, "user_id": 2, "post_id": 2, "content": "Comment", "created_at": "2024-07-05T12:36:56"}],
          "created_at": "2024-07-05T12:35:56"}
     ]
 
 
+def test_latest_comments_query_picks_the_newest_comments_per_post():
+    sql = str(latest_comments_query([1, 2], 5, Comment.id).compile(dialect=postgresql.dialect()))
+    lateral = sql[sql.index("JOIN LATERAL"):]
+
+    assert "WHERE comments.post_id = anon_3.post_id" in lateral
+    assert "ORDER BY comments.created_at DESC, comments.id DESC \n LIMIT" in lateral
+    assert "row_number" not in sql
+    assert sql.endswith("ORDER BY comments.post_id, comments.created_at, comments.id")
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_get_posts_next_cursor(mock_get_session, mock_session, client):
+    mock_session.execute.return_value.mappings.return_value.all.side_effect = [[
+        {"id": 2, "user_id": 1, "title": "Newer Post", "content": "Content",
+         "created_at": datetime(2024, 7, 5, 12, 35, 56)},
+        {"id": 1, "user_id": 1, "title": "Older Post", "content": "Content",
+         "created_at": datetime(2024, 7, 5, 12, 34, 56)}
+    ], []]
+    mock_get_session.return_value = mock_session
+
+    response = client.get("/posts/", params={"limit": 1}, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 200
+    assert [post["id"] for post in response.json()] == [2]
+    assert decode_cursor(response.headers["X-Next-Cursor"]) == (datetime(2024, 7, 5, 12, 35, 56), 2)
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_get_posts_invalid_cursor(mock_get_session, mock_session, client):
+    mock_get_session.return_value = mock_session
+
+    response = client.get("/posts/", params={"cursor": "not-a-cursor"}, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_get_post_comments_pages_with_cursor(mock_get_session, mock_session, client):
+    mock_session.execute.return_value.first.return_value = MagicMock(status="published", comment_count=1200)
+    mock_session.execute.return_value.mappings.return_value.all.return_value = [
+        {"id": 4, "user_id": 1, "post_id": 9, "content": "First", "created_at": datetime(2024, 7, 5, 12, 36, 56)},
+        {"id": 5, "user_id": 2, "post_id": 9, "content": "Second", "created_at": datetime(2024, 7, 5, 12, 37, 56)}
+    ]
+    mock_get_session.return_value = mock_session
+
+    response = client.get("/posts/9/comments", params={"limit": 1}, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 200
+    assert [comment["id"] for comment in response.json()] == [4]
+    assert response.headers["X-Total-Count"] == "1200"
+    assert decode_cursor(response.headers["X-Next-Cursor"]) == (datetime(2024, 7, 5, 12, 36, 56), 4)
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_get_post_comments_unknown_post(mock_get_session, mock_session, client):
+    mock_session.execute.return_value.first.return_value = None
+    mock_get_session.return_value = mock_session
+
+    response = client.get("/posts/9/comments", headers={"Authorization": generate_token()})
+
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Post not found"}
+
+
+def test_comment_counts_follow_published_comments():
+    published = Comment(post_id=1, content="a", status="published", created_at=datetime(2024, 7, 5, 12))
+    pending = Comment(post_id=1, content="b", status="pending")
+    removed = Comment(post_id=2, content="c", status="published")
+    session = MagicMock(new=[published, pending], dirty=[], deleted=[removed], info={})
+
+    collect_comment_counts(session, None, None)
+    counts = session.info["comment_counts"]
+    assert dict(counts) == {1: [1, [datetime(2024, 7, 5, 12)], False], 2: [-1, [], True]}
+
+    update_comment_counts(session, counts)
+    statements = [str(call.args[0].compile(dialect=postgresql.dialect())) for call in session.execute.call_args_list]
+    assert "greatest(posts.last_comment_at" in statements[0]
+    assert "SELECT max(comments.created_at)" in statements[1]
+    assert session.info["changed_tables"] == {"posts"}
+
+
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_get_comments(mock_get_session, mock_session, client):
-    mock_session.query.return_value.all.return_value = [
-        Comment(id=1, user_id=1, post_id=1, content="Comment 1", created_at="2024-07-05T12:36:56"),
-        Comment(id=2, user_id=2, post_id=2, content="Comment 2", created_at="2024-07-05T12:37:56")
+    mock_session.execute.return_value.mappings.return_value.all.return_value = [
+        {"id": 1, "user_id": 1, "post_id": 1, "content": "Comment 1", "created_at": datetime(2024, 7, 5, 12, 36, 56)},
+        {"id": 2, "user_id": 2, "post_id": 2, "content": "Comment 2", "created_at": datetime(2024, 7, 5, 12, 37, 56)}
     ]
     mock_get_session.return_value = mock_session
 
@@ -246,11 +524,11 @@ def test_get_comments(mock_get_session, mock_session, client):
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_get_users(mock_get_session, mock_session, client):
-    mock_session.query.return_value.all.return_value = [
-        User(id=1, name="user1", email="user1@example.com", password="qwert123"),
-        User(id=2, name="user2", email="user2@example.com", password="qwert456")
+    mock_session.execute.return_value.mappings.return_value.all.return_value = [
+        {"id": 1, "name": "user1", "email": "user1@example.com", "password": "qwert123"},
+        {"id": 2, "name": "user2", "email": "user2@example.com", "password": "qwert456"}
     ]
     mock_get_session.return_value = mock_session
 
@@ -264,13 +542,133 @@ def test_get_users(mock_get_session, mock_session, client):
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.main.redis_client', None)
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_metrics_count_requests_by_route(mock_get_session, mock_session, client):
+    mock_session.execute.return_value.mappings.return_value.all.return_value = []
+    mock_get_session.return_value = mock_session
+
+    client.get("/users/", headers={"Authorization": generate_token()})
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'starnavi_requests_total{method="GET",route="/users/",status="200"}' in response.text
+    assert 'starnavi_request_db_queries_count{route="/users/"}' in response.text
+
+
+@pytest.mark.api
+@patch('starnavi.main.COMMENT_WRITE_BEHIND', True)
+@patch('starnavi.main.enqueue_comment', new_callable=AsyncMock)
+@patch('starnavi.main.get_validated_user_id', new_callable=AsyncMock)
+@patch('starnavi.main.moderate', new_callable=AsyncMock)
+def test_create_comment_write_behind(mock_moderate, mock_get_validated_user_id, mock_enqueue_comment, mock_session,
+                                     client):
+    mock_moderate.return_value = True
+    mock_get_validated_user_id.return_value = 1
+    mock_session.get.return_value = Post(id=1, title="Title", content="Content", should_be_answered=False)
+
+    async def enqueue(comment, session):
+        comment.id, comment.created_at = 42, datetime(2024, 7, 5, 12, 36, 56)
+        return True
+    mock_enqueue_comment.side_effect = enqueue
+
+    response = client.post("/comments/", json={"post_id": 1, "content": "Queued"},
+                           headers={"Authorization": generate_token()})
+
+    assert response.status_code == 202
+    assert response.json() == {"id": 42, "user_id": 1, "post_id": 1, "content": "Queued",
+                               "created_at": "2024-07-05T12:36:56", "status": "published"}
+    mock_session.commit.assert_not_awaited()
+
+
+@pytest.mark.api
+@patch('starnavi.main.stream_export')
+def test_export_comments_streams_ndjson(mock_stream_export, client):
+    async def batches(*args):
+        yield encode_ndjson([{"id": 1, "content": "first", "created_at": datetime(2024, 7, 5, 12, 36, 56)}])
+        yield encode_ndjson([{"id": 2, "content": "second", "created_at": datetime(2024, 7, 5, 12, 37, 56)}])
+    mock_stream_export.side_effect = batches
+
+    response = client.get("/export/comments", params={"since": "2024-07-05T00:00:00"},
+                          headers={"Authorization": generate_token()})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.text.splitlines() == ['{"id":1,"content":"first","created_at":"2024-07-05T12:36:56"}',
+                                          '{"id":2,"content":"second","created_at":"2024-07-05T12:37:56"}']
+    assert mock_stream_export.call_args.args[2] == datetime(2024, 7, 5)
+
+
+@pytest.mark.api
+@patch('starnavi.main.resource_etag', new_callable=AsyncMock)
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_get_comments_etag(mock_get_session, mock_resource_etag, mock_session, client):
+    mock_resource_etag.return_value = '"v1"'
+    mock_session.execute.return_value.mappings.return_value.all.return_value = []
+    mock_get_session.return_value = mock_session
+    headers = {"Authorization": generate_token()}
+
+    response = client.get("/comments/", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"v1"'
+
+    mock_session.execute.reset_mock()
+    response = client.get("/comments/", headers={**headers, "If-None-Match": '"v1"'})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == '"v1"'
+    mock_session.execute.assert_not_awaited()
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_search(mock_get_session, mock_session, client):
+    mock_session.execute.return_value.mappings.return_value.all.return_value = [
+        {"kind": "post", "id": 3, "post_id": 3, "title": "Cats", "snippet": "all about <mark>cats</mark>",
+         "rank": 0.6, "created_at": datetime(2024, 7, 5, 12, 34, 56)},
+        {"kind": "comment", "id": 7, "post_id": 3, "title": "Cats", "snippet": "my <mark>cat</mark> agrees",
+         "rank": 0.1, "created_at": datetime(2024, 7, 5, 12, 35, 56)},
+    ]
+    mock_get_session.return_value = mock_session
+
+    response = client.get("/search", params={"q": "cats", "limit": 1}, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 200
+    assert response.json() == [{"kind": "post", "id": 3, "post_id": 3, "title": "Cats",
+                                "snippet": "all about <mark>cats</mark>", "rank": 0.6,
+                                "created_at": "2024-07-05T12:34:56"}]
+    assert response.headers["X-Next-Offset"] == "1"
+    assert "statement_timeout" in str(mock_session.execute.await_args_list[0].args[0])
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_search_timeout(mock_get_session, mock_session, client):
+    cancelled = Exception("canceling statement due to statement timeout")
+    cancelled.pgcode = "57014"
+    mock_session.execute.side_effect = [None, DBAPIError("SELECT", {}, cancelled)]
+    mock_get_session.return_value = mock_session
+
+    response = client.get("/search", params={"q": "cats"}, headers={"Authorization": generate_token()})
+
+    assert response.status_code == 503
+
+
+def test_search_query_only_requested_kinds():
+    sql = str(search_query("cats", {"comment"}, 10, 0).compile(dialect=postgresql.dialect()))
+
+    assert "comments.search_vector @@ websearch_to_tsquery" in sql
+    assert "posts.search_vector" not in sql
+    assert "ts_headline" in sql
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_get_blocked(mock_get_session,  mock_session, client):
-    mock_session.query.return_value.all.return_value = [
-        ContentBlocked(id=1, user_id=1, post_id=1, content="Blocked Content 1", created_at="2024-07-05T12:38:56",
-                       title=None),
-        ContentBlocked(id=2, user_id=2, post_id=2, content="Blocked Content 2", created_at="2024-07-05T12:39:56",
-                       title="Title Blocked")
+    mock_session.execute.return_value.mappings.return_value.all.return_value = [
+        {"id": 1, "user_id": 1, "post_id": 1, "content": "Blocked Content 1",
+         "created_at": datetime(2024, 7, 5, 12, 38, 56), "title": None},
+        {"id": 2, "user_id": 2, "post_id": 2, "content": "Blocked Content 2",
+         "created_at": datetime(2024, 7, 5, 12, 39, 56), "title": "Title Blocked"}
     ]
     mock_get_session.return_value = mock_session
 
@@ -286,34 +684,13 @@ def test_get_blocked(mock_get_session,  mock_session, client):
 
 
 @pytest.mark.api
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_get_comments_daily_breakdown(mock_get_session, mock_session, client):
-    created_comments = [
-        MagicMock(date=date(2024, 7, 1), count=2),
-        MagicMock(date=date(2024, 7, 2), count=1)
+    mock_session.scalars.return_value.all.return_value = [
+        CommentDailyStats(day=date(2024, 7, 2), created_comments=1, blocked_comments=1),
+        CommentDailyStats(day=date(2024, 7, 1), created_comments=2, blocked_comments=1)
     ]
 
-    blocked_comments = [
-        MagicMock(date=date(2024, 7, 1), count=1),
-        MagicMock(date=date(2024, 7, 2), count=1)
-    ]
-
-    def mock_query(*args, **kwargs):
-        class MockQuery:
-            def filter(self, *args, **kwargs):
-                return self
-
-            def group_by(self, *args, **kwargs):
-                return self
-
-            # check this
-            def all(self):
-                return created_comments if 'comments.created_at' in str(args[0]) else blocked_comments
-
-        return MockQuery()
-
-    mock_session.query.side_effect = mock_query
-
     mock_get_session.return_value = mock_session
 
     headers = {"Authorization": generate_token()}
@@ -326,17 +703,48 @@ def test_get_comments_daily_breakdown(mock_get_session, mock_session, client):
     assert response.status_code == 200
     assert response.json() == [
         {"date": "2024-07-01", "created_comments": 2, "blocked_comments": 1},
-        {"date": "2024-07-02", "created_comments": 1, "blocked_comments": 1}
+        {"date": "2024-07-02", "created_comments": 1, "blocked_comments": 1},
+        {"date": "2024-07-03", "created_comments": 0, "blocked_comments": 0}
     ]
 
 
 @pytest.mark.api
-@patch('starnavi.utils.get_validated_user_id', autospec=True)
-@patch('starnavi.services.analyze_content', autospec=True)
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_get_comments_daily_breakdown_invalid_range(mock_get_session, mock_session, client):
+    mock_get_session.return_value = mock_session
+
+    response = client.get("/api/comments-daily-breakdown", headers={"Authorization": generate_token()}, params={
+        "date_from": "2024-07-03",
+        "date_to": "2024-07-01"
+    })
+
+    assert response.status_code == 400
+
+
+@pytest.mark.api
+@patch('starnavi.database.db.get_async_session', autospec=True)
+def test_get_comments_daily_breakdown_rejects_huge_ranges(mock_get_session, mock_session, client):
+    mock_get_session.return_value = mock_session
+
+    response = client.get("/api/comments-daily-breakdown", headers={"Authorization": generate_token()}, params={
+        "date_from": "0001-01-01",
+        "date_to": "9999-12-31"
+    })
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": f"The range must not exceed {ANALYTICS_MAX_DAYS} days"}
+    mock_session.scalars.assert_not_awaited()
+
+
+@pytest.mark.api
+@patch('starnavi.main.get_validated_user_id', autospec=True)
+@patch('starnavi.main.moderate', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_comment_bad_content(mock_get_session, mock_analyze_content, mock_get_validated_user_id, mock_session, client):
     mock_get_validated_user_id.return_value = 1
     mock_analyze_content.return_value = False
+    rows = {Post: Post(id=1, user_id=1), Comment: Comment(id=1, user_id=1, post_id=1, content="Old content")}
+    mock_session.get.side_effect = lambda model, row_id: rows[model]
 
     mock_get_session.return_value = mock_session
 
@@ -351,18 +759,17 @@ def test_comment_bad_content(mock_get_session, mock_analyze_content, mock_get_va
 
 
 @pytest.mark.api
-@patch('starnavi.utils.get_validated_user_id', autospec=True)
-@patch('starnavi.services.analyze_content', autospec=True)
+@patch('starnavi.main.get_validated_user_id', autospec=True)
+@patch('starnavi.main.moderate', autospec=True)
 @patch('starnavi.celery_app.tasks.send_automatic_reply.apply_async', autospec=True)
-@patch('starnavi.database.db.get_session', autospec=True)
+@patch('starnavi.database.db.get_async_session', autospec=True)
 def test_create_comment_should_be_answered(mock_get_session, mock_apply_async, mock_analyze_content,
                                            mock_get_validated_user_id, mock_session, client):
     mock_get_validated_user_id.return_value = 1
     mock_analyze_content.return_value = True
 
-    mock_session.query(Post).filter.return_value.first.return_value = Post(id=1, title="Test Title",
-                                                                           content="This is a test post content",
-                                                                           should_be_answered=True)
+    mock_session.get.return_value = Post(id=1, title="Test Title", content="This is a test post content",
+                                         should_be_answered=True)
 
     mock_get_session.return_value = mock_session
 
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from starnavi.config import MODERATION_LEXICON
+from starnavi.moderation import LocalPrefilter, ModerationBackend, ModerationPipeline
+
+
+class FixedBackend(ModerationBackend):
+    name = "remote"
+
+    def __init__(self, verdict):
+        self.verdict = verdict
+        self.calls = 0
+
+    async def classify(self, content, title=""):
+        self.calls += 1
+        return self.verdict
+
+
+@pytest.fixture
+def prefilter():
+    return LocalPrefilter(block_words=["scumbag"], allow_phrases=["thanks", "nice post, thanks"])
+
+
+def test_prefilter_allows_stock_replies(prefilter):
+    assert prefilter.decide("Thanks!") is True
+    assert prefilter.decide("Nice post,  thanks.") is True
+
+
+def test_prefilter_blocks_lexicon_match(prefilter):
+    assert prefilter.decide("You are a SCUMBAG.") is False
+
+
+@pytest.mark.parametrize("content", [
+    "How are you doing today?",
+    "I will find where you live and hurt your family",
+    "you are worthless trash, go away",
+    "Go back to your country you animals",
+    "how to make meth at home",
+    "killing it",
+    "thanks, idiot",
+])
+def test_prefilter_escalates_everything_else(prefilter, content):
+    assert prefilter.decide(content) is None
+
+
+def test_prefilter_does_not_allow_posts_by_title(prefilter):
+    assert prefilter.decide("I will hurt you", "Thanks") is None
+
+
+def test_shipped_lexicon_escalates_abuse_without_keywords():
+    prefilter = LocalPrefilter.from_file(MODERATION_LEXICON)
+
+    for content in ("I will find where you live and hurt your family", "you are worthless trash, go away",
+                    "Go back to your country you animals", "how to make meth at home"):
+        assert prefilter.decide(content) is None
+    assert prefilter.decide("thanks") is True
+
+
+def test_pipeline_short_circuits_before_remote_backend(prefilter):
+    remote = FixedBackend(False)
+    pipeline = ModerationPipeline([prefilter, remote])
+
+    assert asyncio.run(pipeline.classify("Nice post, thanks")) is True
+    assert asyncio.run(pipeline.classify("you are worthless trash, go away")) is False
+
+    assert remote.calls == 1
+    assert pipeline.stats == {"decided_by": {"local": 1, "remote": 1}, "total": 2, "short_circuit_ratio": 0.5}
+
+
+def test_pipeline_records_outcome_metrics(prefilter):
+    pipeline = ModerationPipeline([prefilter, FixedBackend(False)])
+
+    def outcome(backend, name):
+        return REGISTRY.get_sample_value("starnavi_moderation_total", {"backend": backend, "outcome": name}) or 0
+
+    before = outcome("local", "escalated"), outcome("remote", "blocked")
+    asyncio.run(pipeline.classify("you are worthless trash"))
+
+    assert (outcome("local", "escalated"), outcome("remote", "blocked")) == (before[0] + 1, before[1] + 1)
+
+
+def test_gemini_client_is_built_once_on_first_use(monkeypatch):
+    import starnavi.services as services
+
+    built = []
+    monkeypatch.setattr(services, "build_model", lambda: built.append(1) or "model")
+    monkeypatch.setattr(services, "build_generation_options", lambda: ("config", ["safety"]))
+    services.get_client.cache_clear()
+    try:
+        assert asyncio.run(services.get_client_async()) == ("model", "config", ["safety"])
+        assert services.get_client() == ("model", "config", ["safety"])
+        assert built == [1]
+    finally:
+        services.get_client.cache_clear()
@@ -0,0 +1,56 @@
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+from starnavi.database.partitions import (add_months, create_partitions, ensure_partitions_between, partition_name,
+                                         retire_partitions)
+
+
+def executed_sql(connection):
+    return [str(call.args[0]) for call in connection.execute.call_args_list]
+
+
+def test_add_months_crosses_years():
+    assert add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert partition_name("comments", date(2024, 7, 1)) == "comments_y2024m07"
+
+
+@patch('starnavi.database.partitions.list_partitions', autospec=True)
+def test_create_partitions_skips_existing_months(mock_list_partitions):
+    mock_list_partitions.return_value = {"comments_y2024m12": date(2024, 12, 1)}
+    connection = MagicMock()
+
+    assert create_partitions(connection, "comments", date(2024, 11, 15), date(2025, 1, 1)) == [
+        "comments_y2024m11", "comments_y2025m01"]
+    assert executed_sql(connection) == [
+        "CREATE TABLE IF NOT EXISTS comments_y2024m11 PARTITION OF comments "
+        "FOR VALUES FROM ('2024-11-01 00:00:00+00') TO ('2024-12-01 00:00:00+00')",
+        "CREATE TABLE IF NOT EXISTS comments_y2025m01 PARTITION OF comments "
+        "FOR VALUES FROM ('2025-01-01 00:00:00+00') TO ('2025-02-01 00:00:00+00')",
+    ]
+
+
+@patch('starnavi.database.partitions.list_partitions', autospec=True, return_value={})
+def test_ensure_partitions_between_covers_historical_days(mock_list_partitions):
+    connection = MagicMock()
+
+    created = ensure_partitions_between(connection, date(2019, 1, 15), date(2019, 2, 3))
+
+    assert created == ["comments_y2018m12", "comments_y2019m01", "comments_y2019m02", "comments_y2019m03",
+                       "block_contents_y2018m12", "block_contents_y2019m01", "block_contents_y2019m02",
+                       "block_contents_y2019m03"]
+
+
+@patch('starnavi.database.partitions.current_month', autospec=True, return_value=date(2025, 3, 1))
+@patch('starnavi.database.partitions.list_partitions', autospec=True)
+def test_retire_partitions_detaches_months_past_retention(mock_list_partitions, mock_current_month):
+    mock_list_partitions.side_effect = lambda connection, table: {
+        f"{table}_y2024m12": date(2024, 12, 1), f"{table}_y2025m01": date(2025, 1, 1),
+        f"{table}_y2025m02": date(2025, 2, 1)}
+    connection = MagicMock()
+
+    assert retire_partitions(connection, keep_months=2, drop=True) == ["comments_y2024m12", "block_contents_y2024m12"]
+    assert executed_sql(connection) == [
+        "ALTER TABLE comments DETACH PARTITION comments_y2024m12", "DROP TABLE comments_y2024m12",
+        "ALTER TABLE block_contents DETACH PARTITION block_contents_y2024m12", "DROP TABLE block_contents_y2024m12",
+    ]
@@ -0,0 +1,26 @@
+from sqlalchemy import create_engine, text
+
+from starnavi.profiler import RequestProfile, current_profile, profile_engine, statement_shape
+
+
+def test_statement_shape_ignores_values():
+    assert statement_shape("SELECT * FROM posts WHERE id = 1") == statement_shape("SELECT * FROM posts WHERE id = 42")
+    assert statement_shape("SELECT * FROM posts WHERE id IN ($1, $2)") == "SELECT * FROM posts WHERE id IN (?)"
+    assert statement_shape("SELECT 'a''b'") == "SELECT ?"
+
+
+def test_profile_flags_repeated_statements():
+    engine = create_engine("sqlite://")
+    profile_engine(engine, slow_query_ms=10_000)
+    profile = RequestProfile("GET /posts/")
+    token = current_profile.set(profile)
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            for post_id in range(6):
+                connection.execute(text("SELECT :id AS post_id"), {"id": post_id})
+    finally:
+        current_profile.reset(token)
+
+    assert profile.queries == 7
+    assert profile.repeated(threshold=5) == [("SELECT ? AS post_id", 6)]
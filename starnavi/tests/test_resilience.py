@@ -0,0 +1,104 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from starnavi.resilience import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, call_async, call_sync,
+                                 hedged_async)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", window=4, min_calls=4, error_ratio=0.5, slow_seconds=1.0, slow_ratio=0.75,
+                          open_seconds=30, clock=clock)
+
+
+def test_breaker_trips_on_errors_and_recovers_after_probe(breaker, clock):
+    for failed in (False, True, False, True):
+        breaker.before_call()
+        breaker.record(0.1, failed=failed)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_after == 30
+
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(0.1, failed=False, probe=True)
+    assert breaker.state == CLOSED
+    assert breaker.stats == {"state": CLOSED, "trips": 1, "recent_calls": 0, "recent_errors": 0, "recent_slow": 0}
+
+
+def test_breaker_trips_on_latency(breaker):
+    for elapsed in (2.0, 2.0, 0.1, 2.0):
+        breaker.record(elapsed, failed=False)
+    assert breaker.state == OPEN
+
+
+def test_breaker_ignores_calls_finishing_after_it_opened(breaker, clock):
+    for _ in range(4):
+        breaker.record(0.1, failed=True)
+    breaker.record(0.1, failed=False)
+    assert breaker.state == OPEN
+
+    clock.now += 30
+    breaker.before_call()
+    breaker.record(0.1, failed=True, probe=True)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+
+
+def test_hedged_call_returns_the_first_success():
+    calls = []
+
+    async def attempt():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+            return "slow"
+        return "hedge"
+
+    assert asyncio.run(hedged_async(attempt, 0.01)) == "hedge"
+    assert calls == [0, 1]
+
+
+def test_call_async_applies_the_deadline(breaker):
+    async def attempt():
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(call_async(breaker, attempt, timeout=0.01))
+    assert breaker.stats["recent_errors"] == 1
+
+
+def test_call_sync_hedges_and_applies_the_deadline(breaker):
+    calls = []
+
+    def attempt():
+        index = len(calls)
+        calls.append(index)
+        time.sleep(0.5 if index == 0 else 0)
+        return index
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert call_sync(breaker, attempt, executor, timeout=1, hedge_after=0.01) == 1
+        with pytest.raises(TimeoutError):
+            call_sync(breaker, lambda: time.sleep(0.2), executor, timeout=0.01)
+    assert breaker.stats["recent_errors"] == 1
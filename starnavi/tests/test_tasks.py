@@ -0,0 +1,131 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+
+import pytest
+from sqlalchemy.exc import SQLAlchemyError
+
+from starnavi.celery_app.tasks import (flush_automatic_replies, flush_comment_stream, moderate_pending,
+                                       moderate_pending_batch)
+from starnavi.database.db import Comment, ContentBlocked, Post, PENDING, PUBLISHED
+from starnavi.utils import schedule_automatic_reply
+
+
+@patch('starnavi.celery_app.tasks.insert_replies', autospec=True)
+@patch('starnavi.celery_app.tasks.redis_client')
+def test_flush_automatic_replies_writes_one_batch(mock_redis, mock_insert_replies):
+    rows = [json.dumps({"post_id": 1, "content": "reply 1"}), json.dumps({"post_id": 2, "content": "reply 2"})]
+    pipe = mock_redis.pipeline.return_value.__enter__.return_value
+    pipe.lrange.return_value.ltrim.return_value.execute.return_value = [rows, True]
+
+    assert flush_automatic_replies() == 2
+    mock_insert_replies.assert_called_once_with([{"post_id": 1, "content": "reply 1"},
+                                                 {"post_id": 2, "content": "reply 2"}])
+
+
+@patch('starnavi.utils.send_automatic_reply')
+@patch('starnavi.utils.redis_client')
+def test_schedule_automatic_reply_coalesces_per_post(mock_redis, mock_send_automatic_reply):
+    mock_redis.set = AsyncMock(side_effect=[True, None])
+    post = Post(id=1, title="Title", content="Content", time_for_ai_answer=5)
+
+    assert asyncio.run(schedule_automatic_reply(post)) is True
+    assert asyncio.run(schedule_automatic_reply(post)) is False
+
+    mock_send_automatic_reply.apply_async.assert_called_once_with(("Content", "Title", 1), countdown=5)
+
+
+@patch('starnavi.celery_app.tasks.write_comments', autospec=True)
+@patch('starnavi.celery_app.tasks.redis_client')
+def test_flush_comment_stream_acks_after_commit(mock_redis, mock_write_comments):
+    comment = {"id": 7, "user_id": 2, "post_id": 1, "content": "Queued", "created_at": "2024-07-05T12:36:56+00:00"}
+    entries = [(b"1720182000000-0", {b"comment": json.dumps(comment).encode()})]
+    mock_redis.xreadgroup.side_effect = [[], [[b"stream", entries]], [], []]
+    mock_redis.xautoclaim.return_value = [b"0-0", [], []]
+    mock_write_comments.return_value = 1
+    pipe = mock_redis.pipeline.return_value.__enter__.return_value
+
+    assert flush_comment_stream() == 1
+
+    written = mock_write_comments.call_args.args[0]
+    assert [(row["id"], row["created_at"].year) for row in written] == [(7, 2024)]
+    pipe.xack.assert_called_once_with("starnavi:comment_stream", "comment-writers", b"1720182000000-0")
+
+
+@patch('starnavi.celery_app.tasks.write_comments', autospec=True, side_effect=SQLAlchemyError("down"))
+@patch('starnavi.celery_app.tasks.redis_client')
+def test_flush_comment_stream_keeps_entries_when_the_insert_fails(mock_redis, mock_write_comments):
+    comment = {"id": 7, "user_id": 2, "post_id": 1, "content": "Queued", "created_at": "2024-07-05T12:36:56+00:00"}
+    mock_redis.xreadgroup.return_value = [[b"stream", [(b"1720182000000-0", {b"comment": json.dumps(comment)})]]]
+
+    with pytest.raises(SQLAlchemyError):
+        flush_comment_stream()
+
+    mock_redis.pipeline.assert_not_called()
+
+
+def claimed_rows(rows, claimed_until):
+    return [SimpleNamespace(id=row.id, content=row.content, title=getattr(row, "title", None),
+                            claimed_until=claimed_until) for row in rows]
+
+
+@patch('starnavi.celery_app.tasks.schedule_reply', autospec=True)
+@patch('starnavi.celery_app.tasks.bump_versions_sync', autospec=True)
+@patch('starnavi.celery_app.tasks.classify_pending', autospec=True)
+@patch('starnavi.celery_app.tasks.Session')
+def test_moderate_pending_batch_publishes_blocks_and_keeps_failures(mock_session_class, mock_classify, mock_bump,
+                                                                    mock_schedule_reply):
+    created_at = datetime(2024, 7, 5, tzinfo=timezone.utc)
+    comments = [Comment(id=i, user_id=2, post_id=1, content=f"comment {i}", status=PENDING, created_at=created_at,
+                        claimed_until=created_at) for i in (1, 2, 3)]
+    post = Post(id=1, title="Title", content="Content", should_be_answered=True)
+    session = mock_session_class.return_value
+    session.execute.return_value.all.return_value = claimed_rows(comments, created_at)
+    session.scalars.return_value.all.side_effect = [comments, [post]]
+    mock_classify.return_value = [True, False, TimeoutError()]
+
+    assert moderate_pending_batch(Comment) == (2, 1)
+
+    assert [comment.status for comment in comments] == [PUBLISHED, PENDING, PENDING]
+    assert comments[2].claimed_until is None
+    blocked = session.add.call_args.args[0]
+    assert isinstance(blocked, ContentBlocked)
+    assert (blocked.post_id, blocked.content, blocked.created_at) == (1, "comment 2", created_at)
+    session.delete.assert_called_once_with(comments[1])
+    # The claim and the verdicts are committed separately, with the model called in between.
+    assert session.commit.call_count == 2
+    mock_schedule_reply.assert_called_once_with(post)
+
+
+@patch('starnavi.celery_app.tasks.bump_versions_sync', autospec=True)
+@patch('starnavi.celery_app.tasks.classify_pending', autospec=True)
+@patch('starnavi.celery_app.tasks.Session')
+def test_moderate_pending_batch_deletes_comments_of_blocked_posts_through_the_session(mock_session_class,
+                                                                                    mock_classify, mock_bump):
+    created_at = datetime(2024, 7, 5, tzinfo=timezone.utc)
+    post = Post(id=1, user_id=2, title="Title", content="Content", status=PENDING, created_at=created_at)
+    comment = Comment(id=5, user_id=3, post_id=1, content="comment", status=PUBLISHED, created_at=created_at)
+    session = mock_session_class.return_value
+    session.execute.return_value.all.return_value = claimed_rows([post], created_at)
+    session.scalars.return_value.all.return_value = [post]
+    session.scalars.return_value.__iter__.return_value = iter([comment])
+    mock_classify.return_value = [False]
+
+    assert moderate_pending_batch(Post) == (1, 0)
+
+    assert [call.args[0] for call in session.delete.call_args_list] == [comment, post]
+
+
+@patch('starnavi.celery_app.tasks.moderate_pending.apply_async')
+@patch('starnavi.celery_app.tasks.redis_client')
+@patch('starnavi.celery_app.tasks.moderate_pending_batch', autospec=True)
+def test_moderate_pending_schedules_one_retry_on_failures(mock_batch, mock_redis, mock_apply_async):
+    mock_batch.side_effect = [(3, 1), (2, 0)]
+    mock_redis.set.return_value = True
+
+    assert moderate_pending() == 5
+
+    mock_redis.set.assert_called_once_with("starnavi:moderation_flush:retry", 1, nx=True, ex=30)
+    mock_apply_async.assert_called_once_with(countdown=30)
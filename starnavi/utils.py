@@ -1,25 +1,151 @@
+import asyncio
+import base64
+import binascii
+import hashlib
 import logging
+import math
 import re
-from datetime import datetime
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 import bcrypt
 import jwt
+import orjson
 from fastapi import HTTPException
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from redis.exceptions import RedisError
+from sqlalchemy import and_, cast, func, literal, select, event, or_, text, true, union_all
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import set_committed_value
 
-from starnavi.database.db import User
-from starnavi.config import KEY, JWT_SECRET, ALGORITHM
+from starnavi.database.db import User, Post, Comment, AsyncSessionLocal, PUBLISHED, SEARCH_CONFIG
+from starnavi.cache import TTLCache, redis_client, resource_versions, revoked_users
+from starnavi.celery_app.tasks import send_automatic_reply, flush_comments, moderate_pending
+from starnavi.config import (JWT_SECRET, ALGORITHM, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, TOKEN_LIFETIME_MINUTES,
+                             BCRYPT_ROUNDS, BCRYPT_WORKERS, BCRYPT_MAX_QUEUE, AI_REPLY_WINDOW, AI_REPLY_LOCK_PREFIX,
+                             COMMENT_STREAM, COMMENT_FLUSH_INTERVAL, COMMENT_FLUSH_LOCK, ASYNC_MODERATION_INTERVAL,
+                             ASYNC_MODERATION_LOCK, SEARCH_MAX_CANDIDATES, SEARCH_TIMEOUT_MS)
+from starnavi.metrics import BCRYPT_SECONDS
+from starnavi.models import CommentModel
+from starnavi.resilience import CircuitOpenError
+from starnavi.serialization import model_columns, rows_as_dicts, encode_ndjson
+from starnavi.services import analyze_content_async
+
+
+password_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+password_jobs = {"pending": 0}
 
 
 def encryption(password):
-    return bcrypt.hashpw(password.encode(), KEY).decode()
+    with BCRYPT_SECONDS.labels("hash").time():
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+
+def check_password(password, hashed):
+    try:
+        with BCRYPT_SECONDS.labels("verify").time():
+            return bcrypt.checkpw(password.encode(), hashed.encode())
+    except ValueError:
+        logging.error("Stored password is not a valid bcrypt hash")
+        return False
+
+
+async def run_password_job(func, *args):
+    if password_jobs["pending"] >= BCRYPT_MAX_QUEUE:
+        raise HTTPException(status_code=503, detail="Too many password operations, try again later",
+                            headers={"Retry-After": "1"})
+    password_jobs["pending"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs["pending"] -= 1
+
+
+async def hash_password(password):
+    return await run_password_job(encryption, password)
+
 
+async def verify_password(password, hashed):
+    return await run_password_job(check_password, password, hashed)
 
-def create_ai_user_in_db(session: Session):
-    hashed = encryption("gemini123")
+
+async def create_ai_user_in_db(session: AsyncSession):
+    hashed = await hash_password("gemini123")
     ai_user = User(name="Gemini", email="gemini@gmail.com", password=hashed)
-    insert_into_db(ai_user, session)
+    await insert_into_db_async(ai_user, session)
+
+
+async def moderate(content, title=""):
+    try:
+        return await analyze_content_async(content, title)
+    except asyncio.TimeoutError:
+        logging.error("Moderation request timed out")
+        raise HTTPException(status_code=504, detail="Moderation service timed out")
+    except CircuitOpenError as e:
+        logging.error(f"Moderation unavailable: {e}")
+        raise HTTPException(status_code=503, detail="Moderation service unavailable, try again later",
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+async def schedule_automatic_reply(post):
+    """Enqueue one automatic reply per post per window; comments arriving inside the window share it."""
+    if redis_client is not None:
+        window = max(AI_REPLY_WINDOW, post.time_for_ai_answer or 0)
+        try:
+            if not await redis_client.set(f"{AI_REPLY_LOCK_PREFIX}{post.id}", 1, nx=True, ex=window):
+                return False
+        except RedisError as e:
+            logging.warning(f"Automatic reply lock failed, scheduling anyway: {e}")
+
+    send_automatic_reply.apply_async((post.content, post.title, post.id), countdown=post.time_for_ai_answer)
+    return True
+
+
+async def schedule_comment_flush():
+    """Enqueue at most one stream flush per interval; it drains everything appended until it runs."""
+    try:
+        if not await redis_client.set(COMMENT_FLUSH_LOCK, 1, nx=True, ex=COMMENT_FLUSH_INTERVAL):
+            return False
+    except RedisError as e:
+        logging.warning(f"Comment flush lock failed, scheduling anyway: {e}")
+    flush_comments.apply_async(countdown=COMMENT_FLUSH_INTERVAL)
+    return True
+
+
+async def schedule_pending_moderation():
+    """Enqueue at most one moderation run per interval; it settles everything pending by the time it runs."""
+    if redis_client is not None:
+        try:
+            if not await redis_client.set(ASYNC_MODERATION_LOCK, 1, nx=True, ex=ASYNC_MODERATION_INTERVAL):
+                return False
+        except RedisError as e:
+            logging.warning(f"Moderation lock failed, scheduling anyway: {e}")
+    moderate_pending.apply_async(countdown=ASYNC_MODERATION_INTERVAL)
+    return True
+
+
+async def enqueue_comment(comment, session: AsyncSession):
+    """Write-behind: allocate the id, append the comment to the Redis stream and let Celery commit it in a batch.
+
+    Returns False when Redis is unavailable so the caller can insert directly; the id stays allocated either way.
+    """
+    if redis_client is None:
+        return False
+    comment.id = await session.scalar(select(func.nextval(func.pg_get_serial_sequence(Comment.__tablename__, "id"))))
+    comment.created_at = datetime.now(timezone.utc)
+    payload = {"id": comment.id, "user_id": comment.user_id, "post_id": comment.post_id, "content": comment.content,
+               "created_at": comment.created_at.isoformat()}
+    try:
+        await redis_client.xadd(COMMENT_STREAM, {"comment": orjson.dumps(payload)})
+    except RedisError as e:
+        logging.warning(f"Comment stream unavailable, inserting directly: {e}")
+        return False
+    await schedule_comment_flush()
+    return True
 
 
 def email_check(email):
@@ -39,6 +165,61 @@ def insert_into_db(obj, session: Session):
         raise HTTPException(status_code=502, detail=f'Bad Gateway {e}')
 
 
+async def insert_into_db_async(obj, session: AsyncSession):
+    try:
+        session.add(obj)
+        await session.commit()
+    except SQLAlchemyError as e:
+        logging.error(f"Error occurred while executing SQL commands: {e}")
+        await session.rollback()
+        raise HTTPException(status_code=502, detail=f'Bad Gateway {e}')
+
+
+async def insert_all_into_db_async(objs, session: AsyncSession):
+    try:
+        session.add_all(objs)
+        await session.flush()
+        ids = [obj.id for obj in objs]
+        await session.commit()
+        return ids
+    except SQLAlchemyError as e:
+        logging.error(f"Error occurred while executing SQL commands: {e}")
+        await session.rollback()
+        raise HTTPException(status_code=502, detail=f'Bad Gateway {e}')
+
+
+async def moderate_many(items):
+    """Moderate (content, title) pairs concurrently; failed calls come back as the raised exception."""
+    return await asyncio.gather(*(moderate(content, title) for content, title in items), return_exceptions=True)
+
+
+token_cache = TTLCache(TOKEN_CACHE_SIZE)
+
+
+def revoke_user_tokens(user_id):
+    """Drop the user's cached tokens here and publish the revocation for the other processes to pick up."""
+    for token, data in token_cache.items():
+        if data.get("user_id") == user_id:
+            token_cache.pop(token)
+    revoked_users.revoke(user_id, TOKEN_LIFETIME_MINUTES * 60)
+
+
+@event.listens_for(User, "after_delete")
+def forget_deleted_user(mapper, connection, target):
+    object_session(target).info.setdefault("deleted_users", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def revoke_deleted_users(session):
+    for user_id in session.info.pop("deleted_users", ()):
+        revoke_user_tokens(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def keep_rolled_back_users(session, previous_transaction):
+    session.info.pop("deleted_users", None)
+
+
 async def validate_jwt_token(headers):
     token = None
     if "Authorization" in headers:
@@ -46,6 +227,15 @@ async def validate_jwt_token(headers):
         if not token:
             raise HTTPException(status_code=400, detail="Authentication Token is missing!")
 
+    # Revocations from other processes are pulled in the background; the checks below only read local state.
+    revoked_users.poll()
+    data = token_cache.get(token) if token else None
+    if data is not None:
+        if revoked_users.is_revoked(data.get("user_id")):
+            token_cache.pop(token)
+            raise HTTPException(status_code=401, detail="Token is invalid")
+        return data
+
     try:
         data = jwt.decode(token, JWT_SECRET, ALGORITHM)
         current_email = data["email"]
@@ -57,6 +247,10 @@ async def validate_jwt_token(headers):
         if current_time > expiration_datetime:
             raise HTTPException(status_code=401, detail="Token has expired")
 
+        if revoked_users.is_revoked(data.get("user_id")):
+            raise HTTPException(status_code=401, detail="Token is invalid")
+
+        token_cache.set(token, data, min(TOKEN_CACHE_TTL, data["exp"] - time.time()))
         return data
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
@@ -64,14 +258,154 @@ async def validate_jwt_token(headers):
         raise HTTPException(status_code=401, detail="Token is invalid")
 
 
-async def get_validated_user_id(headers, session: Session):
+async def get_validated_user_id(headers, session: AsyncSession):
     decoded_payload = await validate_jwt_token(headers)
     if not decoded_payload:
         raise HTTPException(status_code=401, detail="Invalid Authentication token!")
 
-    current_user = session.query(User).filter(User.email == str(decoded_payload["email"])).first()
+    if decoded_payload.get("user_id"):
+        return decoded_payload["user_id"]
+
+    user_id = await session.scalar(select(User.id).where(User.email == str(decoded_payload["email"])))
 
-    if not current_user:
+    if not user_id:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return current_user.id
+    decoded_payload["user_id"] = user_id
+    return user_id
+
+
+def encode_cursor(created_at: datetime, row_id: int):
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def latest_comments_query(post_ids, limit, *columns):
+    """`columns` of the `limit` newest published comments of each post, oldest of them first.
+
+    A LATERAL subquery per post reads at most `limit` entries of the (post_id, created_at, id) index, so the cost does
+    not grow with the number of comments a post has.
+    """
+    posts = select(Post.id.label("post_id")).where(Post.id.in_(post_ids)).subquery()
+    newest = select(Comment.id, Comment.created_at).where(
+        Comment.post_id == posts.c.post_id, Comment.status == PUBLISHED
+    ).order_by(Comment.created_at.desc(), Comment.id.desc()).limit(limit).lateral()
+    picked = select(newest.c.id, newest.c.created_at).select_from(posts).join(newest, true()).subquery()
+
+    return select(*columns).join(
+        picked, and_(Comment.id == picked.c.id, Comment.created_at == picked.c.created_at)
+    ).order_by(Comment.post_id, Comment.created_at, Comment.id)
+
+
+async def attach_latest_comments(posts, session: AsyncSession, limit: int):
+    """Load up to `limit` comments per post with a single query and attach them without lazy loading."""
+    post_ids = [post.id for post in posts]
+    grouped = defaultdict(list)
+    if post_ids and limit > 0:
+        for comment in await session.scalars(latest_comments_query(post_ids, limit, Comment)):
+            grouped[comment.post_id].append(comment)
+
+    for post in posts:
+        set_committed_value(post, "comments", grouped[post.id])
+
+
+async def attach_latest_comment_rows(posts, session: AsyncSession, limit: int):
+    """Row-dict counterpart of attach_latest_comments for the serialization fast path."""
+    post_ids = [post["id"] for post in posts]
+    grouped = defaultdict(list)
+    if post_ids and limit > 0:
+        query = latest_comments_query(post_ids, limit, *model_columns(Comment, CommentModel))
+        for comment in rows_as_dicts(await session.execute(query)):
+            grouped[comment["post_id"]].append(comment)
+
+    for post in posts:
+        post["comments"] = grouped[post["id"]]
+
+
+async def resource_etag(request, *tables):
+    """ETag for a read of `tables`, derived from their shared versions so checking it never touches the database."""
+    versions = await resource_versions.get(*tables)
+    if versions is None:
+        return None
+    digest = hashlib.sha256(f"{request.url.path}?{request.url.query}|{versions}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if etag is None or not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+async def stream_export(entity, schema, since, batch_size):
+    """Yield NDJSON batches from a server-side cursor, so memory stays flat whatever the table size.
+
+    Opens its own session: a streaming response outlives the request's dependencies.
+    """
+    query = select(*model_columns(entity, schema), entity.updated_at).order_by(entity.id)
+    if "status" in entity.__table__.columns:
+        query = query.where(entity.status == PUBLISHED)
+    if since is not None:
+        query = query.where(or_(entity.created_at >= since, entity.updated_at >= since))
+
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(query.execution_options(yield_per=batch_size))
+        async for rows in result.mappings().partitions():
+            yield encode_ndjson(rows)
+
+
+SEARCH_HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=20, MinWords=8, StartSel=<mark>, StopSel=</mark>"
+
+
+def search_query(terms, kinds, limit, offset):
+    """One ranked page of published posts and comments matching `terms` (websearch syntax), with snippets.
+
+    Only the newest SEARCH_MAX_CANDIDATES matches of each kind are ranked, so the work stays bounded however common
+    the terms are; ts_headline, which re-parses the text, only runs for the rows of the page.
+    """
+    config = cast(SEARCH_CONFIG, REGCONFIG)
+    tsquery = func.websearch_to_tsquery(config, terms)
+    matches = []
+    for kind, entity, post_id in (("post", Post, Post.id), ("comment", Comment, Comment.post_id)):
+        if kind not in kinds:
+            continue
+        matches.append(
+            select(literal(kind).label("kind"), entity.id, post_id.label("post_id"), entity.created_at,
+                   func.ts_rank(entity.search_vector, tsquery).label("rank"))
+            .where(entity.search_vector.bool_op("@@")(tsquery), entity.status == PUBLISHED)
+            .order_by(entity.created_at.desc()).limit(SEARCH_MAX_CANDIDATES)
+        )
+    ranked = union_all(*matches).subquery() if len(matches) > 1 else matches[0].subquery()
+    order = (ranked.c.rank.desc(), ranked.c.created_at.desc(), ranked.c.kind, ranked.c.id.desc())
+    page = select(ranked).order_by(*order).limit(limit).offset(offset).subquery()
+
+    order = (page.c.rank.desc(), page.c.created_at.desc(), page.c.kind, page.c.id.desc())
+    return select(
+        page.c.kind, page.c.id, page.c.post_id, Post.title, page.c.created_at, page.c.rank,
+        func.ts_headline(config, func.coalesce(Comment.content, Post.content), tsquery,
+                         SEARCH_HEADLINE_OPTIONS).label("snippet"),
+    ).join(Post, Post.id == page.c.post_id).outerjoin(
+        Comment, and_(page.c.kind == "comment", Comment.id == page.c.id, Comment.created_at == page.c.created_at)
+    ).order_by(*order)
+
+
+async def search_content(session: AsyncSession, terms, kinds, limit, offset):
+    """Run search_query under SEARCH_TIMEOUT_MS; a query cancelled by the timeout becomes a 503."""
+    await session.execute(text(f"SET LOCAL statement_timeout = {SEARCH_TIMEOUT_MS}"))
+    try:
+        return rows_as_dicts(await session.execute(search_query(terms, kinds, limit, offset)))
+    except DBAPIError as e:
+        if getattr(e.orig, "pgcode", None) != "57014":
+            raise
+        logging.warning(f"Search for {terms!r} cancelled after {SEARCH_TIMEOUT_MS} ms")
+        raise HTTPException(status_code=503, detail="Search took too long, try more specific terms")